@@ -238,7 +238,11 @@ def toggle_FaceCamera_process(self):
                               self.datafolder,
                               'FaceCamera', 0, 
                               {'frame_rate':\
-                                self.config['FaceCamera-frame-rate']}))
+                                self.config['FaceCamera-frame-rate'],
+                               'storage':\
+                                self.config['FaceCamera-storage']\
+                                  if 'FaceCamera-storage' in self.config\
+                                            else 'frames'}))
         self.FaceCamera_process.start()
         self.statusBar.showMessage(\
                 '[ok] FaceCamera initialized ! (in 5-6s) ')
@@ -267,7 +271,11 @@ def toggle_RigCamera_process(self):
                               self.datafolder,
                               'RigCamera', 1, 
                               {'frame_rate':\
-                                self.config['RigCamera-frame-rate']}))
+                                self.config['RigCamera-frame-rate'],
+                               'storage':\
+                                self.config['RigCamera-storage']\
+                                  if 'RigCamera-storage' in self.config\
+                                            else 'frames'}))
         self.RigCamera_process.start()
         self.statusBar.showMessage(\
                 '[ok] FaceCamera initialized ! (in 5-6s) ')
@@ -310,16 +318,17 @@ def run_update(self):
                   'protocol #%i, stim #%i' % (protocol_id+1, stim_index+1))
 
     # ----- online visualization here -----
-    if (self.FaceCamera_process is not None) and\
-                    (self.imgButton.currentText()=='FaceCamera'):
-        image = np.load(get_latest_file(\
-                os.path.join(str(self.datafolder.get()), 'FaceCamera-imgs')))
-        self.pCamImg.setImage(image.T)
-    elif (self.RigCamera_process is not None) and\
-                    (self.imgButton.currentText()=='RigCamera'):
-        image = np.load(get_latest_file(\
-                os.path.join(str(self.datafolder.get()), 'RigCamera-imgs')))
-        self.pCamImg.setImage(image.T)
+    for camera in ['FaceCamera', 'RigCamera']:
+        if (getattr(self, '%s_process' % camera) is not None) and\
+                        (self.imgButton.currentText()==camera):
+            preview = os.path.join(str(self.datafolder.get()), '%s-last.npy' % camera)
+            if os.path.isfile(preview):
+                # binary storage: last frame saved by the writer
+                image = np.load(preview)
+            else:
+                image = np.load(get_latest_file(\
+                    os.path.join(str(self.datafolder.get()), '%s-imgs' % camera)))
+            self.pCamImg.setImage(image.T)
 
     # ----- while loop with qttimer object ----- #
     if self.runEvent.is_set() and ((time.time()-self.t0)<self.max_time):
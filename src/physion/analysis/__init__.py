@@ -1,2 +1,3 @@
 from . import behavior, dataframe, process_NWB, read_NWB,\
-        stat_tools, summary_pdf, tools, trial_averaging, protocols
+        stat_tools, summary_pdf, tools, trial_averaging, protocols,\
+        index_NWB, cache
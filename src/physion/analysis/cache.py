@@ -0,0 +1,135 @@
+"""
+Memoization of the processing steps of the NWB data (dFoF, Deconvolved)
+
+results are stored in memory (with a least-recently-used eviction above
+    "max_bytes") and optionally on disk (one .npz file per result in "folder")
+
+the cache is opt-in (use_cache=True in Data.build_dFoF), the arrays are copied
+    when stored and when restored: the Data objects never share their arrays
+
+they are keyed on the file identity (path, modification time, size) and on
+    every processing parameter, so that a modified file or a different
+    parameter never returns a stale result
+
+usage:
+    from physion.analysis.cache import CACHE
+    CACHE.folder = '/path/to/cache/folder' # to also store on disk
+    CACHE.invalidate(filename) # to force the recomputation for a file
+    CACHE.clear()
+"""
+import os, hashlib, collections, glob
+import numpy as np
+
+
+def file_identity(filename):
+    """ (absolute path, modification time, size) of a file """
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+
+def hash_value(value):
+    """ a string representation for the cache key (arrays are hashed) """
+    if isinstance(value, np.ndarray):
+        return 'array-%s-%s-%s' % (value.dtype, value.shape,
+                    hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+    elif isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join([hash_value(v) for v in value])
+    else:
+        return repr(value)
+
+
+def copy_entry(entry):
+    return {k:(v.copy() if isinstance(v, np.ndarray) else v) for k, v in entry.items()}
+
+
+def entry_nbytes(entry):
+    return int(np.sum([getattr(v, 'nbytes', 0) for v in entry.values()]))
+
+
+class ProcessingCache:
+    """
+    least-recently-used cache of processing results
+
+    an entry is a dictionary of {attribute:value} to set on the Data object
+    """
+
+    def __init__(self, max_bytes=512e6, folder=None):
+
+        self.max_bytes, self.folder = max_bytes, folder
+        self.entries = collections.OrderedDict()
+
+    def key(self, filename, quantity, params):
+        """
+        builds the key from the file identity and the processing parameters
+            -> "<file-hash>-<quantity>-<parameters-hash>"
+        """
+        path, mtime, size = file_identity(filename)
+        file_hash = hashlib.sha1(path.encode()).hexdigest()[:16]
+        params_hash = hashlib.sha1(('%s-%s-%s' % (mtime, size,
+            ';'.join(['%s=%s' % (k, hash_value(params[k])) for k in sorted(params)]))).encode()).hexdigest()
+        return '%s-%s-%s' % (file_hash, quantity, params_hash)
+
+    def get(self, key):
+        """ returns a copy of the entry (None if not found) """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return copy_entry(self.entries[key])
+
+        elif (self.folder is not None) and\
+                os.path.isfile(os.path.join(self.folder, key+'.npz')):
+            with np.load(os.path.join(self.folder, key+'.npz')) as npz:
+                entry = {k:npz[k] for k in npz.files}
+            for k in entry:
+                if entry[k].ndim==0:
+                    entry[k] = entry[k][()]
+            self.set(key, entry, to_disk=False)
+            return copy_entry(entry)
+
+        return None
+
+    def set(self, key, entry, 
+            to_disk=True,
+            memory_only=[]):
+        """
+        stores a copy of the entry (the arrays of the caller stay its own)
+
+        memory_only: keys of the entry not written on disk
+        """
+        self.entries[key] = copy_entry(entry)
+        self.entries.move_to_end(key)
+
+        # LRU eviction (we keep at least the last entry)
+        while (len(self.entries)>1) and\
+                (np.sum([entry_nbytes(e) for e in self.entries.values()])>self.max_bytes):
+            self.entries.popitem(last=False)
+
+        if to_disk and (self.folder is not None):
+            os.makedirs(self.folder, exist_ok=True)
+            # only in-memory arrays and scalars are stored on disk
+            np.savez(os.path.join(self.folder, key+'.npz'),
+                     **{k:v for k, v in entry.items()\
+                            if isinstance(v, (np.ndarray, int, float, np.number))\
+                                    and (k not in memory_only)})
+
+    def invalidate(self, filename=None):
+        """
+        removes the entries of a given file (all entries if None)
+            in memory and on disk
+        """
+        if filename is None:
+            prefix = ''
+        else:
+            prefix = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16]
+
+        for key in [k for k in self.entries if k.startswith(prefix)]:
+            self.entries.pop(key)
+
+        if self.folder is not None:
+            for f in glob.glob(os.path.join(self.folder, prefix+'*.npz')):
+                os.remove(f)
+
+    def clear(self):
+        self.invalidate()
+
+
+CACHE = ProcessingCache()
@@ -13,6 +13,108 @@ def Normalize(x):
     else:
         return np.zeros(len(x)), mean, 0
 
+
+class ColumnsBuilder:
+    """
+    collects the columns of the dataframe to build it with one allocation
+        per data type (instead of one DataFrame insertion per column)
+
+    supports the part of the pandas.DataFrame interface used in this module:
+        builder[key] = array, builder[key], iteration over the keys,
+        metadata as attributes (dt, filename, ...)
+    """
+
+    def __init__(self, time,
+                 dtype=np.float64,
+                 view=False):
+        self._time, self._dtype, self._view = time, dtype, view
+        self._keys, self._columns, self._blocks = [], {}, []
+
+    def __setitem__(self, key, array):
+        if key not in self._columns:
+            self._keys.append(key)
+        self._columns[key] = np.asarray(array)
+
+    def __getitem__(self, key):
+        if key=='time':
+            return self._time
+        return self._columns[key]
+
+    def __iter__(self):
+        return iter(['time']+self._keys)
+
+    def keys(self):
+        return ['time']+self._keys
+
+    def add_normalized_block(self, keys, array, chunk_size=64):
+        """
+        the rows of "array" as Z-scored columns (see "Normalize"),
+            only referenced here, normalized when building the dataframe
+            (or kept as a view of "array" if "view")
+
+        returns the mean and std of each row
+        """
+        mean, std = np.empty(len(keys)), np.empty(len(keys))
+        for i in range(0, len(keys), chunk_size):
+            # by chunks of rows, to limit the temporary arrays
+            mean[i:i+chunk_size] = np.mean(array[i:i+chunk_size], axis=1)
+            std[i:i+chunk_size] = np.std(array[i:i+chunk_size], axis=1)
+        self._blocks.append((list(keys), array, mean, std))
+        self._keys += list(keys)
+        for key in keys:
+            self._columns[key] = None
+        return mean, std
+
+    def to_dataframe(self, chunk_size=64):
+
+        BLOCK_KEYS = [key for block in self._blocks for key in block[0]]
+        BOOLS = [key for key in self._keys\
+                    if (self._columns[key] is not None) and\
+                            (self._columns[key].dtype==bool)]
+        FLOATS = [key for key in self._keys\
+                    if (key not in BOOLS) and\
+                        not (self._view and (key in BLOCK_KEYS))]
+
+        FRAMES = [pandas.DataFrame({'time':self._time})]
+
+        if self._view:
+            # zero-copy: the (not normalized) arrays as DataFrame blocks
+            for keys, array, _, _ in self._blocks:
+                FRAMES.append(pandas.DataFrame(array.T, columns=keys, copy=False))
+
+        # one allocation for all the float columns
+        values = np.empty((len(FLOATS), len(self._time)), dtype=self._dtype)
+        index = {key:i for i, key in enumerate(FLOATS)}
+        for keys, array, mean, std in ([] if self._view else self._blocks):
+            i0 = index[keys[0]]
+            for i in range(0, len(keys), chunk_size):
+                rows = slice(i, min([i+chunk_size, len(keys)]))
+                normalized = array[rows]-mean[rows,np.newaxis]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    normalized /= std[rows,np.newaxis]
+                normalized[std[rows]==0,:] = 0
+                values[i0+rows.start:i0+rows.stop] = normalized
+        for key in FLOATS:
+            if self._columns[key] is not None:
+                values[index[key]] = self._columns[key]
+        FRAMES.append(pandas.DataFrame(values.T, columns=FLOATS, copy=False))
+
+        # one allocation for all the boolean columns
+        flags = np.empty((len(BOOLS), len(self._time)), dtype=bool)
+        for i, key in enumerate(BOOLS):
+            flags[i] = self._columns[key]
+        FRAMES.append(pandas.DataFrame(flags.T, columns=BOOLS, copy=False))
+
+        dataframe = pandas.concat(FRAMES, axis=1)
+
+        # metadata
+        for key, value in vars(self).items():
+            if not key.startswith('_'):
+                setattr(dataframe, key, value)
+
+        return dataframe
+
+
 def NWB_to_dataframe(nwbfile,
                      # behavior features:
                      add_shifted_behavior_features=False,
@@ -26,11 +128,22 @@ def NWB_to_dataframe(nwbfile,
                      #
                      time_sampling_reference='dFoF',
                      subsampling=None,
+                     columnar=True,
+                     dtype=np.float64,
+                     view=False,
                      verbose=True):
     """
         builds a pandas.DataFrame from a nwbfile 
             with a given time sampling reference
 
+    * nwbfile: a filename or a "read_NWB.Data" object
+
+    * columnar: all columns are built in one allocation per data type
+            (otherwise: one DataFrame insertion per column)
+        dtype: of the float columns (except the time)
+        view: the dFoF columns are a view of "data.dFoF" (no copy),
+            hence not normalized (and of the dtype of "data.dFoF")
+
     * visual stimulation features can be labelled either:
         - "" 
         - "per-protocol"
@@ -45,7 +158,10 @@ def NWB_to_dataframe(nwbfile,
         normalized (Z-scored) over the whole time trace
 
     """
-    data = read_NWB.Data(nwbfile, verbose=verbose)
+    if isinstance(nwbfile, read_NWB.Data):
+        data = nwbfile
+    else:
+        data = read_NWB.Data(nwbfile, verbose=verbose)
 
     if subsampling is None:
         subsampling = 1
@@ -57,9 +173,12 @@ def NWB_to_dataframe(nwbfile,
         print('taking running speed by default')
         time = data.t_running_speed[::subsampling]
 
-    dataframe = pandas.DataFrame({'time':time})
+    if columnar:
+        dataframe = ColumnsBuilder(time, dtype=dtype, view=view)
+    else:
+        dataframe = pandas.DataFrame({'time':time})
     dataframe.dt = time[1]-time[0] # store the time step in the metadata
-    dataframe.filename = os.path.basename(nwbfile) # keep filename
+    dataframe.filename = os.path.basename(data.filename) # keep filename
 
     # - - - - - - - - - - - - - - - - - - #
     #       --- neural activity ---       #
@@ -74,13 +193,23 @@ def NWB_to_dataframe(nwbfile,
 
         dataframe.nROIs = data.nROIs
 
-        for i in range(data.nROIs):
+        if columnar:
 
-            dFoF = data.dFoF[i,:]
-            dFoF, dFoF_mean, dFoF_std = Normalize(dFoF)
-            setattr(data, 'dFoF_ROI%i_mean' % i, dFoF_mean)
-            setattr(data, 'dFoF_ROI%i_std' % i, dFoF_std)
-            dataframe['dFoF-ROI%i'%i] = dFoF
+            MEAN, STD = dataframe.add_normalized_block(\
+                    ['dFoF-ROI%i'%i for i in range(data.nROIs)], data.dFoF[:data.nROIs])
+            for i in range(data.nROIs):
+                setattr(data, 'dFoF_ROI%i_mean' % i, MEAN[i])
+                setattr(data, 'dFoF_ROI%i_std' % i, STD[i])
+
+        else:
+
+            for i in range(data.nROIs):
+
+                dFoF = data.dFoF[i,:]
+                dFoF, dFoF_mean, dFoF_std = Normalize(dFoF)
+                setattr(data, 'dFoF_ROI%i_mean' % i, dFoF_mean)
+                setattr(data, 'dFoF_ROI%i_std' % i, dFoF_std)
+                dataframe['dFoF-ROI%i'%i] = dFoF
 
     # - - - - - - - - - - - - - - - - - - #
     # --- behavioral characterization --- #
@@ -190,9 +319,10 @@ def NWB_to_dataframe(nwbfile,
 
         if (protocol not in exclude_from_stim):
 
-            episodes = process_NWB.EpisodeData(data, 
-                                               protocol_id=p,
-                                               verbose=verbose)
+            if 'parameters' in visual_stim_features:
+                episodes = process_NWB.EpisodeData(data, 
+                                                   protocol_id=p,
+                                                   verbose=verbose)
 
             protocol_cond = data.get_protocol_cond(p)
 
@@ -322,6 +452,9 @@ def NWB_to_dataframe(nwbfile,
             visualStimFlag = visualStimFlag | dataframe[key]
     dataframe['visualStimFlag'] = visualStimFlag
 
+    if columnar:
+        dataframe = dataframe.to_dataframe()
+
     return dataframe
 
 
@@ -362,14 +495,14 @@ def build_timelag_set_of_behavior_arrays(data, DF, array,
     for j, shift in enumerate(bhv_index_shifts):
 
         # initialize:
-        DF['%s__%i' % (behav_key, j)] = np.zeros(len(DF['time']))
+        shifted = np.zeros(len(DF['time']))
 
         istart = np.max([0, shift]) 
         iend = np.min([len(DF['time']), len(DF['time'])+shift])
 
         # fill with values:
-        DF['%s__%i' % (behav_key, j)][istart:iend] = \
-                array[istart-shift:iend-shift]
+        shifted[istart:iend] = array[istart-shift:iend-shift]
+        DF['%s__%i' % (behav_key, j)] = shifted
 
 
 def build_timelag_set_of_stim_specific_arrays(data, DF, index_cond, 
@@ -386,8 +519,8 @@ def build_timelag_set_of_stim_specific_arrays(data, DF, index_cond,
 
 
     # set of timelag binary arrays
-    for j in np.arange(-Nframe_pre, Nframe_stim+Nframe_post+1):
-        DF['%s__%i' % (stim_name, j)] = np.zeros(len(DF['time']), dtype=bool)
+    LAGS = np.arange(-Nframe_pre, Nframe_stim+Nframe_post+1)
+    ARRAYS = np.zeros((len(LAGS), len(DF['time'])), dtype=bool)
 
     # looping over all repeats of this index
     for i in np.flatnonzero(index_cond):
@@ -398,8 +531,11 @@ def build_timelag_set_of_stim_specific_arrays(data, DF, index_cond,
 
             iT0 = np.argmin((DF['time']-tstart)**2)
            
-            for j in np.arange(-Nframe_pre, Nframe_stim+Nframe_post+1):
-                DF.loc[iT0+j, '%s__%i' % (stim_name, j)] = True
+            cond = ((iT0+LAGS)>=0) & ((iT0+LAGS)<len(DF['time']))
+            ARRAYS[np.flatnonzero(cond), (iT0+LAGS)[cond]] = True
+
+    for j, array in zip(LAGS, ARRAYS):
+        DF['%s__%i' % (stim_name, j)] = array
 
     # normalize if needed
     # TO BE FIXED
@@ -0,0 +1,213 @@
+"""
+Persistent metadata index of the NWB files of a data folder
+
+the metadata (subject, protocols, age, date) of each file are stored in a
+    SQLite sidecar file at the root of the data folder, together with
+    the file modification time and size, so that:
+    - only new or modified files are re-read (in parallel) on update
+    - queries by protocol, subject or age do not open any NWB file
+
+usage:
+    python -m physion.analysis.index_NWB /path/to/datafolder
+"""
+import os, sys, time, sqlite3, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from physion.utils.files import get_files_with_extension
+
+INDEX_FILENAME = '.physion-NWB-index.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY, -- relative to the data folder
+    mtime REAL,
+    size INTEGER,
+    subject TEXT,
+    age INTEGER,
+    date TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS protocols (
+    filename TEXT,
+    protocol_id INTEGER,
+    protocol TEXT
+);
+CREATE INDEX IF NOT EXISTS protocols_index ON protocols (protocol);
+CREATE INDEX IF NOT EXISTS subject_index ON files (subject);
+CREATE INDEX IF NOT EXISTS age_index ON files (age);
+"""
+
+
+def is_intrinsic_imaging_file(filename):
+    return (('left-' in filename) or ('down-' in filename) or\
+            ('right-' in filename) or ('up-' in filename))
+
+
+def read_metadata(filename):
+    """
+    reads the metadata of a single NWB file (run in the worker processes)
+
+    returns a dictionary (with the "error" key set if the file could not be read)
+    """
+    # import here to keep the worker processes light at startup
+    from physion.analysis.read_NWB import Data
+
+    metadata = {'filename':filename,
+                'date':filename.split(os.path.sep)[-1].split('-')[0],
+                'subject':'N/A', 'age':-1, 'protocols':[], 'error':None}
+    try:
+        data = Data(filename, metadata_only=True, verbose=False)
+        metadata['subject'] = str(data.nwbfile.subject.subject_id)
+        metadata['age'] = int(data.age)
+        metadata['protocols'] = [str(p) for p in data.protocols]
+    except BaseException as be:
+        metadata['error'] = str(be)
+
+    return metadata
+
+
+def open_index(folder):
+    """
+    opens (and creates if needed) the index of the data folder
+    """
+    db = sqlite3.connect(os.path.join(folder, INDEX_FILENAME))
+    db.executescript(SCHEMA)
+    return db
+
+
+def update_index(folder,
+                 exclude_intrinsic_imaging_files=True,
+                 nproc=None,
+                 verbose=True):
+    """
+    updates the index of the data folder:
+        - new or modified files (mtime/size) are read in a process pool
+        - deleted files are removed from the index
+
+    nproc: number of processes (default: all cpus but one)
+
+    returns the number of (re-)read files
+    """
+    if verbose:
+        print('updating the NWB index of "%s" [...]' % folder)
+        t0 = time.time()
+
+    FILES = get_files_with_extension(folder, extension='.nwb', recursive=True)
+    if exclude_intrinsic_imaging_files:
+        FILES = [f for f in FILES if not is_intrinsic_imaging_file(f)]
+
+    STATS = {os.path.relpath(f, folder):os.stat(f) for f in FILES}
+
+    db = open_index(folder)
+    INDEXED = {f:(mtime, size) for f, mtime, size in\
+                    db.execute('SELECT filename, mtime, size FROM files')}
+
+    to_read = [f for f in STATS if (f not in INDEXED) or\
+                    (INDEXED[f]!=(STATS[f].st_mtime, STATS[f].st_size))]
+    removed = [f for f in INDEXED if f not in STATS]
+
+    if nproc is None:
+        nproc = max([1, multiprocessing.cpu_count()-1]) # leaving 1 cpu for the rest
+
+    filenames = [os.path.join(folder, f) for f in to_read]
+    if (nproc>1) and (len(filenames)>1):
+        # "spawn" for fresh HDF5 states in the workers (fork can deadlock h5py)
+        with ProcessPoolExecutor(max_workers=min([nproc, len(filenames)]),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            METADATA = list(pool.map(read_metadata, filenames))
+    else:
+        METADATA = [read_metadata(f) for f in filenames]
+
+    with db:
+        for f in to_read+removed:
+            db.execute('DELETE FROM files WHERE filename=?', (f,))
+            db.execute('DELETE FROM protocols WHERE filename=?', (f,))
+        for f, metadata in zip(to_read, METADATA):
+            db.execute('INSERT INTO files VALUES (?,?,?,?,?,?,?)',
+                       (f, STATS[f].st_mtime, STATS[f].st_size,
+                        metadata['subject'], metadata['age'],
+                        metadata['date'], metadata['error']))
+            db.executemany('INSERT INTO protocols VALUES (?,?,?)',
+                           [(f, i, p) for i, p in enumerate(metadata['protocols'])])
+            if verbose and (metadata['error'] is not None):
+                print(metadata['error'])
+                print('\n [!!] Pb with "%s" \n' % metadata['filename'])
+    db.close()
+
+    if verbose:
+        print(' -> n=%i new/modified datafiles, n=%i removed (in %.1fs) ' % (\
+                len(to_read), len(removed), (time.time()-t0)))
+
+    return len(to_read)
+
+
+def query_index(folder,
+                for_protocols=[],
+                subject=None,
+                age_range=None,
+                filenames=None):
+    """
+    finds the datafiles in the index (without reading the NWB files)
+
+    - for_protocols: list of protocol names, a file is included
+                                    if it has at least one of them
+    - subject: subject ID
+    - age_range: [min, max] (included)
+    - filenames: restricts the query to these files (paths in the folder)
+
+    the sessions are ordered by filename
+
+    returns a list of dictionaries with keys:
+        filename, date, subject, age, protocols, protocol_ids
+    """
+    db = open_index(folder)
+
+    conditions, args = ['error IS NULL'], []
+    if subject is not None:
+        conditions.append('subject=?')
+        args.append(subject)
+    if age_range is not None:
+        conditions.append('age BETWEEN ? AND ?')
+        args += list(age_range)
+    if len(for_protocols)>0:
+        conditions.append('filename IN (SELECT filename FROM protocols WHERE protocol IN (%s))' %\
+                                ','.join(['?' for p in for_protocols]))
+        args += list(for_protocols)
+
+    if filenames is not None:
+        filenames = set([os.path.relpath(f, folder) for f in filenames])
+
+    SESSIONS = []
+    for f, date, subject, age in db.execute(\
+            'SELECT filename, date, subject, age FROM files WHERE %s ORDER BY filename' %\
+                        ' AND '.join(conditions), args).fetchall():
+        if (filenames is not None) and (f not in filenames):
+            continue
+        protocols = [p for p, in db.execute(\
+            'SELECT protocol FROM protocols WHERE filename=? ORDER BY protocol_id', (f,))]
+        if len(for_protocols)>0:
+            # as in scan_folder_for_NWBfiles, only protocols present once
+            protocol_ids = [protocols.index(p) for p in for_protocols\
+                                        if protocols.count(p)==1]
+            if len(protocol_ids)==0:
+                continue
+            protocols = [protocols[i] for i in protocol_ids]
+        else:
+            protocol_ids = range(len(protocols))
+            protocols = np.array(protocols, dtype=str)
+        SESSIONS.append({'filename':os.path.join(folder, f),
+                         'date':date, 'subject':subject, 'age':age,
+                         'protocols':protocols,
+                         'protocol_ids':protocol_ids})
+    db.close()
+
+    return SESSIONS
+
+
+if __name__=='__main__':
+
+    update_index(sys.argv[-1])
+    for session in query_index(sys.argv[-1]):
+        print(session['filename'], session['subject'], session['protocols'])
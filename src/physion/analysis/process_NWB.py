@@ -7,6 +7,104 @@ from scipy.interpolate import interp1d
 from physion.analysis import stat_tools
 from physion.visual_stim.build import build_stim
 
+
+def episode_window(tfull, tstart, tstop, prestim_duration):
+    """
+    slice of the (sorted) time array "tfull" surrounding an episode,
+
+    equivalent to the boolean condition:
+        (tfull>=(tstart-2.*prestim_duration)) & (tfull<(tstop+1.5*prestim_duration))
+    but found by bisection (no full-length temporary array)
+    """
+    return slice(np.searchsorted(tfull, tstart-2.*prestim_duration, side='left'),
+                 np.searchsorted(tfull, tstop+1.5*prestim_duration, side='left'))
+
+
+def interpolate_episode(x, y, x_new,
+                        bounds_error=True,
+                        out=None):
+    """
+    linear interpolation of "y" (last axis is time) on "x_new"
+
+    the interpolation indices are computed once and applied to 
+        all rows of y (e.g. ROIs) in a single gather,
+    results are identical to one interp1d(kind='linear') per row
+        (that delegates to np.interp for float64 data)
+
+    - bounds_error=True -> raises a ValueError if x_new out of range
+    - bounds_error=False -> values outside the range are set to 
+                        the first/last sample of each row
+    """
+    if len(x)<2:
+        raise ValueError('x and y arrays must have at least 2 entries')
+
+    below, above = (x_new<x[0]), (x_new>x[-1])
+    if bounds_error and (np.any(below) or np.any(above)):
+        raise ValueError('A value in x_new is out of the interpolation range.')
+
+    y = np.asarray(y)
+    if not np.issubdtype(y.dtype, np.inexact):
+        y = y.astype(np.float64) # as in interp1d
+
+    if y.dtype==np.float64:
+        # np.interp conventions
+        lo = np.clip(np.searchsorted(x, x_new, side='right')-1, 0, len(x)-2)
+    else:
+        # interp1d._call_linear conventions
+        lo = np.clip(np.searchsorted(x, x_new, side='left'), 1, len(x)-1)-1
+    hi = lo+1
+
+    y_lo, y_hi = y[..., lo], y[..., hi]
+    # slope = (y_hi - y_lo) / (x_hi - x_lo) ; y_new = slope*(x_new - x_lo) + y_lo
+    y_new = (y_hi-y_lo)/(x[hi]-x[lo])
+    np.multiply(y_new, (x_new-x[lo]), out=y_new)
+    if out is None:
+        out = y_new
+    np.add(y_new, y_lo, out=out)
+
+    if y.dtype==np.float64:
+        # samples on the grid are taken as is
+        on_grid = (x_new==x[lo])
+        out[..., on_grid] = y_lo[..., on_grid]
+        out[..., x_new==x[-1]] = y[..., -1:]
+        # if we get nan in one direction, try the other
+        nan = np.isnan(out)
+        if np.any(nan):
+            slope = (y_hi-y_lo)/(x[hi]-x[lo])
+            out[nan] = (slope*(x_new-x[hi])+y_hi)[nan]
+            flat = np.isnan(out) & (y_lo==y_hi)
+            out[flat] = y_lo[flat]
+
+    if not bounds_error:
+        out[..., below] = y[..., :1]
+        out[..., above] = y[..., -1:]
+
+    return out
+
+
+def interpolate_episode_loop(x, y, x_new,
+                             interpolation='linear',
+                             bounds_error=True):
+    """
+    the non-vectorized version of "interpolate_episode"
+
+    one interp1d per row, kept for arbitrary "interpolation" kinds
+        (and as a reference, see tests/analysis/episodes.py)
+    """
+    if len(y.shape)>1:
+        # multi-dimensional response, e.g. dFoF = (rois, time)
+        resp = np.zeros((y.shape[0], len(x_new)))
+        for j in range(y.shape[0]):
+            func = interp1d(x, y[j,:],
+                            kind=interpolation, bounds_error=False,
+                            fill_value=(y[j,:][0], y[j,:][-1]))
+            resp[j, :] = func(x_new)
+        return resp
+    else:
+        func = interp1d(x, y, kind=interpolation)
+        return func(x_new)
+
+
 class EpisodeData:
     """
     Object to Analyze Responses to several Episodes
@@ -39,6 +137,7 @@ class EpisodeData:
                  prestim_duration=None, # to force the prestim window otherwise, half the value in between episodes
                  dt_sampling=1, # ms
                  interpolation='linear',
+                 vectorized=True,
                  with_visual_stim=False,
                  tfull=None,
                  verbose=True):
@@ -64,6 +163,7 @@ class EpisodeData:
                             prestim_duration=prestim_duration,
                             dt_sampling=dt_sampling,
                             interpolation=interpolation,
+                            vectorized=vectorized,
                             tfull=tfull)
 
         ################################################i
@@ -128,6 +228,7 @@ class EpisodeData:
                        prestim_duration=None,
                        dt_sampling=1, # ms
                        interpolation='linear',
+                       vectorized=True,
                        tfull=None):
        
         """
@@ -138,6 +239,10 @@ class EpisodeData:
         Sets self.index_from_start (the first indexes where the protocol condition is satified = when protocol starts)
         Sets self.quantities  as a list of str 
 
+        vectorized=True (only for interpolation='linear'), interpolation 
+            indices are computed once per episode and time axis and applied
+            to all ROIs at once (see "interpolate_episode"),
+            otherwise one interp1d per ROI and per episode
         """
         if quantities_args is None:
             quantities_args = [{} for q in quantities]
@@ -271,10 +376,16 @@ class EpisodeData:
         for key in full_data.nwbfile.stimulus.keys():
             setattr(self, key, [])
 
-        for q in QUANTITIES:
-            setattr(self, q, [])
+        vectorized = vectorized and (interpolation=='linear')
+
+        episodes = np.arange(full_data.nwbfile.stimulus['time_start'].num_samples)[self.protocol_cond_in_full_data]
 
-        for iEp in np.arange(full_data.nwbfile.stimulus['time_start'].num_samples)[self.protocol_cond_in_full_data]:
+        # responses are stored in preallocated arrays (Nepisodes, [Nrois,] Nt)
+        RESPONSES = [np.zeros((len(episodes),)+np.shape(valfull)[:-1]+(len(self.t),))\
+                            for valfull in QUANTITY_VALUES]
+        iSuccess = 0
+
+        for iEp in episodes:
 
             tstart = full_data.nwbfile.stimulus['time_start_realigned'].data[iEp,0]
             tstop = full_data.nwbfile.stimulus['time_stop_realigned'].data[iEp,0]
@@ -282,26 +393,22 @@ class EpisodeData:
             # print(iEp, tstart, tstop)
             # print(full_data.nwbfile.stimulus['patch-delay'].data[iEp])
 
-            RESPS, success = [], True
-            for quantity, tfull, valfull in zip(QUANTITIES, QUANTITY_TIMES, QUANTITY_VALUES):
+            success = True
+            for quantity, tfull, valfull, response in zip(QUANTITIES, QUANTITY_TIMES, 
+                                                          QUANTITY_VALUES, RESPONSES):
 
                 # compute time and interpolate
-                ep_cond = (tfull>=(tstart-2.*prestim_duration)) & (tfull<(tstop+1.5*prestim_duration)) # higher range of interpolation to avoid boundary problems
+                ep_window = episode_window(tfull, tstart, tstop, prestim_duration) # higher range of interpolation to avoid boundary problems
                 try:
-                    if (len(valfull.shape)>1):
-                        # multi-dimensional response, e.g. dFoF = (rois, time)
-                        resp = np.zeros((valfull.shape[0], len(self.t)))
-                        for j in range(valfull.shape[0]):
-                            func = interp1d(tfull[ep_cond]-tstart, valfull[j,ep_cond],
-                                            kind=interpolation, bounds_error=False,
-                                            fill_value=(valfull[j,ep_cond][0], valfull[j,ep_cond][-1]))
-                            resp[j, :] = func(self.t)
-                        RESPS.append(resp)
-
+                    if vectorized:
+                        interpolate_episode(tfull[ep_window]-tstart, valfull[..., ep_window], self.t,
+                                            bounds_error=(len(valfull.shape)==1),
+                                            out=response[iSuccess])
                     else:
-                        func = interp1d(tfull[ep_cond]-tstart, valfull[ep_cond],
-                                        kind=interpolation)
-                        RESPS.append(func(self.t))
+                        response[iSuccess] = interpolate_episode_loop(tfull[ep_window]-tstart, 
+                                                                      valfull[..., ep_window], self.t,
+                                                                      interpolation=interpolation,
+                                                                      bounds_error=(len(valfull.shape)==1))
 
                 except BaseException as be:
 
@@ -309,16 +416,16 @@ class EpisodeData:
                     if self.verbose:
                         print('----')
                         print(be)
-                        # print(tfull[ep_cond][0]-tstart, tfull[ep_cond][-1]-tstart, tstop-tstart)
+                        # print(tfull[ep_window][0]-tstart, tfull[ep_window][-1]-tstart, tstop-tstart)
                         print(quantity)
                         print('Problem with episode %i between (%.2f, %.2f)s' % (iEp, tstart, tstop))
+                    break
 
 
             if success:
 
                 # only succesful episodes in all modalities
-                for quantity, response in zip(QUANTITIES, RESPS):
-                    getattr(self, quantity).append(response)
+                iSuccess += 1
                 for key in full_data.nwbfile.stimulus.keys():
                     try:
                         getattr(self, key).append(full_data.nwbfile.stimulus[key].data[iEp,0])
@@ -329,8 +436,10 @@ class EpisodeData:
         for key in full_data.nwbfile.stimulus.keys():
             setattr(self, key, np.array(getattr(self, key)))
 
-        for q in QUANTITIES:
-            setattr(self, q, np.array(getattr(self, q)))
+        for q, response in zip(QUANTITIES, RESPONSES):
+            if iSuccess<len(episodes):
+                response = response[:iSuccess].copy()
+            setattr(self, q, response)
 
         self.quantities = QUANTITIES
 
@@ -6,11 +6,159 @@ from scipy.interpolate import interp1d
 from physion.utils.files import get_files_with_extension
 from physion.visual_stim.build import build_stim
 from physion.analysis import tools
+from physion.analysis.cache import CACHE
+from physion.analysis.index_NWB import update_index, query_index,\
+        is_intrinsic_imaging_file
 from physion.imaging.Calcium import compute_dFoF,\
         ROI_TO_NEUROPIL_INCLUSION_FACTOR, METHOD,\
         T_SLIDING, PERCENTILE, NEUROPIL_CORRECTION_FACTOR, ROI_TO_NEUROPIL_INCLUSION_FACTOR_METRIC
 from physion.imaging.dcnv import oasis
 
+class LazyROIArray:
+    """
+    a (nROIs, time_samples) array-like view on the (h5py) dataset
+        of a RoiResponseSeries (Fluorescence, Neuropil) 
+
+    nothing is loaded at creation, slicing (by ROI or by time window)
+        only reads the needed HDF5 chunks, e.g.:
+        - F[:, i1:i2] -> all ROIs in a time window
+        - F[roiIndices, :] -> some ROIs over the full recording
+        (index arrays on both axes are applied independently, as in h5py)
+
+    the dataset can be stored as (time_samples, nROIs) 
+        (pynwb orientation), this is handled with "transposed=True"
+    """
+
+    memory_budget = 256e6 # bytes, size of the ROI blocks (see "roi_blocks")
+
+    def __init__(self, dataset, 
+                 transposed=False,
+                 roiIndices=None):
+
+        self.dataset, self.transposed = dataset, transposed
+        shape = dataset.shape[::-1] if transposed else dataset.shape
+
+        if roiIndices is None:
+            self.roiIndices = np.arange(shape[0])
+        else:
+            self.roiIndices = np.asarray(roiIndices)
+
+        self.shape = (len(self.roiIndices), shape[1])
+        self.dtype = dataset.dtype
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self[:,:]
+        else:
+            return self[:,:].astype(dtype)
+
+    def __getitem__(self, key):
+
+        if type(key) is not tuple:
+            key = (key,)
+        if key[0] is Ellipsis:
+            key = (slice(None),)+key[1:]
+        elif len(key)>1 and (key[1] is Ellipsis):
+            key = key[:1]
+        key = key+(slice(None),)*(2-len(key))
+        roi_key, time_key = key
+
+        # ROI axis -> increasing indices in the dataset
+        rois = self.roiIndices[roi_key]
+        single_roi = (np.ndim(rois)==0)
+        rois = np.atleast_1d(rois)
+        if (len(rois)>0) and np.all(np.diff(rois)==1):
+            roi_sel, roi_order = slice(rois[0], rois[-1]+1), None
+        else:
+            roi_sel, roi_order = np.unique(rois, return_inverse=True)
+
+        # time axis -> a slice (bounding window if fancy index)
+        single_time, time_index = False, None
+        if isinstance(time_key, slice):
+            start, stop, step = time_key.indices(self.shape[1])
+            if step>0:
+                time_sel = slice(start, max([start,stop]), step)
+            else:
+                time_key = np.arange(start, stop, step)
+        elif np.ndim(time_key)==0:
+            single_time = True
+            time_key = np.arange(self.shape[1])[time_key]
+            time_sel = slice(time_key, time_key+1)
+        if not isinstance(time_key, slice) and not single_time:
+            time_index = np.arange(self.shape[1])[time_key]
+            if len(time_index)>0:
+                time_sel = slice(time_index.min(), time_index.max()+1)
+                time_index = time_index-time_sel.start
+            else:
+                time_sel = slice(0, 0)
+
+        if (len(rois)==0) or (time_sel.start==time_sel.stop):
+            block = np.zeros((len(rois), len(range(*time_sel.indices(self.shape[1])))),
+                             dtype=self.dtype)
+        elif self.transposed:
+            block = self.dataset[time_sel, roi_sel].T
+        else:
+            block = self.dataset[roi_sel, time_sel]
+
+        if roi_order is not None:
+            block = block[roi_order,:]
+        if time_index is not None:
+            block = block[:,time_index]
+        if single_time:
+            block = block[:,0]
+        if single_roi:
+            block = block[0]
+
+        return block
+
+    def roi_subset(self, roiIndices):
+        """
+        a new (still lazy) array restricted to some ROIs
+        """
+        return LazyROIArray(self.dataset,
+                            transposed=self.transposed,
+                            roiIndices=self.roiIndices[roiIndices])
+
+    @property
+    def block_size(self):
+        """
+        number of ROIs per block fitting in the memory budget (in float64),
+            a multiple of the HDF5 chunk size along the ROI axis if any
+        """
+        n = max([1, int(self.memory_budget/8/max([1,self.shape[1]]))])
+        chunks = getattr(self.dataset, 'chunks', None)
+        if chunks is not None:
+            nchunk = chunks[1] if self.transposed else chunks[0]
+            n = max([nchunk, nchunk*(n//nchunk)])
+        return n
+
+    def roi_blocks(self):
+        """
+        slices over the ROI axis to loop over the data with bounded memory
+        """
+        return [slice(i, min([i+self.block_size, self.shape[0]]))\
+                    for i in range(0, self.shape[0], self.block_size)]
+
+    def sum(self, axis=None):
+        if axis in [1, -1]:
+            return np.concatenate([self[rois,:].sum(axis=1)\
+                                        for rois in self.roi_blocks()])
+        S = np.sum([self[rois,:].sum(axis=0) for rois in self.roi_blocks()], axis=0)
+        return S if axis==0 else np.sum(S)
+
+    def mean(self, axis=None):
+        if axis in [1, -1]:
+            return self.sum(axis=1)/self.shape[1]
+        elif axis==0:
+            return self.sum(axis=0)/self.shape[0]
+        else:
+            return self.sum()/self.shape[0]/self.shape[1]
+
+
 class Data:
     
     """
@@ -22,11 +170,19 @@ class Data:
                  with_tlim=True,
                  metadata_only=False,
                  with_visual_stim=False,
+                 lazy=False,
                  verbose=False):
+        """
+        lazy=True -> the ROI fluorescence data (rawFluo, neuropil) are not
+                loaded in memory but read on demand from the file
+                (see LazyROIArray), the file stays open (see "close")
+        """
 
         self.filename = filename.split(os.path.sep)[-1]
+        self.filepath = filename
         self.tlim, self.visual_stim, self.nwbfile = None, None, None
         self.metadata, self.df_name = None, ''
+        self.lazy = lazy
         
         if verbose:
             t0 = time.time()
@@ -407,14 +563,45 @@ class Data:
                    with_computed_neuropil_fact=False,
                    roi_to_neuropil_fluo_inclusion_factor_metric=\
                     ROI_TO_NEUROPIL_INCLUSION_FACTOR_METRIC,
+                   use_cache=False,
                    verbose=True):
         """
         creates self.dFoF, self.t_dFoF
 
         [!!] we always rebuild the rawFluo and neuropil 
                 to remove the potential valid_roiIndices previous filters
+
+        use_cache=True -> the result is memoized for the file and 
+                this set of parameters (see analysis.cache),
+                rawFluo and neuropil are not cached (re-read from the file)
         """
 
+        self.dFoF_cache_key = None
+        if use_cache:
+            key = CACHE.key(self.filepath, 'dFoF',
+                dict(roi_to_neuropil_fluo_inclusion_factor=roi_to_neuropil_fluo_inclusion_factor,
+                     neuropil_correction_factor=neuropil_correction_factor,
+                     method_for_F0=method_for_F0,
+                     percentile=percentile,
+                     sliding_window=sliding_window,
+                     with_correctedFluo_and_F0=with_correctedFluo_and_F0,
+                     specific_time_sampling=specific_time_sampling,
+                     smoothing=smoothing,
+                     interpolation=interpolation,
+                     with_computed_neuropil_fact=with_computed_neuropil_fact,
+                     roi_to_neuropil_fluo_inclusion_factor_metric=\
+                             roi_to_neuropil_fluo_inclusion_factor_metric))
+            entry = CACHE.get(key)
+            if entry is not None:
+                self.restore_dFoF(entry,
+                                  specific_time_sampling=specific_time_sampling,
+                                  interpolation=interpolation,
+                                  verbose=verbose)
+                self.dFoF_cache_key = key
+                if verbose:
+                    print('-> dFoF restored from cache')
+                return
+
         self.build_rawFluo(specific_time_sampling=specific_time_sampling,
                            interpolation=interpolation,
                            verbose=verbose)
@@ -423,21 +610,61 @@ class Data:
                             verbose=verbose)
         self.t_dFoF = self.t_rawFluo
 
-        return compute_dFoF(self,
-                            roi_to_neuropil_fluo_inclusion_factor=\
+        compute_dFoF(self,
+                     roi_to_neuropil_fluo_inclusion_factor=\
                                     roi_to_neuropil_fluo_inclusion_factor,
-                            neuropil_correction_factor=\
+                     neuropil_correction_factor=\
                                     neuropil_correction_factor,
-                            method_for_F0=method_for_F0,
-                            percentile=percentile,
-                            sliding_window=sliding_window,
-                            with_correctedFluo_and_F0=\
+                     method_for_F0=method_for_F0,
+                     percentile=percentile,
+                     sliding_window=sliding_window,
+                     with_correctedFluo_and_F0=\
                                     with_correctedFluo_and_F0,
-                            smoothing=smoothing,
-                            with_computed_neuropil_fact=with_computed_neuropil_fact,
-                            roi_to_neuropil_fluo_inclusion_factor_metric=\
+                     smoothing=smoothing,
+                     with_computed_neuropil_fact=with_computed_neuropil_fact,
+                     roi_to_neuropil_fluo_inclusion_factor_metric=\
                                     roi_to_neuropil_fluo_inclusion_factor_metric,
-                            verbose=verbose)
+                     verbose=verbose)
+
+        if use_cache:
+            entry = {}
+            for k in ['dFoF', 't_dFoF', 'valid_roiIndices', 'neuropil_correction_factor',
+                      'correctedFluo', 'correctedFluo0']:
+                if hasattr(self, k) and\
+                        ((k not in ['correctedFluo', 'correctedFluo0']) or with_correctedFluo_and_F0):
+                    entry[k] = getattr(self, k)
+            # rawFluo and neuropil are re-read from the NWB file
+            CACHE.set(key, entry)
+            self.dFoF_cache_key = key
+
+    def restore_dFoF(self, entry,
+                     specific_time_sampling=None,
+                     interpolation='linear',
+                     verbose=True):
+        """
+        sets the dFoF (and the associated quantities) from a cache entry
+        """
+        for k in entry:
+            setattr(self, k, entry[k])
+
+        self.initialize_ROIs(valid_roiIndices=self.valid_roiIndices)
+
+        # rawFluo and neuropil (not cached) are re-read from the file
+        for k in ['rawFluo', 'neuropil']:
+            getattr(self, 'build_%s' % k)(specific_time_sampling=specific_time_sampling,
+                                          interpolation=interpolation,
+                                          verbose=verbose)
+            # we restrict to valid ROIs
+            if hasattr(getattr(self, k), 'roi_subset'):
+                setattr(self, k, getattr(self, k).roi_subset(self.valid_roiIndices))
+            else:
+                setattr(self, k, getattr(self, k)[self.valid_roiIndices,:])
+
+    def invalidate_cache(self):
+        """
+        removes the memoized processing results of this file (see analysis.cache)
+        """
+        CACHE.invalidate(self.filepath)
         
 
 
@@ -449,14 +676,31 @@ class Data:
             self.build_dFoF(verbose=verbose)
         setattr(self, 'Zscore_dFoF', (self.dFoF-self.dFoF.mean(axis=0).reshape(1, self.dFoF.shape[1]))/self.dFoF.std(axis=0).reshape(1, self.dFoF.shape[1]))
 
-    def build_Deconvolved(self, Tau=1.3):
+    def build_Deconvolved(self, Tau=1.3,
+                          use_cache=False):
+        """
+        use_cache=True -> memoized if the dFoF was built with the cache
+        """
         if not hasattr(self, 'dFoF'):
             print('\n deconvolution not possible \n --> need to build_dFoF(**options) first !! ')
-        else:
-            setattr(self, 'Deconvolved',
-                    oasis(self.dFoF, 
-                          self.dFoF.shape[0], # batch size
-                              Tau, 1./self.CaImaging_dt))
+            return
+
+        key = None
+        if use_cache and (getattr(self, 'dFoF_cache_key', None) is not None):
+            key = CACHE.key(self.filepath, 'Deconvolved', 
+                            dict(dFoF=self.dFoF_cache_key, Tau=Tau))
+            entry = CACHE.get(key)
+            if entry is not None:
+                self.Deconvolved = entry['Deconvolved']
+                return
+
+        setattr(self, 'Deconvolved',
+                oasis(self.dFoF, 
+                      None, # batch size set from the memory budget
+                          Tau, 1./self.CaImaging_dt))
+
+        if key is not None:
+            CACHE.set(key, {'Deconvolved':self.Deconvolved})
 
 
     def build_neuropil(self,
@@ -474,7 +718,11 @@ class Data:
         if not hasattr(self, 't_neuropil'):
             self.t_neuropil = self.Neuropil.timestamps[:]
 
-        if len(self.t_neuropil)==self.Neuropil.data.shape[1]:
+        if self.lazy:
+            # nothing loaded, see LazyROIArray
+            self.neuropil = LazyROIArray(self.Neuropil.data,
+                        transposed=(len(self.t_neuropil)!=self.Neuropil.data.shape[1]))
+        elif len(self.t_neuropil)==self.Neuropil.data.shape[1]:
             self.neuropil = np.array(self.Neuropil.data)[:,:]
         else:
             # data badly oriented --> transpose in that case
@@ -507,7 +755,11 @@ class Data:
         if not hasattr(self, 't_rawFluo'):
             self.t_rawFluo = self.Fluorescence.timestamps[:]
 
-        if len(self.t_rawFluo)==self.Fluorescence.data.shape[1]:
+        if self.lazy:
+            # nothing loaded, see LazyROIArray
+            self.rawFluo = LazyROIArray(self.Fluorescence.data,
+                        transposed=(len(self.t_rawFluo)!=self.Fluorescence.data.shape[1]))
+        elif len(self.t_rawFluo)==self.Fluorescence.data.shape[1]:
             self.rawFluo = np.array(self.Fluorescence.data)
         else:
             # data badly oriented --> transpose in that case
@@ -644,35 +896,17 @@ class Data:
             return ['']
             
         
-def scan_folder_for_NWBfiles(folder, 
-                             for_protocol=None,
-                             for_protocols=[],
-                             sorted_by='filename',
-                             Nmax=1000000,
-                             exclude_intrinsic_imaging_files=True,
-                             verbose=True):
+def scan_NWBfiles(folder, for_protocols, Nmax,
+                  exclude_intrinsic_imaging_files, verbose):
     """
-    scan folders for protocols and returns a list of datafiles
-
-    by default: excludes the intrinsic imaging files
+    reads the metadata of all NWB files in the folder (one after the other)
     """
-    if verbose:
-        print('inspecting the folder "%s" [...]' % folder)
-        t0 = time.time()
-
-    if (for_protocol is not None) and (len(for_protocols)==0):
-        for_protocols = [for_protocol]
-
     FILES0 = get_files_with_extension(folder,
                     extension='.nwb', recursive=True)
     
     if exclude_intrinsic_imaging_files:
-        FILES0 = [f for f in FILES0 if (('left-' not in f) and\
-                                      ('down-' not in f) and\
-                                      ('right-' not in f) and\
-                                      ('up-' not in f))]
+        FILES0 = [f for f in FILES0 if not is_intrinsic_imaging_file(f)]
 
-    DATES = np.array([f.split(os.path.sep)[-1].split('-')[0] for f in FILES0])
     FILES, SUBJECTS, PROTOCOLS, PROTOCOL_IDS, AGES = [], [], [], [], []
 
     for f in FILES0[:Nmax]:
@@ -708,11 +942,72 @@ def scan_folder_for_NWBfiles(folder,
                 AGES.append(data.age)
 
         except BaseException as be:
-            SUBJECTS.append('N/A')
             if verbose:
                 print(be)
                 print('\n [!!] Pb with "%s" \n' % f)
-        
+
+    return FILES, SUBJECTS, PROTOCOLS, PROTOCOL_IDS, AGES
+
+
+def scan_folder_for_NWBfiles(folder, 
+                             for_protocol=None,
+                             for_protocols=[],
+                             sorted_by='filename',
+                             Nmax=1000000,
+                             exclude_intrinsic_imaging_files=True,
+                             use_index=False,
+                             nproc=None,
+                             verbose=True):
+    """
+    scan folders for protocols and returns a list of datafiles
+
+    by default: excludes the intrinsic imaging files
+
+    use_index=True -> the metadata are read from the index of the folder 
+            (see analysis.index_NWB), only new or modified files are
+            read (in "nproc" parallel processes) to update the index
+
+    Nmax: only the first Nmax files of the folder are considered
+            (before the protocol selection, with or without index)
+    """
+    if verbose:
+        print('inspecting the folder "%s" [...]' % folder)
+        t0 = time.time()
+
+    if (for_protocol is not None) and (len(for_protocols)==0):
+        for_protocols = [for_protocol]
+
+    if use_index:
+
+        update_index(folder,
+                     exclude_intrinsic_imaging_files=exclude_intrinsic_imaging_files,
+                     nproc=nproc, verbose=verbose)
+
+        # as in "scan_NWBfiles": Nmax applies to the files of the folder
+        #                               (before the protocol selection)
+        FILES0 = get_files_with_extension(folder,
+                        extension='.nwb', recursive=True)
+        if exclude_intrinsic_imaging_files:
+            FILES0 = [f for f in FILES0 if not is_intrinsic_imaging_file(f)]
+
+        SESSIONS = query_index(folder, for_protocols=for_protocols,
+                               filenames=(FILES0[:Nmax] if Nmax<len(FILES0) else None))
+
+        FILES = [s['filename'] for s in SESSIONS]
+        DATES = np.array([s['date'] for s in SESSIONS])
+        SUBJECTS = [s['subject'] for s in SESSIONS]
+        PROTOCOLS = [s['protocols'] for s in SESSIONS]
+        PROTOCOL_IDS = [s['protocol_ids'] for s in SESSIONS]
+        AGES = [s['age'] for s in SESSIONS]
+
+    else:
+
+        FILES, SUBJECTS, PROTOCOLS, PROTOCOL_IDS, AGES = \
+                scan_NWBfiles(folder, for_protocols, Nmax,
+                              exclude_intrinsic_imaging_files, verbose)
+
+        DATES = np.array([f.split(os.path.sep)[-1].split('-')[0] for f in FILES])
+
     if verbose:
         print(' -> found n=%i datafiles (in %.1fs) ' % (len(FILES),
                                                         (time.time()-t0)))
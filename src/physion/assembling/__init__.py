@@ -1 +1 @@
-from . import subject, add_ophys, nwb, tools, dataset
+from . import subject, add_ophys, nwb, tools, dataset, batch
@@ -0,0 +1,146 @@
+"""
+Batch building of NWB files (used by the recursive and spreadsheet modes
+        of "python -m physion.assembling.nwb")
+
+    - sessions are built in a process pool ("nproc" workers)
+    - the output of each session goes to its own log file:
+            "[destination]/logs/[date]-[time].log"
+    - sessions whose NWB file is newer than all their input files are skipped
+    - an error only fails its session (but Ctrl-C stops the whole batch)
+    - a summary table of timings and failures is printed at the end
+"""
+import os, time, traceback, multiprocessing, contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+def last_modification(folder):
+    """
+    most recent modification time of the files in a folder (recursive)
+    """
+    mtime = os.path.getmtime(folder)
+    for root, _, files in os.walk(folder):
+        for f in files:
+            mtime = max([mtime, os.path.getmtime(os.path.join(root, f))])
+    return mtime
+
+
+def is_up_to_date(filename, inputs):
+    """
+    the NWB file exists and is newer than all the inputs (files or folders)
+    """
+    if not os.path.isfile(filename):
+        return False
+    mtime = os.path.getmtime(filename)
+    for i in inputs:
+        if (os.path.isdir(i) and (last_modification(i)>mtime)) or\
+                (os.path.isfile(i) and (os.path.getmtime(i)>mtime)):
+            return False
+    return True
+
+
+def build_session(job):
+    """
+    builds the NWB file of a single session (run in the worker processes)
+
+    job = (args, Subject, force, extra_inputs)
+
+    returns a dictionary with keys:
+        datafolder, filename, status ("built", "skipped" or "failed"), time, error, log
+    """
+    # import here to keep the worker processes light at startup
+    from physion.assembling.nwb import build_NWB_func, nwb_filename
+
+    args, Subject, force, extra_inputs = job
+
+    tic = time.time()
+    result = {'datafolder':args.datafolder, 'filename':'', 'status':'failed',
+              'time':0, 'error':'', 'log':''}
+    try:
+        args.filename = nwb_filename(args.datafolder, args.destination_folder)
+        result['filename'] = args.filename
+
+        if (not force) and is_up_to_date(args.filename,
+                                         [args.datafolder]+extra_inputs):
+            result['status'] = 'skipped'
+        else:
+            os.makedirs(os.path.join(os.path.dirname(args.filename), 'logs'),
+                        exist_ok=True)
+            result['log'] = os.path.join(os.path.dirname(args.filename), 'logs',
+                        os.path.basename(args.filename).replace('.nwb', '.log'))
+            with open(result['log'], 'w') as log,\
+                    contextlib.redirect_stdout(log),\
+                    contextlib.redirect_stderr(log):
+                try:
+                    build_NWB_func(args, Subject=Subject)
+                    result['status'] = 'built'
+                except KeyboardInterrupt:
+                    raise
+                except BaseException as be:
+                    # (build_NWB_func raises a bare BaseException on missing NI-DAQ data)
+                    traceback.print_exc()
+                    result['error'] = str(be) if str(be)!='' else type(be).__name__
+    except KeyboardInterrupt:
+        raise
+    except BaseException as be:
+        result['error'] = str(be) if str(be)!='' else type(be).__name__
+
+    result['time'] = time.time()-tic
+    return result
+
+
+def print_summary(RESULTS):
+    """
+    summary table of the batch build
+    """
+    print('')
+    print(' %4s | %-8s | %8s | %s' % ('#', 'status', 'time (s)', 'session'))
+    print(' '+'-'*70)
+    for i, r in enumerate(RESULTS):
+        print(' %4i | %-8s | %8.1f | %s' % (i+1, r['status'], r['time'],
+                                            r['datafolder']))
+        if r['status']=='failed':
+            print('      |          |          |   [!!] %s' % r['error'])
+            if r['log']!='':
+                print('      |          |          |   --> see log: "%s"' % r['log'])
+    print(' '+'-'*70)
+    print(' n=%i built, n=%i skipped (up-to-date), n=%i failed' % tuple(\
+            [len([r for r in RESULTS if r['status']==s])\
+                            for s in ['built', 'skipped', 'failed']]))
+    print('')
+
+
+def build_sessions(JOBS,
+                   nproc=1,
+                   force=False,
+                   extra_inputs=[]):
+    """
+    JOBS: list of (args, Subject) of "build_NWB_func"
+
+    nproc: number of sessions built in parallel
+    force: rebuild also the up-to-date NWB files
+    extra_inputs: files considered as inputs of all sessions (e.g. the spreadsheet)
+
+    returns the list of results of "build_session"
+    """
+    JOBS = [(args, Subject, force, extra_inputs) for args, Subject in JOBS]
+
+    RESULTS = []
+    def report(result):
+        RESULTS.append(result)
+        print(' [%i/%i] %s: "%s" (%.1fs)' % (len(RESULTS), len(JOBS),
+                                            result['status'], result['datafolder'],
+                                            result['time']))
+
+    if (nproc>1) and (len(JOBS)>1):
+        # "spawn" for fresh HDF5 states in the workers (fork can deadlock h5py)
+        with ProcessPoolExecutor(max_workers=min([nproc, len(JOBS)]),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            for result in pool.map(build_session, JOBS):
+                report(result)
+    else:
+        for job in JOBS:
+            report(build_session(job))
+
+    print_summary(RESULTS)
+
+    return RESULTS
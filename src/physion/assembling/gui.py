@@ -99,7 +99,7 @@ def load_NWB_folder(self):
     if self.folder!='':
 
         for subfolder, _, files in os.walk(self.folder):
-            if ('NIdaq.npy' in files) and\
+            if (('NIdaq.npy' in files) or ('NIdaq.analog.npy' in files)) and\
                 (('metadata.npy' in files) or ('metadata.json' in files)):
                 self.folders.append(os.path.join(self.folder, subfolder))
 
@@ -7,7 +7,7 @@ from hdmf.data_utils import DataChunkIterator
 from hdmf.backends.hdf5.h5_utils import H5DataIO
 from dateutil.tz import tzlocal
 
-from physion.behavior.locomotion import compute_speed
+from physion.behavior.locomotion import compute_downsampled_speed
 from physion.analysis.tools import resample, resample_signal
 from physion.utils.paths import python_path
 from physion.visual_stim.build import build_stim as build_visualStim
@@ -18,7 +18,7 @@ from .subject import reformat_props, cleanup_keys, subject_template
 from .add_ophys import add_ophys
 from .realign_from_photodiode import realign_from_photodiode
 from .dataset import read_spreadsheet, read_metadata
-from .tools import load_FaceCamera_data,\
+from .tools import load_FaceCamera_data, load_NIdaq_data,\
         build_subsampling_from_freq, StartTime_to_day_seconds
 
 ALL_MODALITIES = ['raw_CaImaging', 'processed_CaImaging',
@@ -128,12 +128,9 @@ def build_NWB_func(args, Subject=None):
                    datetime.datetime.now(datetime.UTC).replace(tzinfo=tzlocal()))
 
     if not hasattr(args, 'filename') or args.filename=='':
-        if args.destination_folder=='':
-            args.filename = os.path.join(pathlib.Path(args.datafolder).parent,
-                                         '%s.nwb' % identifier)
-        else:
-            args.filename = os.path.join(args.destination_folder,
-                                         '%s.nwb' % identifier)
+        args.filename = nwb_filename(args.datafolder,
+                                     args.destination_folder,
+                                     metadata=metadata)
 
     
     manager = pynwb.get_manager() # we need a manager to link raw and processed data
@@ -156,8 +153,7 @@ def build_NWB_func(args, Subject=None):
     if args.verbose:
         print('=> Loading NIdaq data for "%s" [...]' % args.datafolder)
     try:
-        NIdaq_data = np.load(os.path.join(args.datafolder, 'NIdaq.npy'), 
-                             allow_pickle=True).item()
+        NIdaq_data = load_NIdaq_data(args.datafolder)
     except FileNotFoundError:
         print('\n   [!!] No NI-DAQ data found [!!] \n')
         NIdaq_data = None
@@ -184,14 +180,13 @@ def build_NWB_func(args, Subject=None):
             if args.verbose:
                 print('=> Computing and storing running-speed for "%s" [...]' % args.datafolder)
 
-            speed = compute_speed(NIdaq_data['digital'][0],
+            # decoding fused with the downsampling at "running_sampling"
+            _, speed = compute_downsampled_speed(NIdaq_data['digital'][0],
                     acq_freq=float(metadata['NIdaq-acquisition-frequency']),
+                    new_freq=args.running_sampling,
+                    smoothing=2./args.running_sampling,
                     radius_position_on_disk=float(metadata['rotating-disk']['radius-position-on-disk-cm']),
                     rotoencoder_value_per_rotation=float(metadata['rotating-disk']['roto-encoder-value-per-rotation']))
-            _, speed = resample_signal(speed,
-                                    original_freq=float(metadata['NIdaq-acquisition-frequency']),
-                                    new_freq=args.running_sampling,
-                                    pre_smoothing=2./args.running_sampling)
             running_sampling = args.running_sampling
             np.save(os.path.join(args.datafolder, 'locomotion.npy'),
                     dict(speed=speed, running_sampling=running_sampling))
@@ -650,6 +645,20 @@ def build_NWB_func(args, Subject=None):
     ####         Writing NWB file             #######
     #################################################
 
+    # written to a temporary file, renamed only once complete
+    #    (an interrupted build never leaves a truncated NWB file)
+    io = pynwb.NWBHDF5IO(args.filename+'.part', mode='w', manager=manager)
+    print("""     ----> Saving the NWB file: "%s" """ % args.filename)
+    try:
+        io.write(nwbfile, link_data=False)
+    except BaseException:
+        # failed (or interrupted) write -> release the handle, no partial file left
+        io.close()
+        if os.path.isfile(args.filename+'.part'):
+            os.remove(args.filename+'.part')
+        raise
+    io.close()
+
     if os.path.isfile(args.filename):
         temp = str(tempfile.NamedTemporaryFile().name)+'.nwb'
         print("""
@@ -658,16 +667,36 @@ def build_NWB_func(args, Subject=None):
         """ % (args.filename, temp))
         shutil.move(args.filename, temp)
 
-    io = pynwb.NWBHDF5IO(args.filename, mode='w', manager=manager)
-    print("""     ----> Saving the NWB file: "%s" """ % args.filename)
-    io.write(nwbfile, link_data=False)
-    io.close()
+    os.replace(args.filename+'.part', args.filename)
     print('---> done !')
     
     return args.filename
 
 
 
+def nwb_filename(datafolder, 
+                 destination_folder='',
+                 metadata=None):
+    """
+    the NWB file built from a datafolder: "[destination]/[date]-[time].nwb"
+        (default destination: the parent folder of the datafolder)
+    """
+    if metadata is None:
+        metadata = read_metadata(datafolder)
+
+    if 'date' in metadata:
+        identifier = metadata['date']+'-'+metadata['time']
+    else:
+        identifier = metadata['filename'][-19:-9]+'-'+metadata['filename'][-8:]
+
+    if destination_folder=='':
+        return os.path.join(pathlib.Path(datafolder).parent,
+                            '%s.nwb' % identifier)
+    else:
+        return os.path.join(destination_folder,
+                            '%s.nwb' % identifier)
+
+
 def build_cmd(datafolder,
               modalities=['Locomotion', 'VisualStim'],
               force_to_visualStimTimestamps=False,
@@ -701,7 +730,7 @@ def check_times(times, t0):
 
 if __name__=='__main__':
 
-    import argparse, os
+    import argparse, os, copy
 
     parser=argparse.ArgumentParser(description="""
     Building NWB file from mutlimodal experimental recordings
@@ -746,6 +775,16 @@ if __name__=='__main__':
     parser.add_argument('-R', "--recursive", action="store_true")
     parser.add_argument('-fi', "--files_indices", 
                         default=[0, 10000], nargs=2, type=int)
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="""
+                        In recursive or spreadsheet mode,
+                        number of sessions built in parallel
+                        """)
+    parser.add_argument("--force", action="store_true",
+                        help="""
+                        In recursive or spreadsheet mode,
+                        rebuild also the up-to-date NWB files
+                        """)
 
     args = parser.parse_args()
 
@@ -758,13 +797,15 @@ if __name__=='__main__':
 
     if '.xlsx' in args.datafolder:
 
+        from physion.assembling.batch import build_sessions
+
         filename, directory = args.datafolder, os.path.dirname(args.datafolder)
         dataset, subjects, _ = read_spreadsheet(filename)
         if args.destination_folder=='':
             args.destination_folder = os.path.join(directory, 'NWBs')
+        JOBS = []
         for i in np.arange(args.files_indices[0], 
                            min([len(dataset), args.files_indices[1]])):
-            print('\n \n     [%i] -- %s \n ' % (i+1, dataset['datafolder'][i]))
 
             # subject information:
             Subject = subjects[\
@@ -786,11 +827,19 @@ if __name__=='__main__':
                 if dataset[key].values[i]=='Yes':
                     args.modalities.append(key)
 
-            # run the build:
-            build_NWB_func(args, Subject=Subject)
+            JOBS.append((copy.copy(args), Subject))
+
+        # run the builds (the spreadsheet is an input of each session):
+        build_sessions(JOBS, 
+                       nproc=args.nproc,
+                       force=args.force,
+                       extra_inputs=[filename])
         
     elif args.recursive:
 
+        from physion.assembling.batch import build_sessions
+
+        JOBS = []
         i = -1
         for f, _, __ in os.walk(args.datafolder):
             timeFolder = f.split(os.path.sep)[-1]
@@ -799,22 +848,24 @@ if __name__=='__main__':
                     (len(dateFolder.split('_'))==3):
                 i+=1
                 if (i>=args.files_indices[0]) and (i<=args.files_indices[1]):
-                    print()
-                    print(' [ %i ]  processing "%s" [...] ' % (i,f))
                     args.datafolder = f
                     args.filename = ''
                     if args.only_protocol!='':
                         # we check that it matches the protocol
                         metadata = read_metadata(args.datafolder)
                         if args.only_protocol in metadata['protocol']:
-                            build_NWB_func(args)
+                            JOBS.append((copy.copy(args), None))
                         else:
                             print('')
                             print('  [!!]  ignoring:', f, ' of protocol', 
                                   metadata['protocol'])
                             print('')
                     else:
-                        build_NWB_func(args)
+                        JOBS.append((copy.copy(args), None))
+
+        build_sessions(JOBS,
+                       nproc=args.nproc,
+                       force=args.force)
 
     elif os.path.isdir(args.datafolder) and (\
                 ('metadata.npy' in os.listdir(args.datafolder)) or
@@ -14,6 +14,7 @@ def realign_from_photodiode(signal,
                             indices_forced=[],
                             times_forced=[],
                             durations_forced=[],
+                            vectorized=True,
                             verbose=True):
     """
     
@@ -23,6 +24,10 @@ def realign_from_photodiode(signal,
 
     - onset_shift: possibility to shift the onset time by a fixed quantity
             (N.B. that depends on the smoothing, so onset_shift can be negative to compensate)
+
+    - vectorized: the threshold crossings are found once for the whole signal,
+            and each episode onset is then searched in the crossing times
+            (instead of a mask over the whole signal per episode)
     """
     success = True
 
@@ -53,12 +58,28 @@ def realign_from_photodiode(signal,
     baseline = bins[np.argmax(H)+1]
     threshold = (np.max(smooth_signal)-baseline)/4. # reaching 25% of peak level
 
+    if vectorized:
+        # all the upward threshold crossings, in a single pass
+        crossing_times = t[:-2][(smooth_signal[1:]>=(baseline+threshold)) &\
+                                        (smooth_signal[:-1]<(baseline+threshold))]
+        icrossing, previous_tsearch = 0, -np.inf
+
     # looping over episodes
     i=0
     while (i<max_episode) and (tstart<(t[-1]-metadata['time_duration'][i])) and success:
 
         # the next time point above being above threshold
-        cond_thresh = (t[:-2]>tstart+shift_time) & (smooth_signal[1:]>=(baseline+threshold)) & (smooth_signal[:-1]<(baseline+threshold))
+        if vectorized:
+            tsearch = tstart+shift_time
+            if tsearch<previous_tsearch:
+                icrossing = 0 # backward move (forced episode), restart the walk
+            # first crossing strictly after tsearch, searched forward only
+            icrossing += np.searchsorted(crossing_times[icrossing:], tsearch, side='right')
+            previous_tsearch = tsearch
+            found = icrossing<len(crossing_times)
+        else:
+            cond_thresh = (t[:-2]>tstart+shift_time) & (smooth_signal[1:]>=(baseline+threshold)) & (smooth_signal[:-1]<(baseline+threshold))
+            found = np.sum(cond_thresh)>0
         # print(tstart, i, success)
 
         if i in indices_forced:
@@ -74,9 +95,12 @@ def realign_from_photodiode(signal,
             # we just skip this episodes:
             success = True
 
-        elif np.sum(cond_thresh)>0:
+        elif found:
             # success
-            tshift = t[:-2][cond_thresh][0] - tstart - onset_shift
+            if vectorized:
+                tshift = crossing_times[icrossing] - tstart - onset_shift
+            else:
+                tshift = t[:-2][cond_thresh][0] - tstart - onset_shift
             metadata['time_start_realigned'].append(tstart+tshift)
         else:
             success = False
@@ -148,7 +172,8 @@ if __name__=='__main__':
     parser.add_argument("--durations_forced", nargs='*', type=float, default=[])
     args = parser.parse_args()
 
-    data = np.load(os.path.join(args.datafolder, 'NIdaq.npy'), allow_pickle=True).item()['analog'][0]
+    from physion.assembling.tools import load_NIdaq_data
+    data = load_NIdaq_data(args.datafolder)['analog'][0]
     metadata = np.load(os.path.join(args.datafolder, 'metadata.npy'), allow_pickle=True).item()
     VisualStim = np.load(os.path.join(args.datafolder, 'visual-stim.npy'), allow_pickle=True).item()
 
@@ -20,6 +20,25 @@ def read_metadata(datafolder):
 
     return metadata 
 
+
+def load_NIdaq_data(datafolder):
+    """
+    returns the NIdaq data as a dictionary with keys: "analog", "digital", "dt"
+
+    - streamed recordings ("NIdaq.analog.npy", "NIdaq.digital.npy", "NIdaq.dt.npy")
+        are memory-mapped (read-only, no unpickling)
+    - (deprecated, the pickled dictionary of "NIdaq.npy")
+    """
+    if os.path.isfile(os.path.join(datafolder, 'NIdaq.analog.npy')):
+        return {'analog':np.load(os.path.join(datafolder, 'NIdaq.analog.npy'),
+                                 mmap_mode='r'),
+                'digital':np.load(os.path.join(datafolder, 'NIdaq.digital.npy'),
+                                  mmap_mode='r'),
+                'dt':np.load(os.path.join(datafolder, 'NIdaq.dt.npy'))[0]}
+    else:
+        return np.load(os.path.join(datafolder, 'NIdaq.npy'),
+                       allow_pickle=True).item()
+
 def build_subsampling_from_freq(subsampled_freq=1.,
                                 original_freq=1.,
                                 N=10, Nmin=3):
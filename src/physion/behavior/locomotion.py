@@ -1,6 +1,20 @@
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
 
+# ############# TRANSITION TABLE ##############
+# ## state = A+2*B (i.e. the NIDAQ digital value)
+# ## transition code = (previous_state<<2)|state
+# ##   +1: the A signal lead the B signal (counterclockwise)
+# ##         ... => 11 => 01 => 00 => 10 => 11 => ...
+# ##   -1: the B signal lead the A signal (clockwise)
+# ##         ... => 11 => 10 => 00 => 01 => 11 => ...
+# ##    0: no change or invalid transition (two steps)
+TRANSITION_TABLE = np.zeros(16, dtype=np.int8)
+TRANSITION_TABLE[[(3<<2)|2, (2<<2)|0, (0<<2)|1, (1<<2)|3]] = 1
+TRANSITION_TABLE[[(3<<2)|1, (1<<2)|0, (0<<2)|2, (2<<2)|3]] = -1
+
+CHUNK_SIZE = 2**20 # samples
+
 def process_binary_signal(binary_signal, empirical=False):
 
     # ########################
@@ -64,6 +78,92 @@ def compute_position_from_binary_signals(A, B, forward='counterclockwise'):
 
     return np.cumsum(np.concatenate([[0], Delta_position]))
 
+def quadrature_states(chunk, next_value=0, empirical=False):
+    """
+    state (A+2*B) of a chunk of the binary signal
+
+    invalid states (digital values >3, i.e. with other lines on) are set to 4
+
+    next_value: first value after the chunk (for the "empirical" B)
+    """
+    chunk = np.asarray(chunk).astype(np.int64)
+    if empirical:
+        A = chunk%2
+        # B is A shifted by one sample (see process_binary_signal)
+        return (A+2*np.concatenate([A[1:], [next_value%2]])).astype(np.uint8)
+    else:
+        states = chunk.astype(np.uint8)
+        states[(chunk<0) | (chunk>3)] = 4
+        return states
+
+
+def compute_position(binary_signal,
+                     forward='counterclockwise',
+                     empirical=False,
+                     chunk_size=CHUNK_SIZE,
+                     sampling_indices=None):
+    """
+    single-pass decoding of the roto-encoder signal
+        (same result as compute_position_from_binary_signals)
+
+    the transition codes (previous_state<<2)|state are mapped
+        through the TRANSITION_TABLE, chunk by chunk 
+        (the memory use of the temporaries is bounded by "chunk_size")
+
+    sampling_indices: if not None, only the position at those
+                    (increasing) indices is returned
+    
+    returns the position (in encoder steps, float array)
+    """
+    N = len(binary_signal)
+    sign = -1 if forward=='clockwise' else 1
+
+    if sampling_indices is None:
+        position = np.empty(N, dtype=float)
+    else:
+        sampling_indices = np.asarray(sampling_indices, dtype=int)
+        position = np.empty(len(sampling_indices), dtype=float)
+        i_sampled = 0
+
+    previous_state, current_position = None, 0
+    for i0 in range(0, N, chunk_size):
+
+        i1 = min([i0+chunk_size, N])
+        next_value = binary_signal[i1] if (empirical and i1<N) else 0
+        states = quadrature_states(binary_signal[i0:i1], next_value, empirical)
+
+        # the transition to each sample (the first sample has no transition)
+        previous = np.concatenate([[states[0] if previous_state is None\
+                                                else previous_state], states[:-1]])
+        delta = TRANSITION_TABLE[((previous&3)<<2)|(states&3)]
+        if (states.max()>3) or (previous.max()>3):
+            delta[(states>3) | (previous>3)] = 0
+
+        chunk_position = current_position+sign*np.cumsum(delta, dtype=np.int64)
+
+        if sampling_indices is None:
+            position[i0:i1] = chunk_position
+        else:
+            i_stop = np.searchsorted(sampling_indices, i1, side='left')
+            position[i_sampled:i_stop] = chunk_position[sampling_indices[i_sampled:i_stop]-i0]
+            i_sampled = i_stop
+
+        previous_state, current_position = states[-1], chunk_position[-1]
+
+    return position
+
+
+def position_scale_factor(radius_position_on_disk=1,
+                          rotoencoder_value_per_rotation=1,
+                          cpr=1000,
+                          empirical=False):
+    """ from encoder steps to cm """
+    if empirical:
+        return 2.*np.pi*radius_position_on_disk/rotoencoder_value_per_rotation
+    else :
+        return 2.*np.pi*radius_position_on_disk/cpr/4.
+
+
 def compute_speed(binary_signal, 
                   acq_freq=1e4, 
                   position_smoothing=10e-3, # s
@@ -72,14 +172,21 @@ def compute_speed(binary_signal,
                   cpr=1000,
                   forward='counterclockwise',
                   empirical=False,
-                  with_raw_position=False):
+                  with_raw_position=False,
+                  vectorized=True):
+    """
+    vectorized=False: former decoding with the comparisons of the A and B traces 
+                        (kept for comparison, see tests/behavior/locomotion.py)
+    """
 
-    A, B = process_binary_signal(binary_signal, empirical)
-    
-    if empirical:
-        position = compute_position_from_binary_signals(A, B, forward)*2.*np.pi*radius_position_on_disk/rotoencoder_value_per_rotation
-    else :
-        position = compute_position_from_binary_signals(A, B, forward)*2.*np.pi*radius_position_on_disk/cpr/4.
+    if vectorized:
+        position = compute_position(binary_signal, forward, empirical)
+    else:
+        A, B = process_binary_signal(binary_signal, empirical)
+        position = compute_position_from_binary_signals(A, B, forward)
+    position *= position_scale_factor(radius_position_on_disk,
+                                      rotoencoder_value_per_rotation,
+                                      cpr, empirical)
 
     if position_smoothing>0:
         speed = np.diff(gaussian_filter1d(position, int(position_smoothing*acq_freq), mode='nearest'))
@@ -94,6 +201,51 @@ def compute_speed(binary_signal,
         return speed, position
     else:
         return speed
+
+
+def compute_downsampled_speed(binary_signal, 
+                              acq_freq=1e4, 
+                              new_freq=50.,
+                              smoothing=2./50., # s
+                              radius_position_on_disk=1,	# cm
+                              rotoencoder_value_per_rotation=1, # a.u.
+                              cpr=1000,
+                              forward='counterclockwise',
+                              empirical=False,
+                              chunk_size=CHUNK_SIZE):
+    """
+    running speed directly at the "new_freq" sampling rate
+        (e.g. the "running_sampling" of assembling.nwb)
+    
+    the position is only kept at the bin edges of the new time sampling
+        -> the speed in each bin is the mean speed over the bin
+        then smoothed (gaussian filter of width "smoothing")
+
+    replaces compute_speed + analysis.tools.resample_signal 
+        without any full-length array (memory bounded by "chunk_size")
+
+    returns t, speed (t=np.arange(len(speed))/new_freq as in resample_signal)
+    """
+    N = len(binary_signal)
+    # same time sampling than resample_signal on compute_speed (N-1 samples)
+    t = np.arange(int((N-2)/acq_freq*new_freq))/new_freq
+
+    # bin edges centered on the new time samples
+    edges = np.clip(np.round((np.arange(len(t)+1)-0.5)*acq_freq/new_freq),
+                    0, N-1).astype(int)
+    position = compute_position(binary_signal, forward, empirical,
+                                chunk_size=chunk_size,
+                                sampling_indices=edges)
+    position *= position_scale_factor(radius_position_on_disk,
+                                      rotoencoder_value_per_rotation,
+                                      cpr, empirical)
+
+    speed = np.diff(position)*acq_freq/np.clip(np.diff(edges), 1, np.inf)
+
+    if (smoothing*new_freq)>1:
+        speed = gaussian_filter1d(speed, int(smoothing*new_freq), mode='nearest')
+
+    return t, speed
  	
 
 if __name__=='__main__':
@@ -124,7 +276,8 @@ if __name__=='__main__':
         
         with open(os.path.join(args.datafolder, 'metadata.json'), 'r') as file:
             metadata = json.load(file)
-        NIdaq_data = np.load(os.path.join(args.datafolder, 'NIdaq.npy'), allow_pickle=True).item()
+        from physion.assembling.tools import load_NIdaq_data
+        NIdaq_data = load_NIdaq_data(args.datafolder)
         digital_inputs = NIdaq_data['digital']
         args.acq_time_step = 1./metadata['NIdaq-acquisition-frequency']
         t_array = np.arange(len(digital_inputs[0]))*args.acq_time_step
@@ -1,2 +1,2 @@
 from . import camera, FOV, imaging, movie, plots, pupil, raw, snapshot,\
-        tools, episodes, dataframe
+        tools, episodes, dataframe, envelope
@@ -0,0 +1,177 @@
+"""
+Level-of-detail representation of the traces for the display of long recordings
+
+    a min/max envelope pyramid is built once per trace: level k stores the
+    minimum and maximum over consecutive blocks of base*factor**k samples
+
+    displaying a time window on "npixels" pixels then only reads the coarsest
+    level that still has one block per pixel (or the raw samples when zoomed in),
+    i.e. O(npixels) values whatever the zoom, and the transients are kept
+    (unlike a fixed "[::subsampling]" stride)
+
+usage:
+    envelope = get_envelope(data, 'dFoF', data.dFoF, **timing_of(data.Neuropil))
+    t, y = envelope.query(tlim[0], tlim[1], npixels=800, rows=[0, 3])
+"""
+import numpy as np
+
+
+def timing_of(nwb_quantity):
+    """ the timing arguments of EnvelopePyramid for a NWB time series """
+    if nwb_quantity.timestamps is not None:
+        return {'timestamps':np.array(nwb_quantity.timestamps[:])}
+    else:
+        return {'starting_time':nwb_quantity.starting_time,
+                'rate':nwb_quantity.rate}
+
+
+def axes_width(ax):
+    """ width of a matplotlib axes in pixels """
+    return max([1, int(ax.get_window_extent().width)])
+
+
+def block_min_max(mins, maxs, n):
+    """
+    minimum and maximum over consecutive blocks of "n" samples along the last axis
+        (the last block can be incomplete)
+    """
+    nFull = mins.shape[-1]//n
+    shape = mins.shape[:-1]+(nFull, n)
+    bMin = mins[...,:nFull*n].reshape(shape).min(axis=-1)
+    bMax = maxs[...,:nFull*n].reshape(shape).max(axis=-1)
+    if mins.shape[-1]>nFull*n:
+        bMin = np.concatenate([bMin, mins[...,nFull*n:].min(axis=-1)[...,np.newaxis]],
+                              axis=-1)
+        bMax = np.concatenate([bMax, maxs[...,nFull*n:].max(axis=-1)[...,np.newaxis]],
+                              axis=-1)
+    return bMin, bMax
+
+
+class EnvelopePyramid:
+
+    def __init__(self, source,
+                 timestamps=None, starting_time=0., rate=1.,
+                 base=16, factor=4, min_blocks=64,
+                 memory_budget=128e6):
+        """
+        source: trace(s) of shape (nSamples,) or (nTraces, nSamples), any array
+                    sliceable along the last axis (numpy, h5py, LazyROIArray)
+        timestamps: time of the samples, otherwise: starting_time+index/rate
+
+        base: block size of the first level (below, the raw samples are used)
+        factor: block size ratio between consecutive levels
+        min_blocks: number of blocks below which no coarser level is built
+        memory_budget: in bytes, the source is read by time chunks of that size
+        """
+        self.source = source
+        self.shape = source.shape
+        self.nSamples = self.shape[-1]
+        self.base, self.factor = base, factor
+
+        if timestamps is not None:
+            self.timestamps = np.asarray(timestamps)
+        else:
+            self.timestamps = None
+            self.starting_time, self.rate = starting_time, rate
+
+        # first level, from the source read by time chunks
+        nTraces = self.shape[0] if len(self.shape)>1 else 1
+        chunk = base*max([1, int(memory_budget/8/nTraces/base)])
+        MINS, MAXS = [], []
+        for i in range(0, self.nSamples, chunk):
+            x = np.asarray(self.read(slice(i, min([i+chunk, self.nSamples]))))
+            bMin, bMax = block_min_max(x, x, base)
+            MINS.append(bMin)
+            MAXS.append(bMax)
+        self.levels = [(np.concatenate(MINS, axis=-1),
+                        np.concatenate(MAXS, axis=-1))]
+
+        # coarser levels
+        while self.levels[-1][0].shape[-1]>min_blocks:
+            self.levels.append(block_min_max(*self.levels[-1], factor))
+
+        # extrema over the whole recording (e.g. for the normalization)
+        self.min = self.levels[-1][0].min(axis=-1)
+        self.max = self.levels[-1][1].max(axis=-1)
+
+    def block_size(self, level):
+        return self.base*self.factor**level
+
+    def read(self, time_slice, rows=None):
+        """ raw samples """
+        if len(self.shape)==1:
+            return self.source[time_slice]
+        elif rows is None:
+            return self.source[:,time_slice]
+        else:
+            return self.source[rows,time_slice]
+
+    def times(self, indices):
+        if self.timestamps is not None:
+            return self.timestamps[indices]
+        else:
+            return self.starting_time+np.asarray(indices)/self.rate
+
+    def indices(self, t1, t2):
+        """ [i1, i2[ range of the samples such that t1<=t<=t2 """
+        if self.timestamps is not None:
+            i1 = np.searchsorted(self.timestamps, t1, side='left')
+            i2 = np.searchsorted(self.timestamps, t2, side='right')
+        else:
+            i1 = int(np.ceil((t1-self.starting_time)*self.rate))
+            i2 = int(np.floor((t2-self.starting_time)*self.rate))+1
+        i1 = min([max([0, i1]), self.nSamples])
+        return i1, min([max([i1, i2]), self.nSamples])
+
+    def query(self, t1, t2, npixels,
+              rows=None,
+              which='min-max'):
+        """
+        samples to display the window [t1, t2] on "npixels" pixels
+
+        rows: indices of the traces (2D source), all if None
+        which: 'min-max' -> the min and max of each block, interleaved
+                                (2 points per block, at the block center)
+               'max' or 'min' -> one point per block
+
+        returns (t, y), with y of shape (len(t),) or (nRows, len(t)),
+            the raw samples when the window has less than base*npixels samples
+        """
+        i1, i2 = self.indices(t1, t2)
+
+        # coarsest level with at least one block per pixel
+        level = -1
+        while (level+1<len(self.levels)) and\
+                ((i2-i1)>=npixels*self.block_size(level+1)):
+            level += 1
+
+        if level<0:
+            return self.times(np.arange(i1, i2)),\
+                        np.asarray(self.read(slice(i1, i2), rows))
+
+        n = self.block_size(level)
+        b1, b2 = i1//n, -(-i2//n)
+        mins, maxs = self.levels[level][0][...,b1:b2], self.levels[level][1][...,b1:b2]
+        if (rows is not None) and (len(self.shape)>1):
+            mins, maxs = mins[rows], maxs[rows]
+
+        t = self.times(np.clip(np.arange(b1, b2)*n+n//2, i1, i2-1))
+        if which=='max':
+            return t, maxs
+        elif which=='min':
+            return t, mins
+        else:
+            return np.repeat(t, 2),\
+                np.stack([mins, maxs], axis=-1).reshape(mins.shape[:-1]+(2*(b2-b1),))
+
+
+def get_envelope(data, key, source, **kwargs):
+    """
+    envelope pyramid of a trace of the "data" object, built at the first call
+        and stored in "data.envelopes" (rebuilt if the source array was replaced)
+    """
+    if not hasattr(data, 'envelopes'):
+        data.envelopes = {}
+    if (key not in data.envelopes) or (data.envelopes[key].source is not source):
+        data.envelopes[key] = EnvelopePyramid(source, **kwargs)
+    return data.envelopes[key]
@@ -5,6 +5,8 @@ import matplotlib.pylab as plt
 from scipy.ndimage import filters
 
 from physion.dataviz import tools as dv_tools
+from physion.dataviz.envelope import EnvelopePyramid, get_envelope,\
+        timing_of, axes_width
 import physion.utils.plot_tools as pt
 
 def add_CaImagingRaster(data, tlim, ax, raster=None,
@@ -21,7 +23,27 @@ def add_CaImagingRaster(data, tlim, ax, raster=None,
                         axb=None,
                         bar_inset_start=-0.02, bar_inset_width=0.01,
                         normalization='per-line', subsampling=1,
+                        envelope=True, npixels=None,
                         name=''):
+    """
+    envelope: maximum over the time blocks of the envelope pyramid
+                on "npixels" (default: axes width) columns,
+              otherwise a "[::subsampling]" stride over the frames
+    """
+
+    if envelope:
+        add_CaImagingRasterEnvelope(data, tlim, ax, raster=raster,
+                                    fig_fraction_start=fig_fraction_start,
+                                    fig_fraction=fig_fraction,
+                                    subquantity=subquantity,
+                                    roiIndices=roiIndices,
+                                    subquantity_args=subquantity_args,
+                                    cmap=cmap, axb=axb,
+                                    bar_inset_start=bar_inset_start,
+                                    bar_inset_width=bar_inset_width,
+                                    normalization=normalization,
+                                    npixels=npixels, name=name)
+        return
 
     if (subquantity in ['Fluorescence', 'rawFluo']) and (raster is None):
         if (type(roiIndices)==str) and (roiIndices=='all'):
@@ -52,8 +74,8 @@ def add_CaImagingRaster(data, tlim, ax, raster=None,
         # checking more than one ROI to plot the raster
 
         if normalization in ['per line', 'per-line', 'per cell', 'per-cell']:
-            raster = np.array([(raster[i,:]-np.min(raster[i,:]))/(np.max(raster[i,:])-\
-                                    np.min(raster[i,:])) for i in range(raster.shape[0])])
+            rMin, rMax = np.min(raster, axis=1), np.max(raster, axis=1)
+            raster = (raster-rMin[:,np.newaxis])/(rMax-rMin)[:,np.newaxis]
             
         indices=np.arange(*dv_tools.convert_times_to_indices(*tlim,
                                     data.Neuropil, axis=1))[::subsampling]
@@ -64,33 +86,109 @@ def add_CaImagingRaster(data, tlim, ax, raster=None,
                         dv_tools.convert_index_to_time(indices[-1], data.Neuropil),
                         fig_fraction_start, fig_fraction_start+fig_fraction))
 
-        if normalization in ['per line', 'per-line', 'per cell', 'per-cell']:
+        add_CaImagingRasterAnnotations(data, tlim, ax, ims, raster.shape[0],
+                                       fig_fraction_start=fig_fraction_start,
+                                       fig_fraction=fig_fraction,
+                                       subquantity=subquantity, axb=axb,
+                                       bar_inset_start=bar_inset_start,
+                                       bar_inset_width=bar_inset_width,
+                                       normalization=normalization, name=name)
+
+
+def add_CaImagingRasterAnnotations(data, tlim, ax, ims, nROIs,
+                                   fig_fraction_start=0., fig_fraction=1.,
+                                   subquantity='Fluorescence',
+                                   axb=None,
+                                   bar_inset_start=-0.02, bar_inset_width=0.01,
+                                   normalization='per-line',
+                                   name=''):
+
+    if normalization in ['per line', 'per-line', 'per cell', 'per-cell']:
+
+        if axb is None:
+            axb = pt.inset(ax, [bar_inset_start, fig_fraction_start+.1*fig_fraction,
+                                bar_inset_width, .6*fig_fraction], facecolor='w')
+
+        cb = plt.colorbar(ims, cax=axb)
+        cb.set_ticks([])
+        axb.set_ylabel('$\\Delta$F/F' if (subquantity in ['dFoF', 'dF/F']) else ' fluo.', fontsize=9)
+        axb.annotate('max', (0.5,1.1), fontsize=7,
+                xycoords='axes fraction', ha='center')
+        axb.annotate('min', (0.5,-0.1), fontsize=7, va='top',
+                xycoords='axes fraction', ha='center')
+
+    dv_tools.add_name_annotation(data, ax, name, tlim,
+            fig_fraction, fig_fraction_start, rotation=90)
+
+    ax.annotate('1', (tlim[1], fig_fraction_start), xycoords='data')
+    ax.annotate('%i' % nROIs,
+                (tlim[1], fig_fraction_start+fig_fraction), va='top', xycoords='data')
+    ax.annotate('ROIs', 
+                (tlim[1], fig_fraction_start+fig_fraction/2.),
+                va='center',
+                # rotation=-90,
+                xycoords='data',
+                fontsize=8)
+
+
+def add_CaImagingRasterEnvelope(data, tlim, ax, raster=None,
+                                fig_fraction_start=0., fig_fraction=1.,
+                                subquantity='Fluorescence',
+                                roiIndices='all',
+                                subquantity_args={},
+                                cmap=plt.cm.binary,
+                                axb=None,
+                                bar_inset_start=-0.02, bar_inset_width=0.01,
+                                normalization='per-line',
+                                npixels=None,
+                                name=''):
+    """
+    raster from the envelope pyramid of the whole quantity (cached in "data"),
+        the ROIs are selected and normalized at query time
+    """
+
+    rows = None if ((type(roiIndices)==str) and (roiIndices=='all')) else roiIndices
+
+    if raster is not None:
+        envelope = EnvelopePyramid(raster, **timing_of(data.Neuropil))
+    elif subquantity in ['Neuropil', 'neuropil']:
+        envelope = get_envelope(data, 'neuropil', data.neuropil,
+                                **timing_of(data.Neuropil))
+    elif subquantity in ['dFoF', 'dF/F']:
+        if not hasattr(data, 'dFoF'):
+            data.build_dFoF(**subquantity_args)
+        envelope = get_envelope(data, 'dFoF', data.dFoF,
+                                **timing_of(data.Neuropil))
+    else:
+        envelope = get_envelope(data, 'rawFluo', data.rawFluo,
+                                **timing_of(data.Neuropil))
 
-            if axb is None:
-                axb = pt.inset(ax, [bar_inset_start, fig_fraction_start+.1*fig_fraction,
-                                    bar_inset_width, .6*fig_fraction], facecolor='w')
+    nROIs = envelope.shape[0] if rows is None else len(rows)
 
-            cb = plt.colorbar(ims, cax=axb)
-            cb.set_ticks([])
-            axb.set_ylabel('$\\Delta$F/F' if (subquantity in ['dFoF', 'dF/F']) else ' fluo.', fontsize=9)
-            axb.annotate('max', (0.5,1.1), fontsize=7,
-                    xycoords='axes fraction', ha='center')
-            axb.annotate('min', (0.5,-0.1), fontsize=7, va='top',
-                    xycoords='axes fraction', ha='center')
+    if nROIs>1:
+        # checking more than one ROI to plot the raster
 
-            
-        dv_tools.add_name_annotation(data, ax, name, tlim,
-                fig_fraction, fig_fraction_start, rotation=90)
-
-        ax.annotate('1', (tlim[1], fig_fraction_start), xycoords='data')
-        ax.annotate('%i' % raster.shape[0],
-                    (tlim[1], fig_fraction_start+fig_fraction), va='top', xycoords='data')
-        ax.annotate('ROIs', 
-                    (tlim[1], fig_fraction_start+fig_fraction/2.),
-                    va='center',
-                    # rotation=-90,
-                    xycoords='data',
-                    fontsize=8)
+        t, image = envelope.query(*tlim, npixels or axes_width(ax),
+                                  rows=rows, which='max')
+
+        if normalization in ['per line', 'per-line', 'per cell', 'per-cell']:
+            rMin, rMax = envelope.min, envelope.max
+            if rows is not None:
+                rMin, rMax = rMin[rows], rMax[rows]
+            image = (image-rMin[:,np.newaxis])/(rMax-rMin)[:,np.newaxis]
+
+        ims = ax.imshow(image, origin='lower', cmap=cmap,
+                aspect='auto', interpolation='none', vmin=0, vmax=1,
+                extent=(t[0], t[-1],
+                        fig_fraction_start, fig_fraction_start+fig_fraction))
+
+        add_CaImagingRasterAnnotations(data, tlim, ax, ims, nROIs,
+                                       fig_fraction_start=fig_fraction_start,
+                                       fig_fraction=fig_fraction,
+                                       subquantity=subquantity, axb=axb,
+                                       bar_inset_start=bar_inset_start,
+                                       bar_inset_width=bar_inset_width,
+                                       normalization=normalization, name=name)
 
     
     
@@ -102,9 +200,15 @@ def add_CaImaging(data, tlim, ax,
                   scale_side='left',
                   vicinity_factor=1, 
                   subsampling=1, 
+                  envelope=True, npixels=None,
                   name='[Ca] imaging',
                   annotation_side='left',
                   sigma=0):
+    """
+    envelope: min/max envelope on "npixels" (default: axes width) pixels,
+                otherwise a "[::subsampling]" stride over the frames
+                (always the case with a gaussian smoothing, "sigma">0)
+    """
 
     if (subquantity in ['dF/F', 'dFoF']) and (not hasattr(data, 'dFoF')):
         data.build_dFoF(**dFoF_args)
@@ -117,15 +221,28 @@ def add_CaImaging(data, tlim, ax,
     else:
         COLORS = [str(color) for n in range(len(roiIndices))]
 
-    i1, i2 = dv_tools.convert_times_to_indices(*tlim, data.Neuropil, axis=1)
-    t = np.array(data.Neuropil.timestamps[:])[np.arange(i1,i2)][::subsampling]
+    if envelope and (sigma==0):
+        key = 'dFoF' if (subquantity in ['dF/F', 'dFoF']) else 'rawFluo'
+        t, Y = get_envelope(data, key, getattr(data, key),
+                            **timing_of(data.Neuropil)).query(*tlim,
+                                    npixels or axes_width(ax), rows=roiIndices)
+    else:
+        i1, i2 = dv_tools.convert_times_to_indices(*tlim, data.Neuropil, axis=1)
+        t = np.array(data.Neuropil.timestamps[:])[np.arange(i1,i2)][::subsampling]
 
     for n, ir in zip(range(len(roiIndices))[::-1], roiIndices[::-1]):
 
         ypos = n*fig_fraction/len(roiIndices)/vicinity_factor+\
                 fig_fraction_start # bottom position
 
-        if (subquantity in ['dF/F', 'dFoF']):
+        if envelope and (sigma==0):
+            dv_tools.plot_scaled_signal(data, ax, t, Y[n], tlim, 1.,
+                   ax_fraction_extent=fig_fraction/len(roiIndices),
+                   ax_fraction_start=ypos, color=color,
+                   scale_side=scale_side,
+                   scale_unit_string=(('%.0f$\\Delta$F/F' if (key=='dFoF') else\
+                                                'fluo (a.u.)') if (n==0) else ''))
+        elif (subquantity in ['dF/F', 'dFoF']):
             if sigma > 0 :
                 y = filters.gaussian_filter1d(data.dFoF[ir, np.arange(i1,i2)][::subsampling], sigma)
             else : 
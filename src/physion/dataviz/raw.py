@@ -4,6 +4,7 @@ import numpy as np
 import matplotlib.pylab as plt
 
 from physion.dataviz import tools as dv_tools
+from physion.dataviz.envelope import get_envelope, timing_of, axes_width
 from physion.dataviz.imaging import *
 
 from physion.analysis import read_NWB
@@ -12,12 +13,21 @@ from physion.analysis import read_NWB
 def add_Photodiode(data, tlim, ax,
                    fig_fraction_start=0., fig_fraction=1.,
                    subsampling=10,
+                   envelope=True, npixels=None,
                    color='#808080',
                    name='photodiode'):
-    i1, i2 = dv_tools.convert_times_to_indices(*tlim, data.nwbfile.acquisition['Photodiode-Signal'])
-    t = dv_tools.convert_index_to_time(range(i1,i2),
-            data.nwbfile.acquisition['Photodiode-Signal'])[::subsampling]
-    y = data.nwbfile.acquisition['Photodiode-Signal'].data[i1:i2][::subsampling]
+    """
+    envelope: min/max envelope on "npixels" (default: axes width) pixels,
+                otherwise a "[::subsampling]" stride over the samples
+    """
+    signal = data.nwbfile.acquisition['Photodiode-Signal']
+    if envelope:
+        t, y = get_envelope(data, 'Photodiode', signal.data,
+                            **timing_of(signal)).query(*tlim, npixels or axes_width(ax))
+    else:
+        i1, i2 = dv_tools.convert_times_to_indices(*tlim, signal)
+        t = dv_tools.convert_index_to_time(np.arange(i1,i2), signal)[::subsampling]
+        y = signal.data[i1:i2][::subsampling]
 
     dv_tools.plot_scaled_signal(data,ax, t, y, tlim, 1e-5,
                                 ax_fraction_extent=fig_fraction,
@@ -50,14 +60,20 @@ def add_Locomotion(data, tlim, ax,
                    fig_fraction_start=0., fig_fraction=1., subsampling=2,
                    speed_scale_bar=1, # cm/s
                    scale_side='left',
+                   envelope=True, npixels=None,
                    color='#1f77b4', name='run. speed'):
 
     if not hasattr(data, 'running_speed'):
         data.build_running_speed()
 
-    i1, i2 = dv_tools.convert_times_to_indices(*tlim,
-            data.nwbfile.acquisition['Running-Speed'])
-    x, y = data.t_running_speed[i1:i2][::subsampling], data.running_speed[i1:i2][::subsampling]
+    if envelope:
+        x, y = get_envelope(data, 'Locomotion', data.running_speed,
+                            **timing_of(data.nwbfile.acquisition['Running-Speed'])\
+                                ).query(*tlim, npixels or axes_width(ax))
+    else:
+        i1, i2 = dv_tools.convert_times_to_indices(*tlim,
+                data.nwbfile.acquisition['Running-Speed'])
+        x, y = data.t_running_speed[i1:i2][::subsampling], data.running_speed[i1:i2][::subsampling]
 
     dv_tools.plot_scaled_signal(data, ax, x, y,
                                 tlim, speed_scale_bar,
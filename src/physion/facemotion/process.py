@@ -1,4 +1,5 @@
-import sys, os, pathlib, time
+import sys, os, pathlib, time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy.interpolate import interp1d
 from scipy.sparse.linalg import eigsh
@@ -47,6 +48,9 @@ def set_ROI_area(cls,
 
         cls.Nx = cls.fullx[cls.zoom_cond].max()-cls.fullx[cls.zoom_cond].min()+1
         cls.Ny = cls.fully[cls.zoom_cond].max()-cls.fully[cls.zoom_cond].min()+1
+        # the zoom area is a rectangle -> slices equivalent to the mask
+        cls.zoom = (slice(cls.fullx[cls.zoom_cond].min(), cls.fullx[cls.zoom_cond].max()+1),
+                    slice(cls.fully[cls.zoom_cond].min(), cls.fully[cls.zoom_cond].max()+1))
     else:
         print('need to provide coords or to create ROI !!')
 
@@ -71,30 +75,109 @@ def load_ROI_data(cls, iframe1=0, iframe2=100,
     return DATA
     
 
+def load_ROI_block(camData, zoom, frames):
+    """
+    reads the zoom area (slices) of a set of frames 
+        -> array of shape (len(frames), Nx, Ny) in the original dtype
+
+    binary files are memory-mapped (only the needed frames are read)
+
+    also returns the boolean array of successfully read frames
+    """
+    frames = np.asarray(frames, dtype=int)
+
+    if camData.frames is not None:
+        # frames are stored transposed, see CameraData.get
+        return np.array(camData.frames[frames, zoom[1], zoom[0]].transpose(0,2,1)),\
+                np.ones(len(frames), dtype=bool)
+
+    valid = np.ones(len(frames), dtype=bool)
+    DATA = None
+    for i, frame in enumerate(frames):
+        try:
+            img = camData.get(frame)[zoom]
+            if DATA is None:
+                DATA = np.zeros((len(frames), *img.shape), dtype=img.dtype)
+            DATA[i] = img
+        except ValueError:
+            print('problem with frame #', frame)
+            valid[i] = False
+
+    return DATA, valid
+
+
+def compute_block_motion(camData, zoom, frames):
+    """
+    motion (mean squared difference with the next frame) of a block of frames
+
+    each needed frame is read once, and the differences of the whole block
+        are computed in a single step
+    """
+    frames = np.asarray(frames, dtype=int)
+    needed = np.unique(np.concatenate([frames, frames+1]))
+    imgs, valid = load_ROI_block(camData, zoom, needed)
+
+    i0, i1 = np.searchsorted(needed, frames), np.searchsorted(needed, frames+1)
+    motion = np.zeros(len(frames))
+    cond = valid[i0] & valid[i1]
+    if np.sum(cond)>0:
+        diff = imgs[i1[cond]].astype(np.float64)
+        diff -= imgs[i0[cond]]
+        diff **= 2
+        motion[cond] = np.mean(diff.reshape(len(diff), -1), axis=1)
+
+    return motion
+
+
+def compute_block_motion_worker(args):
+    """
+    args = (folder, name, zoom, frames), run in the worker processes
+    """
+    # import here to keep the worker processes light at startup
+    from physion.utils.camera import CameraData
+
+    folder, name, zoom, frames = args
+    return compute_block_motion(CameraData(name, folder=folder, verbose=False),
+                                zoom, frames)
 
 
 def compute_motion(cls,
                    time_subsampling=5,
+                   block_size=100,
+                   nproc=1,
                    with_ProgressBar=False):
     """
+    face motion: mean squared difference between consecutive frames
+        (evaluated every "time_subsampling" frames)
 
+    frames are processed by blocks of "block_size" frames,
+        blocks can be processed in parallel by "nproc" processes
     """
     frames = np.arange(cls.camData.nFrames)[::time_subsampling]
-    motion = np.zeros(len(frames)-1)
+
+    BLOCKS = [frames[:-1][i:i+block_size] for i in range(0, len(frames)-1, block_size)]
 
     if with_ProgressBar:
-        printProgressBar(0, cls.camData.nFrames)
+        printProgressBar(0, len(BLOCKS))
+
+    MOTION = []
+    if nproc>1:
+        # "spawn" for fresh states in the workers (no forked video captures)
+        with ProcessPoolExecutor(max_workers=nproc,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            for motion in pool.map(compute_block_motion_worker,
+                                   [(cls.camData.folder, cls.camData.name, cls.zoom, block)\
+                                                for block in BLOCKS]):
+                MOTION.append(motion)
+                if with_ProgressBar:
+                    printProgressBar(len(MOTION), len(BLOCKS))
+    else:
+        for block in BLOCKS:
+            MOTION.append(compute_block_motion(cls.camData, cls.zoom, block))
+            if with_ProgressBar:
+                printProgressBar(len(MOTION), len(BLOCKS))
 
-    for i, frame in enumerate(frames[:-1]):
-        try:
-            imgs = load_ROI_data(cls, frame, frame+2, flatten=True)
-            motion[i] = np.mean(np.diff(imgs,axis=0)**2)
-        except ValueError:
-            print('problem with frame #', frame)
-            pass # TO BE REMOVED !!
-        
-        if with_ProgressBar and (i%20==0):
-            printProgressBar(frame, cls.camData.nFrames)
+    motion = np.concatenate(MOTION) if len(MOTION)>0 else np.zeros(0)
        
     # ensure non-zero values, in mp4 movies you can have redundant frames
     for i in range(1,len(motion)):
@@ -112,6 +195,7 @@ if __name__=='__main__':
     parser.add_argument('-df', "--datafolder", type=str,
             default='/home/yann/UNPROCESSED/2021_05_20/13-59-57/')
     parser.add_argument('-ts', "--time_subsampling", type=int, default=1)
+    parser.add_argument("--nproc", type=int, default=1)
     parser.add_argument("--debug", action="store_true")
     args = parser.parse_args()
 
@@ -144,14 +228,16 @@ if __name__=='__main__':
             
             args.data = np.load(os.path.join(args.datafolder,
                                              'facemotion.npy'), allow_pickle=True).item()
-            load_folder(args)
+            from physion.utils.camera import CameraData
+            args.camData = CameraData('FaceCamera', folder=args.datafolder)
 
             set_ROI_area(args, roi_coords=args.data['ROI'])
             frames, motion = compute_motion(args,
                                             time_subsampling=args.time_subsampling,
+                                            nproc=args.nproc,
                                             with_ProgressBar=True)
             args.data['frame'] = frames
-            args.data['t'] = args.times[frames]
+            args.data['t'] = args.camData.times[frames]
             args.data['motion'] = motion
             np.save(os.path.join(args.datafolder, 'facemotion.npy'), args.data)
             print('Data successfully saved as "%s"' % os.path.join(args.datafolder, 'facemotion.npy'))
@@ -1,10 +1,15 @@
 """
 
+settings['storage']:
+    - 'frames' (default): one "[timestamp].npy" file per frame in "X-imgs"
+    - 'binary': frames appended to "X.bin" (see hardware/camera_writer.py)
 """
 import time, sys, os, cv2
 import numpy as np
 from pathlib import Path
 
+from physion.hardware.camera_writer import BinaryFrameWriter
+
 x=int(800/5)
 y=int(600/5)
 
@@ -18,6 +23,8 @@ class CameraAcquisition:
         self.name = name
         self.times, self.running = [], False
         self.dt = 1./settings['frame_rate']
+        self.storage = settings['storage'] if 'storage' in settings else 'frames'
+        self.writer = None
 
 
     def rec_and_check(self, run_flag, quit_flag, folder,
@@ -42,26 +49,41 @@ class CameraAcquisition:
 
                 self.running, self.times = True, []
                 # reinitialize recording
-                self.imgs_folder = os.path.join(folder.get(), '%s-imgs' % self.name)
-                Path(self.imgs_folder).mkdir(parents=True, exist_ok=True)
+                if self.storage=='binary':
+                    self.writer = BinaryFrameWriter(folder.get(), self.name)
+                else:
+                    self.imgs_folder = os.path.join(folder.get(), '%s-imgs' % self.name)
+                    Path(self.imgs_folder).mkdir(parents=True, exist_ok=True)
 
             elif self.running and not run_flag.is_set(): # running and we need to stop
 
                 self.running=False
+                self.close_writer()
                 print('%s -- effective sampling frequency: %.1f Hz ' %\
                         (self.name, 1./np.mean(np.diff(self.times))))
 
             # after the update
             if self.running:
 
-                np.save(os.path.join(self.imgs_folder, '%s.npy' % Time), image)
+                if self.writer is not None:
+                    self.writer.write(Time, image)
+                else:
+                    np.save(os.path.join(self.imgs_folder, '%s.npy' % Time), image)
                 self.times.append(Time)
 
+            time.sleep(max([0, self.dt-(time.time()-Time)]))
+
         if len(self.times)>0:
             print('%s -- effective sampling frequency: %.1f Hz ' % (\
                     self.name, 1./np.mean(np.diff(self.times))))
         
         self.running=False
+        self.close_writer()
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
 def launch_Camera(run_flag, quit_flag, datafolder,
                   name='RigCamera',
@@ -1,10 +1,15 @@
 """
 
+settings['storage']:
+    - 'frames' (default): one "[timestamp].npy" file per frame in "X-imgs"
+    - 'binary': frames appended to "X.bin" (see hardware/camera_writer.py)
 """
 import simple_pyspin, time, sys, os
 import numpy as np
 from pathlib import Path
 
+from physion.hardware.camera_writer import BinaryFrameWriter
+
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
 
 class stop_func: # dummy version of the multiprocessing.Event class
@@ -24,6 +29,8 @@ class CameraAcquisition:
         
         self.name = name
         self.times, self.running = [], False
+        self.storage = settings['storage'] if 'storage' in settings else 'frames'
+        self.writer = None
         self.init_camera(settings, 
                          index=camera_index)
 
@@ -63,7 +70,7 @@ class CameraAcquisition:
 
             except BaseException as be:
                 # print(be)
-                print('[X] problem FETCHING image', os.path.join(self.imgs_folder, '%s.npy' % Time), ' -> not saved ! ')
+                print('[X] problem FETCHING %s image at t=%s -> not saved ! ' % (self.name, Time))
                 image = None
 
 
@@ -71,31 +78,47 @@ class CameraAcquisition:
 
                 self.running, self.times = True, []
                 # reinitialize recording
-                self.imgs_folder = os.path.join(folder.get(), '%s-imgs' % self.name)
-                Path(self.imgs_folder).mkdir(parents=True, exist_ok=True)
+                if self.storage=='binary':
+                    self.writer = BinaryFrameWriter(folder.get(), self.name)
+                else:
+                    self.imgs_folder = os.path.join(folder.get(), '%s-imgs' % self.name)
+                    Path(self.imgs_folder).mkdir(parents=True, exist_ok=True)
 
             elif self.running and not run_flag.is_set(): # running and we need to stop
 
                 self.running=False
+                self.close_writer()
                 print('%s -- effective sampling frequency: %.1f Hz ' %\
                         (self.name, 1./np.mean(np.diff(self.times))))
                 
 
             # after the update
             if self.running and image is not None:
-                try:
-                    np.save(os.path.join(self.imgs_folder, '%s.npy' % Time), image)
-                except BaseException as be:
-                    # print(be)
-                    print('[X] problem SAVING image', os.path.join(self.imgs_folder, '%s.npy' % Time), ' -> not saved ! ')
+                if self.writer is not None:
+                    # queued, written by the background thread
+                    self.writer.write(Time, image)
+                    self.times.append(Time)
+                else:
+                    try:
+                        np.save(os.path.join(self.imgs_folder, '%s.npy' % Time), image)
+                        self.times.append(Time)
+                    except BaseException as be:
+                        # print(be)
+                        print('[X] problem SAVING image', os.path.join(self.imgs_folder, '%s.npy' % Time), ' -> not saved ! ')
 
         if len(self.times)>0:
             print('%s -- effective sampling frequency: %.1f Hz ' % (\
                     self.name, 1./np.mean(np.diff(self.times))))
         
         self.running=False
+        self.close_writer()
         self.cam.stop()
 
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
 def launch_Camera(run_flag, quit_flag, datafolder,
                   name='FaceCamera',
                   camera_index=0, 
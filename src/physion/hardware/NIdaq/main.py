@@ -1,4 +1,4 @@
-import nidaqmx, time
+import nidaqmx, time, os
 import numpy as np
 
 from nidaqmx.utils import flatten_channel_string
@@ -12,7 +12,40 @@ from physion.hardware.NIdaq.config import find_x_series_devices,\
        find_m_series_devices, get_analog_input_channels,\
        get_digital_input_channels, get_analog_output_channels
 
+
+def truncate_npy(filename, N):
+    """
+    truncates a ".npy" file of shape (Nchannels, Nsamples) in Fortran order 
+        to its first N samples (in place: header rewritten, file truncated)
+    """
+    with open(filename, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version==(1,0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        header = repr({'descr':np.lib.format.dtype_to_descr(dtype),
+                       'fortran_order':fortran_order,
+                       'shape':(shape[0], N)})
+        # same header length (padded with spaces, ending with a newline)
+        start = 8+(2 if version==(1,0) else 4)
+        f.seek(start)
+        f.write((header.ljust(offset-start-1)+'\n').encode('latin1'))
+        f.truncate(offset+shape[0]*N*dtype.itemsize)
+
+
 class Acquisition:
+    """
+    the data are written in preallocated arrays of the full recording size,
+        when a filename is given (e.g. "/path/to/NIdaq.npy"), 
+        those are memory-mapped ".npy" files (streamed to disk):
+            - "NIdaq.analog.npy" (Nchannel_analog_in, Nsamples) float64
+            - "NIdaq.digital.npy" (1, Nsamples) uint32
+            - "NIdaq.dt.npy" the sampling interval
+        truncated to the recorded samples on close 
+        (read them with physion.assembling.tools.load_NIdaq_data)
+    """
 
     def __init__(self,
                  sampling_rate=10000,
@@ -44,12 +77,10 @@ class Acquisition:
 
         # preparing input channels
         # - analog:
-        self.analog_data = np.zeros((Nchannel_analog_in, 1), dtype=np.float64)
         if self.Nchannel_analog_in>0:
             self.analog_input_channels = \
                     get_analog_input_channels(self.device)[:Nchannel_analog_in]
         # - digital:
-        self.digital_data = np.zeros((1, 1), dtype=np.uint32)
         if self.Nchannel_digital_in>0:
             self.digital_input_channels = \
                     get_digital_input_channels(self.device)[:Nchannel_digital_in]
@@ -88,10 +119,38 @@ class Acquisition:
 
         self.outputs = outputs      
 
+    def init_storage(self):
+        """
+        preallocates the data arrays (memory-mapped files if filename)
+            and the reading buffers, reused at each callback
+        """
+        self.Nanalog, self.Ndigital = 0, 0 # number of samples written
+        shapes = {'analog':(self.Nchannel_analog_in, self.Nsamples),
+                  'digital':(1, self.Nsamples if self.Nchannel_digital_in>0 else 0)}
+        dtypes = {'analog':np.float64, 'digital':np.uint32}
+        for key in ['analog', 'digital']:
+            if (self.filename is not None) and (np.prod(shapes[key])>0):
+                # Fortran order -> the successive buffers are contiguous on disk
+                setattr(self, '%s_data' % key,
+                        np.lib.format.open_memmap(\
+                                self.filename.replace('.npy', '.%s.npy' % key),
+                                mode='w+', dtype=dtypes[key], 
+                                shape=shapes[key], fortran_order=True))
+            else:
+                setattr(self, '%s_data' % key, 
+                        np.zeros(shapes[key], dtype=dtypes[key], order='F'))
+        self.analog_buffer = np.zeros((self.Nchannel_analog_in, self.buffer_size),
+                                      dtype=np.float64)
+        self.digital_buffer = np.zeros((1, self.buffer_size), dtype=np.uint32)
 
+        if self.filename is not None:
+            np.save(self.filename.replace('.npy', '.dt.npy'), 
+                    self.dt*np.ones(1))
             
     def launch(self):
 
+        self.init_storage()
+
         if self.outputs is not None:
             self.write_task = nidaqmx.Task()
 
@@ -185,35 +244,61 @@ class Acquisition:
                 self.write_task.close()
             self.sample_clk_task.close()
 
+        if hasattr(self, 'Nanalog') and not self.data_saved:
+            # restricting to the recorded samples
+            for key, N in zip(['analog', 'digital'], [self.Nanalog, self.Ndigital]):
+                data = getattr(self, '%s_data' % key)
+                if self.filename is None:
+                    setattr(self, '%s_data' % key, data[:,:N])
+                elif isinstance(data, np.memmap):
+                    data.flush()
+                    # the memory map is released before truncating the file
+                    setattr(self, '%s_data' % key, None)
+                    del data
+                    fn = self.filename.replace('.npy', '.%s.npy' % key)
+                    truncate_npy(fn, N)
+                    setattr(self, '%s_data' % key, np.load(fn, mmap_mode='r'))
+                else:
+                    setattr(self, '%s_data' % key, data[:,:N])
+                    np.save(self.filename.replace('.npy', '.%s.npy' % key), 
+                            getattr(self, '%s_data' % key))
+
         if (self.filename is not None):
             if self.data_saved:
                 print('[ok] NIdaq data already saved as: %s ' % self.filename)
             else:
-                np.save(self.filename,
-                        {'analog':self.analog_data[:,1:],
-                         'digital':self.digital_data[:,1:],
-                         'dt':self.dt})
-                print('[ok] NIdaq data saved as: %s ' % self.filename)
+                print('[ok] NIdaq data saved as: %s ' % self.filename.replace('.npy', '.*.npy'))
             self.data_saved = True
             
         self.running = False
 
         if return_data:
-            return self.analog_data[:,1:], self.digital_data[:,1:], self.dt
+            return self.analog_data, self.digital_data, self.dt
         
     def reading_task_callback(self, task_idx, event_type, num_samples, callback_data=None):
+        """
+        the buffers are copied into the preallocated data arrays
+            -> constant cost per callback
+        """
         if self.running:
             try:
                 if self.Nchannel_analog_in>0:
-                    analog_buffer = np.zeros((self.Nchannel_analog_in, num_samples), dtype=np.float64)
-                    self.analog_reader.read_many_sample(analog_buffer, num_samples, timeout=WAIT_INFINITELY)
-                    self.analog_data = np.append(self.analog_data, analog_buffer, axis=1)
+                    n = min([num_samples, self.Nsamples-self.Nanalog])
+                    if n!=self.analog_buffer.shape[1]:
+                        # (the readers need a contiguous buffer of size n)
+                        self.analog_buffer = np.zeros((self.Nchannel_analog_in, n), dtype=np.float64)
+                    self.analog_reader.read_many_sample(self.analog_buffer, n, timeout=WAIT_INFINITELY)
+                    self.analog_data[:,self.Nanalog:self.Nanalog+n] = self.analog_buffer
+                    self.Nanalog += n
                 
                 if self.Nchannel_digital_in>0:
-                    digital_buffer = np.zeros((1, num_samples), dtype=np.uint32)
-                    self.digital_reader.read_many_sample_port_uint32(digital_buffer,
-                                                                 num_samples, timeout=WAIT_INFINITELY)
-                    self.digital_data = np.append(self.digital_data, digital_buffer, axis=1)
+                    n = min([num_samples, self.Nsamples-self.Ndigital])
+                    if n!=self.digital_buffer.shape[1]:
+                        self.digital_buffer = np.zeros((1, n), dtype=np.uint32)
+                    self.digital_reader.read_many_sample_port_uint32(self.digital_buffer,
+                                                                 n, timeout=WAIT_INFINITELY)
+                    self.digital_data[:,self.Ndigital:self.Ndigital+n] = self.digital_buffer
+                    self.Ndigital += n
             except nidaqmx.errors.DaqError:
                 # print('process already closed')
                 pass
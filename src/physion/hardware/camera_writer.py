@@ -0,0 +1,126 @@
+"""
+Writer of camera frames into a single contiguous binary file
+
+    instead of one "[timestamp].npy" file per frame in the "X-imgs" folder,
+    the frames are appended to "X.bin" (C-order, shape: nFrames x Ly x Lx)
+    with their index in "X-summary.npy" ("times_binary", "imageSize_binary",
+    "dtype_binary"), i.e. the binary format read by physion.utils.camera.CameraData
+
+    - the writes are done in a background thread fed by a bounded queue,
+        the acquisition loop never waits for the disk
+        (frames are dropped and counted when the queue is full)
+    - the summary is saved periodically (a killed acquisition remains readable)
+    - the last frame is saved every "preview_interval" seconds in "X-last.npy"
+        (for the online display)
+"""
+import os, time, queue, threading
+import numpy as np
+
+
+class BinaryFrameWriter:
+
+    def __init__(self, folder, name,
+                 queue_size=300,
+                 summary_interval=1000,
+                 preview_interval=0.5):
+
+        self.name = name
+        self.filename = os.path.join(folder, '%s.bin' % name)
+        self.summary_file = os.path.join(folder, '%s-summary.npy' % name)
+        self.preview_file = os.path.join(folder, '%s-last.npy' % name)
+
+        self.summary_interval = summary_interval
+        self.preview_interval = preview_interval
+
+        self.times, self.dropped = [], 0
+        self.shape, self.dtype = None, None
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = open(self.filename, 'wb')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, Time, image):
+        """
+        called by the acquisition loop, never blocks
+
+        returns False if the frame was dropped (full queue)
+        """
+        try:
+            self.queue.put_nowait((Time, image))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def run(self):
+        """ background thread: writes the queued frames """
+
+        last_preview = 0
+        while True:
+
+            item = self.queue.get()
+            if item is None:
+                break
+            Time, image = item
+
+            if self.shape is None:
+                self.shape, self.dtype = image.shape, image.dtype
+            elif image.shape!=self.shape:
+                print('[X] %s frame of shape %s instead of %s -> not saved ! ' % (\
+                        self.name, image.shape, self.shape))
+                self.dropped += 1
+                continue
+
+            try:
+                self.file.write(np.ascontiguousarray(image,
+                                                     dtype=self.dtype).tobytes())
+                self.times.append(Time)
+            except BaseException as be:
+                print(be)
+                print('[X] problem SAVING %s frame at t=%s -> not saved ! ' % (\
+                        self.name, Time))
+                self.dropped += 1
+
+            if len(self.times)%self.summary_interval==0:
+                self.file.flush()
+                self.save_summary()
+
+            if (Time-last_preview)>self.preview_interval:
+                self.save_preview(image)
+                last_preview = Time
+
+        self.file.close()
+
+    def save_summary(self):
+        """ index of the binary file (written to a temporary file first) """
+        if self.shape is None:
+            return
+        summary = {'times':np.array(self.times),
+                   'times_binary':np.array(self.times),
+                   'imageSize_binary':(self.shape[1], self.shape[0]),
+                   'dtype_binary':str(self.dtype),
+                   'dropped_frames':self.dropped}
+        # np.save adds ".npy" to names without it
+        np.save(self.summary_file.replace('.npy', '.tmp.npy'), summary)
+        os.replace(self.summary_file.replace('.npy', '.tmp.npy'), self.summary_file)
+
+    def save_preview(self, image):
+        try:
+            np.save(self.preview_file.replace('.npy', '.tmp.npy'), image)
+            os.replace(self.preview_file.replace('.npy', '.tmp.npy'),
+                       self.preview_file)
+        except BaseException:
+            pass # only for display
+
+    def close(self):
+        """ waits for the queued frames to be written """
+
+        self.queue.put(None)
+        self.thread.join()
+        self.save_summary()
+        if self.dropped>0:
+            print('[!!] %s -- %i frames dropped ' % (self.name, self.dropped))
+        print('[ok] %s -- %i frames saved in "%s" ' % (\
+                self.name, len(self.times), self.filename))
+
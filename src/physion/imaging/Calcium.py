@@ -2,7 +2,7 @@ import numpy as np
 from scipy.ndimage import gaussian_filter1d, minimum_filter1d, maximum_filter1d
 from scipy.signal import convolve, windows
 from scipy.interpolate import interp1d
-from sklearn.linear_model import LinearRegression
+from numba import njit, prange
 import time
 
 ##############################################################################
@@ -11,9 +11,9 @@ import time
 
 ROI_TO_NEUROPIL_INCLUSION_FACTOR = 1.0 # ratio to discard ROIs with weak fluo compared to neuropil
 ROI_TO_NEUROPIL_INCLUSION_FACTOR_METRIC = 'mean' # either 'mean' or 'std'
-METHOD = 'percentile' # either 'minimum', 'percentile', 'sliding_minimum', 'sliding_percentile', 'hamming', 'sliding_minmax'
-T_SLIDING = 300. # seconds (used only if METHOD= 'sliding_minimum' | 'sliding_percentile' | 'hamming' | 'sliding_minmax')
-PERCENTILE = 10. # for baseline (used only if METHOD= 'percentile' | 'sliding_percentile' | 'hamming')
+METHOD = 'percentile' # either 'minimum', 'percentile', 'sliding_minimum', 'sliding_percentile', 'sliding_percentile_exact', 'hamming', 'sliding_minmax'
+T_SLIDING = 300. # seconds (used only if METHOD= 'sliding_minimum' | 'sliding_percentile' | 'sliding_percentile_exact' | 'hamming' | 'sliding_minmax')
+PERCENTILE = 10. # for baseline (used only if METHOD= 'percentile' | 'sliding_percentile' | 'sliding_percentile_exact' | 'hamming')
 NEUROPIL_CORRECTION_FACTOR = 0.8 # fraction of neuropil substracted to fluorescence
 
 # -------------------------------------------------------------------------- #
@@ -83,6 +83,110 @@ def compute_sliding_percentile(array, percentile, Window,
 
     return Flow
 
+@njit(["void(int64[:], int64, int64)"], cache=True)
+def fenwick_add(tree, rank, value):
+    """ adds "value" at "rank" in the Fenwick (binary indexed) tree """
+    i = rank+1
+    while i<tree.shape[0]:
+        tree[i] += value
+        i += i & (-i)
+
+@njit(["int64(int64[:], int64)"], cache=True)
+def fenwick_kth(tree, k):
+    """ rank of the k-th (0-based) element present in the Fenwick tree """
+    N = tree.shape[0]-1
+    step = 1
+    while 2*step<=N:
+        step *= 2
+    pos, remaining = 0, k+1
+    while step>0:
+        if (pos+step<=N) and (tree[pos+step]<remaining):
+            pos += step
+            remaining -= tree[pos]
+        step = step//2
+    return pos
+
+@njit(["void(float64[:], int64, int64, int64, float64, float64[:])"], cache=True)
+def sliding_percentile_trace(F, Window, klow, khigh, gamma, Flow):
+    """
+    exact sliding percentile on a single trace:
+        Flow[i] = percentile of F[i:i+Window] (np.percentile "linear" method)
+
+    the values present in the window are counted in a Fenwick tree 
+        over their ranks in the sorted trace, so that each step
+        (one value in, one value out, two order statistics) is O(log N)
+    """
+    N = F.shape[0]
+    order = np.argsort(F, kind='mergesort')
+    sortedF = F[order]
+    rank = np.empty(N, dtype=np.int64)
+    for i in range(N):
+        rank[order[i]] = i
+    tree = np.zeros(N+1, dtype=np.int64)
+
+    nNaNs = 0
+    for i in range(Window-1):
+        fenwick_add(tree, rank[i], 1)
+        if np.isnan(F[i]):
+            nNaNs += 1
+
+    for i in range(N-Window+1):
+        # adding the new value
+        fenwick_add(tree, rank[i+Window-1], 1)
+        if np.isnan(F[i+Window-1]):
+            nNaNs += 1
+        if nNaNs>0:
+            Flow[i] = np.nan
+        else:
+            # interpolation as in numpy's "_lerp"
+            a = sortedF[fenwick_kth(tree, klow)]
+            b = sortedF[fenwick_kth(tree, khigh)]
+            if gamma>=0.5:
+                Flow[i] = b-(b-a)*(1-gamma)
+            else:
+                Flow[i] = a+(b-a)*gamma
+        # removing the oldest value
+        fenwick_add(tree, rank[i], -1)
+        if np.isnan(F[i]):
+            nNaNs -= 1
+
+@njit(["void(float64[:,:], int64, int64, int64, float64, float64[:,:])"],
+      parallel=True, cache=True)
+def sliding_percentile_matrix(F, Window, klow, khigh, gamma, Flow):
+    """ exact sliding percentile on many ROIs parallelized with prange  """
+    for n in prange(F.shape[0]):
+        sliding_percentile_trace(F[n], Window, klow, khigh, gamma, Flow[n])
+
+def compute_sliding_percentile_exact(array, percentile, Window):
+    """
+    exact sliding percentile over a window (no subsampling, no smoothing)
+        for all ROIs at once, O(N log N) per ROI
+
+    the values at the boundaries are handled as in "sliding_percentile"
+    """
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    N = array.shape[1]
+    Window = min([max([1, int(Window)]), N])
+
+    # order statistics needed for the "linear" percentile (see np.percentile)
+    q = np.true_divide(percentile, 100)
+    virtual_index = (Window-1)*q
+    klow = int(np.floor(virtual_index))
+    gamma = float(virtual_index-klow)
+    khigh = min([max([0, klow+1]), Window-1])
+    klow = min([max([0, klow]), Window-1])
+
+    y = np.zeros((array.shape[0], N-Window+1))
+    sliding_percentile_matrix(array, Window, klow, khigh, gamma, y)
+
+    # clean up boundaries
+    Flow = np.zeros(array.shape)
+    Flow[:,:int(Window/2)] = y[:,:1]
+    Flow[:,int(Window/2):int(Window/2)+y.shape[1]] = y
+    Flow[:,int(Window/2)+y.shape[1]:] = y[:,-1:]
+
+    return Flow
+
 def compute_sliding_minimum(array, Window,
                             pre_smoothing=0,
                             with_smoothing=False):
@@ -145,6 +249,10 @@ def compute_F0(data, F,
                                           int(sliding_window/data.CaImaging_dt),
                                           with_smoothing=True)
 
+    elif method=='sliding_percentile_exact':
+        return compute_sliding_percentile_exact(F, percentile,
+                                                int(sliding_window/data.CaImaging_dt))
+
     elif method=='hamming':
         return compute_hamming(F, int(sliding_window/data.CaImaging_dt), percentile)
     
@@ -155,42 +263,83 @@ def compute_F0(data, F,
         print('\n --- method not recognized --- \n ')
 
 
+def compute_neuropil_slopes(F, Fneu):
+    """
+    slope of the linear relationship between the low fluorescence levels (5th 
+        percentile) and the neuropil levels (binned in 20 percentile bins)
+        for each ROI
+
+    all ROIs at once:
+        - the neuropil percentile bin edges are computed in a single call
+        - samples are sorted by (bin, fluorescence) in each ROI to read
+                the 5th percentile of each bin at its rank
+        - least-square slopes are computed in closed form
+    ROIs with an empty bin get a NaN slope
+    """
+    F, Fneu = np.asarray(F), np.asarray(Fneu)
+    nROIs, per = F.shape[0], np.arange(5, 101, 5)
+
+    # bin edges: (21, nROIs)
+    edges = np.percentile(Fneu, np.concatenate([[0], per]), axis=1)
+
+    # bin of each sample: edges[j] <= Fneu < edges[j+1] -> j, 
+    #           samples equal to the max have the (discarded) bin 20
+    bins = np.zeros(Fneu.shape, dtype=np.int64)
+    for j in range(1, len(per)+1):
+        bins += (Fneu>=edges[j][:,np.newaxis])
+
+    # sorting by bin and then by fluorescence in each ROI
+    order = np.lexsort((F, bins), axis=-1)
+    sortedF = np.take_along_axis(F, order, axis=-1)
+
+    counts = np.bincount((bins+(len(per)+1)*np.arange(nROIs)[:,np.newaxis]).ravel(),
+                         minlength=nROIs*(len(per)+1)).reshape(nROIs, len(per)+1)[:,:-1]
+    starts = np.cumsum(counts, axis=1)-counts
+
+    # 5th percentile in each bin (as np.percentile, "linear" method)
+    virtual_index = (counts-1)*np.true_divide(5, 100)
+    previous = np.floor(virtual_index).astype(np.int64)
+    gamma = virtual_index-previous
+    previous = np.clip(previous, 0, np.maximum(counts-1, 0))
+    following = np.clip(previous+1, 0, np.maximum(counts-1, 0))
+    rows = np.arange(nROIs)[:,np.newaxis]
+    a = sortedF[rows, np.minimum(starts+previous, F.shape[1]-1)]
+    b = sortedF[rows, np.minimum(starts+following, F.shape[1]-1)]
+    diff_b_a = b-a
+    y = np.where(gamma>=0.5, b-diff_b_a*(1-gamma), a+diff_b_a*gamma)
+    y[counts==0] = np.nan
+
+    # least-square slopes
+    x = edges[1:].T
+    x = x-x.mean(axis=1)[:,np.newaxis]
+    y = y-y.mean(axis=1)[:,np.newaxis]
+
+    return np.sum(x*y, axis=1)/np.sum(x**2, axis=1)
+
+def neuropil_factor_from_slopes(slopes):
+    """
+    the neuropil factor is the mean of the strictly positive slopes,
+        ROIs with negative slopes are discarded
+    """
+    valid_ROIs = (slopes>0)
+    alpha = np.mean(slopes[valid_ROIs])
+
+    return alpha, valid_ROIs
+
 def compute_neuropil_facor(F, Fneu):
 
-    slopes_list = []
-    per = np.arange(5, 101, 5)
-
-    for k in range(len(F)): #loop on each neuron
-        b = 0
-        All_F, percentile_Fneu = [], []
-        for q in per:
-            current_percentile = np.percentile(Fneu[k], q)
-            previous_percentile = np.percentile(Fneu[k], b)
-            index_percentile_q = np.where((previous_percentile <= Fneu[k]) & (Fneu[k] < current_percentile))
-            F_percentile_q = F[k][index_percentile_q]
-            perc_F_q = np.percentile(F_percentile_q, 5)
-            percentile_Fneu.append(current_percentile)
-            All_F.append(perc_F_q)
-            b = q
-
-        #fitting a linear regression model
-        x = np.array(percentile_Fneu).reshape(-1, 1)
-        y = np.array(All_F)
-        model = LinearRegression()
-        model.fit(x, y)
-        slopes_list.append(model.coef_[0])
-    
-    valid_ROIs, alphas = [],[]
-    for q in range(len(slopes_list)):
-        if slopes_list[q] > 0:
-            valid_ROIs.append(True)
-            alphas.append(slopes_list[q])
-        else :
-            valid_ROIs.append(False)
-    
-    alpha = np.mean(alphas)
+    return neuropil_factor_from_slopes(compute_neuropil_slopes(F, Fneu))
 
-    return alpha, np.array(valid_ROIs)
+def roi_blocks(array):
+    """
+    slices to loop over the ROI axis of the fluorescence data:
+        - a single slice for in-memory arrays
+        - memory-bounded blocks for lazy arrays (see analysis.read_NWB.LazyROIArray)
+    """
+    if hasattr(array, 'roi_blocks'):
+        return array.roi_blocks()
+    else:
+        return [slice(0, array.shape[0])]
 
 def compute_dFoF(data,  
                  roi_to_neuropil_fluo_inclusion_factor=ROI_TO_NEUROPIL_INCLUSION_FACTOR,
@@ -225,9 +374,15 @@ def compute_dFoF(data,
         print('\ncalculating dF/F with method "%s" [...]' % method_for_F0)
     
 
+    # the data are processed by blocks of ROIs (a single block if in memory)
+    blocks = roi_blocks(data.rawFluo)
+
     # Step 0) -> compute neuropil correction factor if needed
     if with_computed_neuropil_fact :
-        neuropil_correction_factor, valid_ROIs_neuropil = compute_neuropil_facor(data.rawFluo, data.neuropil)
+        neuropil_correction_factor, valid_ROIs_neuropil = neuropil_factor_from_slopes(\
+                np.concatenate([compute_neuropil_slopes(np.asarray(data.rawFluo[rois,:]),
+                                                        np.asarray(data.neuropil[rois,:]))\
+                                    for rois in blocks]))
         if verbose :
             print('neuropil correction factor computed:', neuropil_correction_factor)
             if np.sum(~valid_ROIs_neuropil)>0:
@@ -245,54 +400,68 @@ def compute_dFoF(data,
     data.neuropil_correction_factor = neuropil_correction_factor
 
     #######################################################################
+
+    dFoF, VALID, cF, cF0 = [], [], [], []
+
+    for rois in blocks:
+
+        rawFluo = np.asarray(data.rawFluo[rois,:])
+        neuropil = np.asarray(data.neuropil[rois,:])
     
-    # Step 1) ->  performing neuropil correction 
-    correctedFluo = data.rawFluo-\
-        neuropil_correction_factor*data.neuropil
+        # Step 1) ->  performing neuropil correction 
+        correctedFluo = rawFluo-\
+            neuropil_correction_factor*neuropil
         
-    
-    # Step 2) -> compute the F0 term (~ sliding minimum/percentile)
-    correctedFluo0 = compute_F0(data, correctedFluo,
-                                method=method_for_F0,
-                                percentile=percentile,
-                                sliding_window=sliding_window)
-
-    # Step 3) -> determine the valid ROIs
-    # ROIs with strictly positive baseline
-    valid_roiIndices = (np.min(correctedFluo0, axis=1)>1)
-
-    # ROIs above Inclusion Factor
-    if roi_to_neuropil_fluo_inclusion_factor_metric == 'mean':
-        valid_roiIndices = valid_roiIndices &\
-            ((np.mean(data.rawFluo, axis=1)>\
-                roi_to_neuropil_fluo_inclusion_factor*np.mean(data.neuropil, axis=1)))
-    elif roi_to_neuropil_fluo_inclusion_factor_metric == 'std' :
-        neuropil_filtered = gaussian_filter1d(data.neuropil, 10)
-        rawFluo_filtered = gaussian_filter1d(data.rawFluo, 10)
-        valid_roiIndices = valid_roiIndices &\
-            ((np.std(rawFluo_filtered, axis=1)>\
-                roi_to_neuropil_fluo_inclusion_factor*np.std(neuropil_filtered, axis=1)))
-    else:
-        raise ValueError('roi_to_neuropil_fluo_inclusion_factor must be either "mean" or "std"')
+        # Step 2) -> compute the F0 term (~ sliding minimum/percentile)
+        correctedFluo0 = compute_F0(data, correctedFluo,
+                                    method=method_for_F0,
+                                    percentile=percentile,
+                                    sliding_window=sliding_window)
+
+        # Step 3) -> determine the valid ROIs
+        # ROIs with strictly positive baseline
+        valid_roiIndices = (np.min(correctedFluo0, axis=1)>1)
+
+        # ROIs above Inclusion Factor
+        if roi_to_neuropil_fluo_inclusion_factor_metric == 'mean':
+            valid_roiIndices = valid_roiIndices &\
+                ((np.mean(rawFluo, axis=1)>\
+                    roi_to_neuropil_fluo_inclusion_factor*np.mean(neuropil, axis=1)))
+        elif roi_to_neuropil_fluo_inclusion_factor_metric == 'std' :
+            neuropil_filtered = gaussian_filter1d(neuropil, 10)
+            rawFluo_filtered = gaussian_filter1d(rawFluo, 10)
+            valid_roiIndices = valid_roiIndices &\
+                ((np.std(rawFluo_filtered, axis=1)>\
+                    roi_to_neuropil_fluo_inclusion_factor*np.std(neuropil_filtered, axis=1)))
+        else:
+            raise ValueError('roi_to_neuropil_fluo_inclusion_factor must be either "mean" or "std"')
 
-    # Add strictly positive neuropil correction factor criterion
-    if with_computed_neuropil_fact :
-        valid_roiIndices = valid_roiIndices & valid_ROIs_neuropil
+        # Add strictly positive neuropil correction factor criterion
+        if with_computed_neuropil_fact :
+            valid_roiIndices = valid_roiIndices & valid_ROIs_neuropil[rois]
+
+        # Step 4) -> compute the delta F over F quantity: dFoF = (F-F0)/F0
+        dFoF.append((correctedFluo[valid_roiIndices, :]-\
+          correctedFluo0[valid_roiIndices, :])/correctedFluo0[valid_roiIndices, :])
 
-    # Step 4) -> compute the delta F over F quantity: dFoF = (F-F0)/F0
-    data.dFoF = (correctedFluo[valid_roiIndices, :]-\
-      correctedFluo0[valid_roiIndices, :])/correctedFluo0[valid_roiIndices, :]
+        # Step 5) -> Gaussian smoothing if required
+        if smoothing is not None:
+            dFoF[-1] = gaussian_filter1d(dFoF[-1], smoothing, axis=1)
 
-    # Step 5) -> Gaussian smoothing if required
-    if smoothing is not None:
-        data.dFoF = gaussian_filter1d(data.dFoF, smoothing, axis=1)
+        VALID.append(valid_roiIndices)
+        if with_correctedFluo_and_F0:
+            cF.append(correctedFluo[valid_roiIndices,:])
+            cF0.append(correctedFluo0[valid_roiIndices,:])
+
+    valid_roiIndices = np.concatenate(VALID)
+    data.dFoF = dFoF[0] if len(dFoF)==1 else np.concatenate(dFoF)
 
     #######################################################################
     if verbose:
         if np.sum(~valid_roiIndices)>0:
             print('\n  ** %i ROIs were discarded with the positive-alpha, positive-F0 and Neuropil-Factor criteria (%.1f%%) ** \n'\
                   % (np.sum(~valid_roiIndices),
-                      100*np.sum(~valid_roiIndices)/correctedFluo.shape[0]))
+                      100*np.sum(~valid_roiIndices)/len(valid_roiIndices)))
         else:
             print('\n  ** all ROIs passed the positive F0 criterion ** \n')
             
@@ -301,12 +470,17 @@ def compute_dFoF(data,
             valid_roiIndices = np.arange(data.original_nROIs)[valid_roiIndices])
 
     # we resrict the rawFluo and neuropil to valid ROIs
-    data.rawFluo = data.rawFluo[data.valid_roiIndices,:]
-    data.neuropil = data.neuropil[data.valid_roiIndices,:]
+    if hasattr(data.rawFluo, 'roi_subset'):
+        # lazy data, still not loaded
+        data.rawFluo = data.rawFluo.roi_subset(data.valid_roiIndices)
+        data.neuropil = data.neuropil.roi_subset(data.valid_roiIndices)
+    else:
+        data.rawFluo = data.rawFluo[data.valid_roiIndices,:]
+        data.neuropil = data.neuropil[data.valid_roiIndices,:]
 
     if with_correctedFluo_and_F0:
-        data.correctedFluo0 = correctedFluo0[data.valid_roiIndices,:]
-        data.correctedFluo = correctedFluo[data.valid_roiIndices,:]
+        data.correctedFluo0 = np.concatenate(cF0)
+        data.correctedFluo = np.concatenate(cF)
     
     if verbose:
         print('-> dFoF calculus done !  (calculation took %.1fs)' % (time.time()-tick))
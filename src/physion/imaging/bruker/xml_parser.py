@@ -3,13 +3,255 @@ import numpy as np
 
 
 def bruker_xml_parser(filename, 
+                      streaming=True,
                       verbose=False):
     """
     function to parse the xml metadata file produced by the Prairie software
 
+    streaming: incremental parsing (the Frame elements are cleared once read),
+                otherwise the whole ElementTree is loaded in memory
+
     TODO:
     - find automated ways to count channels
     """
+    if streaming:
+        return bruker_xml_streaming_parser(filename, verbose=verbose)
+    else:
+        return bruker_xml_tree_parser(filename, verbose=verbose)
+
+
+def read_settings(settings):
+    """ the "PVStateShard" element of the acquisition settings """
+    SETTINGS = {}
+    for setting in settings:
+        if 'value' in setting.attrib:
+            SETTINGS[setting.attrib['key']] = setting.attrib['value']
+        else:
+            SETTINGS[setting.attrib['key']] = {}
+            for s in setting:
+                if s.tag == 'IndexedValue':
+                    if 'description' in s.attrib:
+                        SETTINGS[setting.attrib['key']][s.attrib['description']] = s.attrib['value']
+                    else:
+                        SETTINGS[setting.attrib['key']][s.attrib['index']] = s.attrib['value']
+                elif s.tag == 'SubindexedValues':
+                    if len(list(s)) == 1:
+                        SETTINGS[setting.attrib['key']][s.attrib['index']] = s[0].attrib['value']
+                    else:
+                        SETTINGS[setting.attrib['key']][s.attrib['index']] = {}
+                        for sub in s:
+                            SETTINGS[setting.attrib['key']][s.attrib['index']][sub.attrib['description']] = [sub.attrib['value']]
+    return SETTINGS
+
+
+def read_depths(shard, depths):
+    """ adds the Z-axis positions of a "PVStateShard" of a Frame to "depths" """
+    for d in shard:
+        if d.attrib['key']=='positionCurrent':
+            for e in d:
+                if e.attrib['index']=='ZAxis':
+                    for g in e:
+                        if g.attrib['description'] not in depths:
+                            depths[g.attrib['description']] = []
+                        try:
+                            depths[g.attrib['description']].append(float(g.attrib['value']))
+                        except ValueError:
+                            pass
+
+
+def depth_shift(depths, depth_index, verbose=False):
+    """ depth of the planes from the Z-axis positions """
+
+    # dealing with depth  --- MANUAL for piezo plane-scanning mode because the bruker xml files don't hold this info...
+    if np.sum(['Piezo' in key for key in depths.keys()]):
+        Ndepth = len(np.unique(depth_index)) # SHOULD ALWAYS BE ODD
+        try:
+            for key in depths.keys():
+                if 'Piezo' in key:
+                    depth_start_piezo = depths[key][0]
+            depth_middle_piezo = 200 # SHOULD BE ALWAYS CENTER AT 200um
+            return np.linspace(-1, 1, Ndepth)*(depth_middle_piezo-depth_start_piezo)
+        except BaseException as be:
+            if verbose:
+                print(be)
+                print(' [!!] plane info was not found [!!] ')
+            return np.arange(1, Ndepth+1)
+    else:
+        return np.zeros(1)
+
+
+def translate_to_arrays(data, CHANNELS):
+
+    # ---------------------------- #
+    #  translation to numpy arrays
+    # ---------------------------- #
+    data['Nchannels']=0
+    data['channels'] = CHANNELS
+    for channel in CHANNELS:
+        if len(data[channel]['relativeTime'])>1:
+            data['Nchannels'] += 1
+        for key in ['relativeTime', 'absoluteTime']:
+            data[channel][key] = np.array(data[channel][key], dtype=np.float64)
+        data[channel]['depth_index'] = np.array(data[channel]['depth_index'], dtype=int)
+        for key in ['tifFile']:
+            data[channel][key] = np.array(data[channel][key], dtype=str)
+
+    data['Nplanes'] = len(data['depth_shift'])
+
+
+def check_version(version):
+    if ('5.5.' in version) or ('5.6.' in version) or ('5.7.' in version):
+        return True
+    elif '5.4.' in version:
+        # version without multiplabe scanning: 5.4.X
+        return False
+    else:
+        raise NotImplementedError('\n \n  [!!]  Prairie version "%s" of xml file not supported  [!!]  \n ' % version)
+
+
+class FrameRecords:
+    """
+    frames of a channel, stored in preallocated arrays
+        (their size is doubled when full)
+    """
+
+    def __init__(self, size=4096):
+        self.n = 0
+        self.arrays = {'order':np.zeros(size, dtype=np.int64),
+                       'relativeTime':np.zeros(size, dtype=np.float64),
+                       'absoluteTime':np.zeros(size, dtype=np.float64),
+                       'depth_index':np.zeros(size, dtype=int)}
+        self.tifFile = []
+
+    def append(self, order, frame, tifFile):
+        if self.n==len(self.arrays['order']):
+            for key in self.arrays:
+                self.arrays[key] = np.concatenate([self.arrays[key],
+                                                   np.zeros_like(self.arrays[key])])
+        self.arrays['order'][self.n] = order
+        for key in ['relativeTime', 'absoluteTime']:
+            self.arrays[key][self.n] = float(frame.attrib[key])
+        self.arrays['depth_index'][self.n] = int(frame.attrib.get('index', 1))-1
+        self.tifFile.append(tifFile)
+        self.n += 1
+
+    def get(self, key):
+        return self.tifFile if key=='tifFile' else self.arrays[key][:self.n]
+
+
+def bruker_xml_streaming_parser(filename,
+                                verbose=False):
+    """
+    same output as "bruker_xml_tree_parser" with an "iterparse" loop:
+        the children of the Sequence elements are read and cleared one by one,
+        their files are stored per channel name in "FrameRecords" arrays
+    """
+    data = {'settings':{}}
+
+    CHANNELS, RECORDS, depths = [], {}, {}
+    level, nRoot, nChild, order = 0, 0, 0, 0
+
+    for event, element in ET.iterparse(filename, events=('start', 'end')):
+
+        if event=='start':
+            level += 1
+            if level==1:
+                root = element
+                data['date'] = root.attrib['date']
+                data['Prairie-version'] = root.attrib['version']
+                multiplane_version = check_version(data['Prairie-version'])
+            elif level==2:
+                nRoot += 1 # index of the root child
+                if nRoot==3:
+                    data['StartTime'] = element.attrib['time']
+                sequence, nChild = element, 0
+            elif level==3:
+                nChild += 1 # index of the Sequence child
+            continue
+
+        level -= 1
+
+        if (level==2) and (nRoot>=3):
+            # a child of a Sequence (e.g. a Frame) is complete
+
+            if (element.tag=='Frame') and (nChild<=4):
+                # to find channel names
+                for f in element:
+                    if ('channelName' in f.attrib) and (f.attrib['channelName'] not in CHANNELS):
+                        CHANNELS.append(f.attrib['channelName'])
+
+            if multiplane_version and (element.tag=='Frame'):
+                for f in element:
+                    if f.tag == 'File':
+                        if f.attrib['channelName'] not in RECORDS:
+                            RECORDS[f.attrib['channelName']] = FrameRecords()
+                        RECORDS[f.attrib['channelName']].append(order, element,
+                                                                f.attrib['filename'])
+                        order += 1
+                    elif f.tag == 'PVStateShard':
+                        read_depths(f, depths)
+
+            elif (not multiplane_version) and (nRoot==3):
+                # only the first Sequence
+                for f in element:
+                    if f.tag == 'File':
+                        if f.attrib['channelName'] not in RECORDS:
+                            RECORDS[f.attrib['channelName']] = FrameRecords()
+                        RECORDS[f.attrib['channelName']].append(order, element,
+                                                                f.attrib['filename'])
+                        order += 1
+
+            del sequence[:]
+
+        elif level==1:
+            # a child of the root element is complete
+            if nRoot==2:
+                data['settings'] = read_settings(element)
+            del root[:]
+
+    for channel in CHANNELS:
+        if multiplane_version:
+            # files whose channel name contains the channel
+            NAMES = [name for name in RECORDS if channel in name]
+        else:
+            NAMES = [name for name in RECORDS if channel==name]
+        data[channel] = {}
+        for key in ['relativeTime', 'absoluteTime', 'depth_index', 'tifFile']:
+            if len(NAMES)>0:
+                data[channel][key] = np.concatenate([RECORDS[name].get(key)\
+                                                        for name in NAMES])
+            else:
+                data[channel][key] = []
+        if len(NAMES)>1:
+            # back to the file order
+            iSort = np.argsort(np.concatenate([RECORDS[name].get('order')\
+                                                    for name in NAMES]), kind='stable')
+            for key in data[channel]:
+                data[channel][key] = data[channel][key][iSort]
+        if nRoot<=3:
+            data[channel]['depth_index'] = np.zeros(len(data[channel]['tifFile']),
+                                                    dtype=int)
+
+    if multiplane_version:
+        if len(CHANNELS)>0:
+            data['depth_shift'] = depth_shift(depths, data[CHANNELS[0]]['depth_index'],
+                                              verbose=verbose)
+        else:
+            data['depth_shift'] = np.zeros(1)
+    else:
+        data['depth_shift'] = np.zeros(1)
+        data['depth_index'] = np.zeros(len(data[CHANNELS[0]]['relativeTime']))
+
+    translate_to_arrays(data, CHANNELS)
+
+    return data
+
+
+def bruker_xml_tree_parser(filename,
+                           verbose=False):
+    """
+    parsing of the full ElementTree (former implementation)
+    """
     mytree = ET.parse(filename)
     root = mytree.getroot()
 
@@ -35,29 +277,11 @@ def bruker_xml_parser(filename,
         data[channel] = {'relativeTime':[], 'absoluteTime':[],
                          'depth_index':[], 'tifFile':[]}
 
-    settings = root[1]
-    for setting in settings:
-        if 'value' in setting.attrib:
-            data['settings'][setting.attrib['key']] = setting.attrib['value']
-        else:
-            data['settings'][setting.attrib['key']] = {}
-            for s in setting:
-                if s.tag == 'IndexedValue':
-                    if 'description' in s.attrib:
-                        data['settings'][setting.attrib['key']][s.attrib['description']] = s.attrib['value']
-                    else:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = s.attrib['value']
-                elif s.tag == 'SubindexedValues':
-                    if len(list(s)) == 1:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = s[0].attrib['value']
-                    else:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = {}
-                        for sub in s:
-                            data['settings'][setting.attrib['key']][s.attrib['index']][sub.attrib['description']] = [sub.attrib['value']]
+    data['settings'] = read_settings(root[1])
     
     data['StartTime'] = root[2].attrib['time']
 
-    if ('5.5.' in data['Prairie-version']) or ('5.6.' in data['Prairie-version']) or ('5.7.' in data['Prairie-version']):
+    if check_version(data['Prairie-version']):
 
         depths = {}
         for frames in root[2:]:
@@ -74,39 +298,14 @@ def bruker_xml_parser(filename,
                                     data[channel]['depth_index'].append(int(x.attrib['index'])-1)
                                 else:
                                     data[channel]['depth_index'].append(0)
-                            # depth
-                            if f.tag == 'PVStateShard':
-                                for d in f:
-                                    if d.attrib['key']=='positionCurrent':
-                                        for e in d:
-                                            if e.attrib['index']=='ZAxis':
-                                                for g in e:
-                                                    if g.attrib['description'] not in depths:
-                                                        depths[g.attrib['description']] = []
-                                                    try:
-                                                        depths[g.attrib['description']].append(float(g.attrib['value']))
-                                                    except ValueError:
-                                                        pass
-
-        # dealing with depth  --- MANUAL for piezo plane-scanning mode because the bruker xml files don't hold this info...
-        if np.sum(['Piezo' in key for key in depths.keys()]):
-            Ndepth = len(np.unique(data[CHANNELS[0]]['depth_index'])) # SHOULD ALWAYS BE ODD
-            try:
-                for key in depths.keys():
-                    if 'Piezo' in key:
-                        depth_start_piezo = depths[key][0]
-                depth_middle_piezo = 200 # SHOULD BE ALWAYS CENTER AT 200um
-                data['depth_shift'] = np.linspace(-1, 1, Ndepth)*(depth_middle_piezo-depth_start_piezo)
-            except BaseException as be:
-                if verbose:
-                    print(be)
-                    print(' [!!] plane info was not found [!!] ')
-                data['depth_shift'] = np.arange(1, Ndepth+1)
-        else:
-            data['depth_shift'] = np.zeros(1)
+                        # depth
+                        if (f.tag == 'PVStateShard') and (len(CHANNELS)>0):
+                            read_depths(f, depths)
 
+        data['depth_shift'] = depth_shift(depths, data[CHANNELS[0]]['depth_index'],
+                                          verbose=verbose)
 
-    elif '5.4.' in data['Prairie-version']:
+    else:
 
         # version without multiplabe scanning: 5.4.X
         for x in root[2]:
@@ -124,25 +323,8 @@ def bruker_xml_parser(filename,
         data['depth_shift'] = np.zeros(1)
         data['depth_index'] = np.zeros(len(data[CHANNELS[0]]['relativeTime']))
 
-    else:
-
-        raise NotImplementedError('\n \n  [!!]  Prairie version "%s" of xml file not supported  [!!]  \n ' % data['Prairie-version'])
+    translate_to_arrays(data, CHANNELS)
 
-    # ---------------------------- #
-    #  translation to numpy arrays
-    # ---------------------------- #
-    data['Nchannels']=0
-    data['channels'] = CHANNELS
-    for channel in CHANNELS:
-        if len(data[channel]['relativeTime'])>1:
-            data['Nchannels'] += 1
-        for key in ['relativeTime', 'absoluteTime']:
-            data[channel][key] = np.array(data[channel][key], dtype=np.float64)
-        for key in ['tifFile']:
-            data[channel][key] = np.array(data[channel][key], dtype=str)
-
-    data['Nplanes'] = len(data['depth_shift'])
-                        
     return data
 
 
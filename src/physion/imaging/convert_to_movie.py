@@ -6,8 +6,14 @@ Two compression options:
     - 2) convert to 8-bit mp4
         log the data to have a good resolution at low fluorescence
 
+        the TIFF batches are decoded and log-transformed in a process pool
+        while a writer thread feeds the video stream (in the frame order,
+        with a bounded number of batches in memory)
+
 """
-import sys, shutil, os, pathlib, time
+import sys, shutil, os, pathlib, time, queue, threading, collections,\
+        multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import cv2 as cv
 from PIL import Image
 import numpy as np
@@ -108,7 +114,132 @@ def convert_to_16bit_avi(TS_folder):
 
 
 
-def convert_to_log8bit_mp4(TS_folder):
+# log and conversion to 8-bit of the 16-bit values, as a lookup table
+LOG8BIT = np.array(np.log(np.arange(2**16)+1.)/np.log(2**16)*2**8, dtype='uint8')
+
+
+def load_log8bit_batch(folder, FILES):
+    """
+    loads a batch of 16-bit TIFF frames and converts them to log 8-bit
+
+    returns (frames, success)
+        frames: list of the converted frames (the failed ones are skipped)
+        success: boolean array of the loaded frames
+    """
+    frames, success = [], np.zeros(len(FILES), dtype=bool)
+    for i, f in enumerate(FILES):
+        try:
+            # load 16-bit image
+            img = np.array(Image.open(os.path.join(folder, f)),
+                           dtype='uint16')
+            # log and convert to 8-bit
+            frames.append(LOG8BIT[img])
+            success[i] = True
+        except BaseException as be:
+            print('problem with frame:', f)
+    return frames, success
+
+
+def write_movie_frames(out, QUEUE, ERRORS):
+    """ 
+    writer thread: batches of frames from the queue to the video stream
+
+    an exception stops the thread and is stored in "ERRORS" 
+        (re-raised by the main thread)
+    """
+    try:
+        while True:
+            frames = QUEUE.get()
+            if frames is None:
+                break
+            for img in frames:
+                out.write(img)
+    except Exception as e:
+        ERRORS.append(e)
+
+
+def write_log8bit_movie(vid_name, folder, FILES, movie_rate, Lx, Ly,
+                        nproc=max([1, multiprocessing.cpu_count()-1]),
+                        batch_size=32,
+                        queue_size=4):
+    """
+    log 8-bit movie of the TIFF frames in "FILES"
+
+    nproc: number of processes decoding the TIFF batches
+    batch_size: frames per batch
+    queue_size: batches waiting for the writer
+        (at most (2*nproc+queue_size+1)*batch_size frames in memory)
+
+    returns the boolean array of the frames in the movie
+    """
+    out = cv.VideoWriter(vid_name,
+                         cv.VideoWriter_fourcc(*'mp4v'), 
+                         movie_rate,
+                         (Lx, Ly),
+                         False)
+
+    QUEUE, ERRORS = queue.Queue(maxsize=queue_size), []
+    writer = threading.Thread(target=write_movie_frames, args=(out, QUEUE, ERRORS),
+                              daemon=True)
+    writer.start()
+
+    def send(item):
+        # to the writer thread (without blocking if it stopped)
+        while writer.is_alive():
+            try:
+                QUEUE.put(item, timeout=1.)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    success = np.zeros(len(FILES), dtype=bool)
+    BATCHES = [np.arange(i, min([i+batch_size, len(FILES)]))\
+                    for i in range(0, len(FILES), batch_size)]
+
+    def feed(batch, result):
+        frames, success[batch] = result
+        if not send(frames):
+            raise ERRORS[0] if len(ERRORS)>0 else RuntimeError('writer thread stopped')
+        printProgressBar(batch[-1], len(FILES))
+
+    try:
+        if (nproc>1) and (len(BATCHES)>1):
+            with ProcessPoolExecutor(max_workers=nproc,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                try:
+                    PENDING = collections.deque()
+                    for batch in BATCHES:
+                        PENDING.append((batch, pool.submit(load_log8bit_batch,
+                                                           folder, FILES[batch])))
+                        if len(PENDING)>=2*nproc:
+                            batch, future = PENDING.popleft()
+                            feed(batch, future.result())
+                    while len(PENDING)>0:
+                        batch, future = PENDING.popleft()
+                        feed(batch, future.result())
+                except BaseException:
+                    # no need to decode the remaining batches
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        else:
+            for batch in BATCHES:
+                feed(batch, load_log8bit_batch(folder, FILES[batch]))
+    finally:
+        # the writer is always stopped and the video file closed
+        send(None)
+        writer.join()
+        out.release()
+
+    if len(ERRORS)>0:
+        raise ERRORS[0]
+
+    return success
+
+
+def convert_to_log8bit_mp4(TS_folder,
+                           nproc=max([1, multiprocessing.cpu_count()-1]),
+                           batch_size=32):
 
     Format = 'wmv' if ('win32' in sys.platform) else 'mp4'
 
@@ -123,9 +254,8 @@ def convert_to_log8bit_mp4(TS_folder):
     for chan in xml['channels']:
     
         print('    --> Channel: ', chan)
-        nframes = len(xml[chan]['tifFile'])
         movie_rate = 1./float(xml['settings']['framePeriod'])
-        FILES = xml[chan]['tifFile']
+        FILES = np.array(xml[chan]['tifFile'])
 
 
         DICT = {'compression':'log+mp4v'}
@@ -134,32 +264,13 @@ def convert_to_log8bit_mp4(TS_folder):
 
             vid_name = os.path.join(TS_folder, 'LOG-%s-plane%i.%s' %\
                                     (chan.replace(' ','-'), p, Format))
-            out = cv.VideoWriter(vid_name,
-                                 cv.VideoWriter_fourcc(*'mp4v'), 
-                                 movie_rate,
-                                 (Lx, Ly),
-                                 False)
-
             print('\n  [...]  Building the video: "%s" ' % vid_name)
 
             plane_cond = (xml[chan]['depth_index']==p)
-            success = np.zeros(len(FILES[plane_cond]), dtype=bool)
-            for i, f in enumerate(FILES[plane_cond]):
-                try:
-                    # load 16-bit image
-                    img = np.array(Image.open(os.path.join(TS_folder, f)),
-                                   dtype='uint16')
-                    # log and convert to 8-bit
-                    img = np.array(np.log(img+1.)/np.log(2**16)*2**8, 
-                                   dtype='uint8')
-                    # write in movie
-                    out.write(img)
-                    printProgressBar(i, nframes)
-                    success[i] = True
-                except BaseException as be:
-                    print('problem with frame:', f)
+            success = write_log8bit_movie(vid_name, TS_folder, FILES[plane_cond],
+                                          movie_rate, Lx, Ly,
+                                          nproc=nproc, batch_size=batch_size)
 
-            out.release()
             print(' [ok] "%s" succesfully created !' % vid_name)
             DICT['Frames_succesfully_in_movie-plane%i'%p]= success
 
@@ -217,38 +328,93 @@ def reconvert_to_tiffs_from_log8bit(TS_folder):
 ###########################
 
 
-def reconvert_to_tiffs_from_16bit(vid_name):
+def reconvert_to_tiffs_from_16bit(vid_name,
+                                  binary_file=None):
+    """
+    restores the TIFF files from the lossless 16-bit movie of a channel
+        in a single decoding pass: the frames are read one by one
+        from the raw output stream of ffmpeg
+
+    binary_file: if given, the frames are written in this suite2p binary file
+                    (int16, nFrames x Ly x Lx) instead of the TIFF files
+            [!!] lossy above 32766: the values are clipped as in suite2p
+                    (the number of clipped pixels is printed) [!!]
 
-    xml_file = get_files_with_extension(os.path.dirname(vid_name),
+    returns the number of restored frames
+        (raises an IOError if ffmpeg fails or if frames are missing)
+    """
+    folder = os.path.dirname(vid_name)
+    xml_file = get_files_with_extension(folder,
                                         extension='.xml')[0]
     xml = bruker_xml_parser(xml_file)
 
     Ly, Lx = int(xml['settings']['linesPerFrame']),\
                     int(xml['settings']['pixelsPerLine'])
 
-    # function to extract frame:
-    def extract_frame(input_vid, frame_num):
-       out, _ = (
-           ffmpeg
-           .input(input_vid)
-           .filter_('select', 'gte(n,{})'.format(frame_num))
-           .output('pipe:', format='rawvideo', pix_fmt='gray16le', vframes=1)
-           .run(capture_stdout=True, capture_stderr=True)
-       )
-       return np.frombuffer(out, np.uint16).reshape([Lx, Ly])
-
-    for chan in xml['channels']:
-
-        nframes = len(xml[chan]['tifFile'])
-
-        for i in range(nframes):
-            frame = extract_frame(vid_name, i)
-            im = Image.fromarray(frame)
-            im.save(os.path.join(os.path.dirname(vid_name),
-                                 xml[chan]['tifFile'][i]),
-                                 format='TIFF')
+    # channel of the movie (see "convert_to_16bit_avi")
+    CHANNELS = [chan for chan in xml['channels']\
+            if os.path.basename(vid_name)=='%s.avi' % chan.replace(' ','-')]
+    chan = CHANNELS[0] if len(CHANNELS)>0 else xml['channels'][0]
+    FILES = xml[chan]['tifFile']
+    nframes = len(FILES)
+
+    process = (
+        ffmpeg
+        .input(vid_name)
+        .output('pipe:', format='rawvideo', pix_fmt='gray16le')
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+    binary = None
+    nbytes, i, nclipped = 2*Ly*Lx, 0, 0
+    try:
+        binary = open(binary_file, 'wb') if (binary_file is not None) else None
+
+        buffer = process.stdout.read(nbytes)
+        while (len(buffer)==nbytes) and (i<nframes):
+            frame = np.frombuffer(buffer, np.uint16).reshape([Ly, Lx])
+            if binary is not None:
+                # as in suite2p.io.BinaryFile.write
+                nclipped += np.sum(frame>2**15-2)
+                binary.write(np.minimum(frame, 2**15-2).astype('int16').tobytes())
+            else:
+                # write as 16bit tiff
+                Image.fromarray(frame).save(os.path.join(folder, FILES[i]),
+                                            format='TIFF')
             printProgressBar(i, nframes)
-            
+            i += 1
+            if i<nframes:
+                buffer = process.stdout.read(nbytes)
+
+        if i<nframes:
+            # end of the stream -> exit status of the decoding
+            process.stdout.close()
+            returncode = process.wait()
+        else:
+            # all frames read (extra frames of the movie are ignored)
+            returncode = 0
+    finally:
+        if binary is not None:
+            binary.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if not process.stdout.closed:
+            process.stdout.close()
+
+    if returncode!=0:
+        raise IOError('ffmpeg failed (return code %i) after %i frames out of %i in "%s"' % (
+                            returncode, i, nframes, vid_name))
+    if i<nframes:
+        raise IOError('only %i frames out of %i in "%s"' % (i, nframes, vid_name))
+    if nclipped>0:
+        print(' [!!] n=%i pixels above %i clipped in the int16 binary "%s" ' % (
+                nclipped, 2**15-2, binary_file))
+    print(' [ok] restored %i frames of "%s" ' % (i, vid_name))
+
+    return i
+
 
 def find_subfolders(folder):
     return [f[0] for f in os.walk(folder)\
@@ -324,6 +490,9 @@ if __name__=='__main__':
     parser.add_argument("--delete", 
                         help="remove the original files", 
                         action="store_true")
+    parser.add_argument("--nproc", 
+                        help="number of processes decoding the TIFF files", 
+                        type=int, default=max([1, multiprocessing.cpu_count()-1]))
     args = parser.parse_args()
 
     print('')
@@ -337,7 +506,7 @@ if __name__=='__main__':
                 convert_to_16bit_avi(folder)
 
             else:
-                convert_to_log8bit_mp4(folder)
+                convert_to_log8bit_mp4(folder, nproc=args.nproc)
             
             if args.delete:
                 print(' - deleting tiffs and binary in ', folder, ' [...]')
@@ -359,8 +528,9 @@ if __name__=='__main__':
 
                 elif os.path.isfile(\
                         os.path.join(folder,
-                                     '%s-summary.npy'%(chan.replace(' ','-')))):
-                    reconvert_to_tiffs_from_16bit(folder)
+                                     '%s.avi'%(chan.replace(' ','-')))):
+                    reconvert_to_tiffs_from_16bit(\
+                        os.path.join(folder, '%s.avi'%(chan.replace(' ','-'))))
 
                 else:
                     print('\n no video file to restore was found ! \n ')
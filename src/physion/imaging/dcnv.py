@@ -67,19 +67,30 @@ def oasis_matrix(F, v, w, t, l, s, tau, fs):
         oasis_trace(F[n], v[n], w[n], t[n], l[n], s[n], tau, fs)
 
 
-def oasis(F: np.ndarray, batch_size: int, tau: float, fs: float) -> np.ndarray:
+# memory budget (in bytes) of the work buffers when the batch size is automatic
+MEMORY_BUDGET = 512e6
+
+def oasis(F: np.ndarray, batch_size: int, tau: float, fs: float,
+          memory_budget: float = MEMORY_BUDGET,
+          out = None) -> np.ndarray:
     """ computes non-negative deconvolution
 
     no sparsity constraints
+
+    (note from physion) the work buffers are allocated once and reused 
+        across batches, and the batches are read one at a time from "F"
+        (so that "F" can be a lazy array, e.g. read_NWB.LazyROIArray)
     
     Parameters
     ----------------
 
     F : float, 2D array
         size [neurons x time], in pipeline uses neuropil-subtracted fluorescence
+        (any array-like supporting F[i0:i1] on the first axis)
 
     batch_size : int
-        number of frames processed per batch
+        number of neurons processed per batch 
+        (None -> set from "memory_budget")
 
     tau : float
         timescale of the sensor, used for the deconvolution kernel
@@ -87,6 +98,12 @@ def oasis(F: np.ndarray, batch_size: int, tau: float, fs: float) -> np.ndarray:
     fs : float
         sampling rate per plane
 
+    memory_budget : float
+        size (in bytes) of the work buffers when batch_size is None
+
+    out : None, str or 2D array
+        None -> a new array, str -> a new memory-mapped "*.npy" file,
+        or a preallocated array (e.g. a np.memmap) of size [neurons x time]
 
     Returns
     ----------------
@@ -96,17 +113,37 @@ def oasis(F: np.ndarray, batch_size: int, tau: float, fs: float) -> np.ndarray:
 
     """
     NN, NT = F.shape
-    F = F.astype(np.float32)
-    S = np.zeros((NN, NT), dtype=np.float32)
+
+    if batch_size is None:
+        # F (float32 copy), v, w, l, s (float32) and t (int64)
+        batch_size = int(memory_budget/(NT*(5*4+8)))
+    batch_size = max([1, min([batch_size, NN])])
+
+    if out is None:
+        S = np.zeros((NN, NT), dtype=np.float32)
+    elif type(out)==str:
+        S = np.lib.format.open_memmap(out, mode='w+', 
+                                      dtype=np.float32, shape=(NN, NT))
+    else:
+        S = out
+
+    f = np.zeros((batch_size, NT), dtype=np.float32)
+    v = np.zeros((batch_size, NT), dtype=np.float32)
+    w = np.zeros((batch_size, NT), dtype=np.float32)
+    t = np.zeros((batch_size, NT), dtype=np.int64)
+    l = np.zeros((batch_size, NT), dtype=np.float32)
+    s = np.zeros((batch_size, NT), dtype=np.float32)
+
     for i in range(0, NN, batch_size):
-        f = F[i:i + batch_size]
-        v = np.zeros((f.shape[0], NT), dtype=np.float32)
-        w = np.zeros((f.shape[0], NT), dtype=np.float32)
-        t = np.zeros((f.shape[0], NT), dtype=np.int64)
-        l = np.zeros((f.shape[0], NT), dtype=np.float32)
-        s = np.zeros((f.shape[0], NT), dtype=np.float32)
-        oasis_matrix(f, v, w, t, l, s, tau, fs)
-        S[i:i + batch_size] = s
+        n = min([batch_size, NN-i])
+        f[:n] = F[i:i + n]
+        s[:n] = 0 # only the spike times are written by oasis_trace
+        oasis_matrix(f[:n], v[:n], w[:n], t[:n], l[:n], s[:n], tau, fs)
+        S[i:i + n] = s[:n]
+
+    if isinstance(S, np.memmap):
+        S.flush()
+
     return S
 
 
@@ -12,7 +12,8 @@ https://github.com/zhuangjun1981/NeuroAnalysisTools/blob/master/NeuroAnalysisToo
 
 
 import numpy as np
-import os
+import os, contextlib, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import scipy.ndimage as ni
 import scipy.sparse as sparse
 import math
@@ -72,9 +73,11 @@ def array_nor(A, float_bit=64):
     return (B - minv) / (maxv - minv)
 
 
-def visualSignMap(phasemap1, phasemap2):
+def visualSignMap(phasemap1, phasemap2, accelerated=False):
     """
     calculate visual sign map from two orthogonally oriented phase maps
+
+    accelerated: gradient directions computed on the whole arrays
     """
 
     if phasemap1.shape != phasemap2.shape:
@@ -83,6 +86,11 @@ def visualSignMap(phasemap1, phasemap2):
     gradmap1 = np.gradient(phasemap1)
     gradmap2 = np.gradient(phasemap2)
 
+    if accelerated:
+        vdiff = np.multiply(np.exp(1j * np.arctan2(gradmap1[1], gradmap1[0])),
+                            np.exp(-1j * np.arctan2(gradmap2[1], gradmap2[0])))
+        return np.sin(np.angle(vdiff))
+
     # gradmap1 = ni.filters.median_filter(gradmap1,100.)
     # gradmap2 = ni.filters.median_filter(gradmap2,100.)
 
@@ -149,11 +157,14 @@ def dilationPatches(rawPatches, smallPatchThr=5, borderWidth=1):  # pixel width
     return newPatches
 
 
-def dilationPatches2(rawPatches, dilationIter=20, borderWidth=1):  # pixel width of the border after dilation
+def dilationPatches2(rawPatches, dilationIter=20, borderWidth=1,  # pixel width of the border after dilation
+                     accelerated=False):
 
     """
     dilation patched in a given area untill the border between them are as
     narrow as defined by 'borderWidth'.
+
+    accelerated: patches overlapping the raw patches selected from their labels
     """
 
     total_area = ni.binary_dilation(rawPatches, iterations=dilationIter).astype(np.int16)
@@ -174,6 +185,11 @@ def dilationPatches2(rawPatches, dilationIter=20, borderWidth=1):  # pixel width
 
     newPatches2 = np.zeros(newPatches.shape, dtype=np.int16)
 
+    if accelerated:
+        overlapping = np.unique(labeledPatches[(labeledPatches > 0) & (rawPatches != 0)])
+        newPatches2[np.isin(labeledPatches, overlapping)] = 1
+        return newPatches2
+
     for i in range(1, patchNum + 1):
         currPatch = np.zeros(labeledPatches.shape, dtype=np.int16)
         currPatch[labeledPatches == i] = 1
@@ -187,22 +203,29 @@ def dilationPatches2(rawPatches, dilationIter=20, borderWidth=1):  # pixel width
     return newPatches2
 
 
-def labelPatches(patchmap, signMap):
+def labelPatches(patchmap, signMap, accelerated=False):
     """
     from a segregated patchmap generate a dictionary with each entry represents
     a single patch, sorted by area
+
+    accelerated: areas counted from the label image (no int16 overflow)
     """
 
     labeledPatches, patchNum = ni.label(patchmap)
 
     # list of area of every patch, first column: patch label, second column: area
-    patchArea = np.zeros((patchNum, 2), dtype=np.int16)
+    if accelerated:
+        patchArea = np.array([np.arange(1, patchNum + 1),
+                              np.bincount(labeledPatches.flatten(),
+                                          minlength=patchNum + 1)[1:]]).T
+    else:
+        patchArea = np.zeros((patchNum, 2), dtype=np.int16)
 
-    for i in range(1, patchNum + 1):
-        currPatch = np.zeros(labeledPatches.shape, dtype=np.int16)
-        currPatch[labeledPatches == i] = 1
-        currPatch[labeledPatches != i] = 0
-        patchArea[i - 1] = [i, np.sum(currPatch[:])]
+        for i in range(1, patchNum + 1):
+            currPatch = np.zeros(labeledPatches.shape, dtype=np.int16)
+            currPatch[labeledPatches == i] = 1
+            currPatch[labeledPatches != i] = 0
+            patchArea[i - 1] = [i, np.sum(currPatch[:])]
 
     # sort patches by the area, from largest to the smallest
     sortArea = patchArea[patchArea[:, 1].argsort(axis=0)][::-1, :]
@@ -381,6 +404,66 @@ def localMin(eccMap, binSize):
 
 
 
+def extendBox(box, margin, shape):
+    """
+    box (tuple of slices) extended by "margin" pixels, within the array shape
+    """
+    return tuple(slice(max([s.start - margin, 0]), min([s.stop + margin, n]))
+                 for s, n in zip(box, shape))
+
+
+def boundingBox(array, margin=0):
+    """
+    slices of the bounding box of the non-zero pixels of an array,
+    extended by "margin" pixels (within the array), None if no pixel
+
+    binary morphology with less than "margin" iterations gives the same result
+    in the box than on the whole array
+    """
+    box = ni.find_objects((np.asarray(array) != 0).astype(np.int8))
+    if len(box) == 0:
+        return None
+    return extendBox(box[0], margin, np.shape(array))
+
+
+def touchingPatches(arrays, distance=1):
+    """
+    matrix of the pairs of patches within "distance" pixels
+        (i.e. touching after "distance" binary dilations, see Patch.isTouching)
+
+    each patch is dilated only in its bounding box and the overlaps are read
+    from a single product of the (sparse) patch x pixel matrices
+    """
+    shape = np.shape(arrays[0])
+    rows, pixels, dilatedRows, dilatedPixels = [], [], [], []
+
+    for i, array in enumerate(arrays):
+        box = boundingBox(array, distance)
+        if box is None:
+            continue
+        y, x = np.nonzero(array[box])
+        pixels.append(np.ravel_multi_index((y + box[0].start, x + box[1].start), shape))
+        rows.append(i * np.ones(len(y), dtype=int))
+        y, x = np.nonzero(ni.binary_dilation(array[box], iterations=distance))
+        dilatedPixels.append(np.ravel_multi_index((y + box[0].start, x + box[1].start), shape))
+        dilatedRows.append(i * np.ones(len(y), dtype=int))
+
+    if len(rows) == 0:
+        return np.zeros((len(arrays), len(arrays)), dtype=bool)
+
+    patchPixels = sparse.csr_matrix((np.ones(len(np.concatenate(rows))),
+                                     (np.concatenate(rows), np.concatenate(pixels))),
+                                    shape=(len(arrays), np.prod(shape)))
+    dilatedPatchPixels = sparse.csr_matrix((np.ones(len(np.concatenate(dilatedRows))),
+                                            (np.concatenate(dilatedRows),
+                                             np.concatenate(dilatedPixels))),
+                                           shape=(len(arrays), np.prod(shape)))
+
+    overlap = (dilatedPatchPixels @ patchPixels.T).toarray()
+
+    return (overlap + overlap.T) > 0
+
+
 def is_adjacent(array1, array2, borderWidth = 2):
     '''
     decide if two patches are adjacent within border width
@@ -394,14 +477,27 @@ def is_adjacent(array1, array2, borderWidth = 2):
     else:
         return False
 
-def adjacentPairs(patches, borderWidth=2):
+def adjacentPairs(patches, borderWidth=2, accelerated=False):
     """
     return all the patch pairs with same visual sign and sharing border
+
+    accelerated: adjacency of all pairs from "touchingPatches"
+        (dilated by "borderWidth-1" each <=> within "2*(borderWidth-1)" pixels)
     """
 
     keyList = patches.keys()
     pairKeyList = []
 
+    if accelerated and (borderWidth > 1):
+        index = {key: i for i, key in enumerate(keyList)}
+        touching = touchingPatches([patches[key].array for key in keyList],
+                                   distance=2 * (borderWidth - 1))
+        for pair in combinations(keyList, 2):
+            if touching[index[pair[0]], index[pair[1]]] and\
+                    (patches[pair[0]].sign == patches[pair[1]].sign):
+                pairKeyList.append(pair)
+        return pairKeyList
+
     for pair in combinations(keyList, 2):
         patch1 = patches[pair[0]]
         patch2 = patches[pair[1]]
@@ -412,13 +508,20 @@ def adjacentPairs(patches, borderWidth=2):
     return pairKeyList
 
 
-def mergePatches(array1, array2, borderWidth=2):
+def mergePatches(array1, array2, borderWidth=2, accelerated=False):
     """
     merge two binary patches with borderWidth no greater than borderWidth
+
+    accelerated: closing restricted to the bounding box of the two patches
     """
 
     sp = array1 + array2
-    spc = ni.binary_closing(sp, iterations=(borderWidth)).astype(np.int8)
+    if accelerated and (borderWidth >= 1):
+        box = boundingBox(sp, borderWidth + 1)
+        spc = np.zeros(sp.shape, dtype=np.int8)
+        spc[box] = ni.binary_closing(sp[box], iterations=(borderWidth))
+    else:
+        spc = ni.binary_closing(sp, iterations=(borderWidth)).astype(np.int8)
 
     _, patchNum = ni.measurements.label(spc)
     if patchNum > 1:
@@ -949,7 +1052,8 @@ class RetinotopicMappingTrial(object):
                      'visualSpacePixelSize': 0.5,
                      'visualSpaceCloseIter': 15,
                      'splitOverlapThr': 1.1
-                 }):
+                 },
+                 accelerated=True):  # morphology in bounding boxes, see "processTrials"
 
         self.mouseID = mouseID
         self.dateRecorded = dateRecorded
@@ -960,6 +1064,7 @@ class RetinotopicMappingTrial(object):
         self.vasculatureMap = vasculatureMap
         self.comments = comments
         self.params = params
+        self.accelerated = accelerated
 
     def getName(self):
 
@@ -994,7 +1099,7 @@ class RetinotopicMappingTrial(object):
         else:
             aziPowerMapf = None
 
-        signMap = visualSignMap(altPosMapf, aziPosMapf)
+        signMap = visualSignMap(altPosMapf, aziPosMapf, accelerated=self.accelerated)
 
         if isReverse: signMap = signMap * -1
 
@@ -1098,11 +1203,18 @@ class RetinotopicMappingTrial(object):
 
         # closing each patch, then put them together
         patchmap2 = np.zeros(patchmap.shape).astype(np.int16)
-        for i in range(patchNum):
-            currPatch = np.zeros(patches.shape).astype(np.int16)
-            currPatch[patches == i + 1] = 1
-            currPatch = ni.binary_closing(currPatch, iterations=closeIter).astype(np.int16)
-            patchmap2 = patchmap2 + currPatch
+        if self.accelerated and (closeIter >= 1):
+            # in the bounding box of each patch
+            for i, box in enumerate(ni.find_objects(patches)):
+                box = extendBox(box, closeIter + 1, patches.shape)
+                patchmap2[box] += ni.binary_closing(patches[box] == i + 1,
+                                                    iterations=closeIter).astype(np.int16)
+        else:
+            for i in range(patchNum):
+                currPatch = np.zeros(patches.shape).astype(np.int16)
+                currPatch[patches == i + 1] = 1
+                currPatch = ni.binary_closing(currPatch, iterations=closeIter).astype(np.int16)
+                patchmap2 = patchmap2 + currPatch
 
         if isPlot:
             plt.figure(figsize=(1.7,1.4))
@@ -1127,10 +1239,11 @@ class RetinotopicMappingTrial(object):
         smallPatchThr = self.params['smallPatchThr']
         vasculatureMap = self.vasculatureMap
 
-        patchMapDilated = dilationPatches2(rawPatchMap, dilationIter=dilationIter, borderWidth=borderWidth)
+        patchMapDilated = dilationPatches2(rawPatchMap, dilationIter=dilationIter, borderWidth=borderWidth,
+                                           accelerated=self.accelerated)
 
         # generate raw patch dictionary
-        rawPatches = labelPatches(patchMapDilated, signMapf)
+        rawPatches = labelPatches(patchMapDilated, signMapf, accelerated=self.accelerated)
 
         rawPatches2 = dict(rawPatches)
         # remove small patches
@@ -1140,16 +1253,24 @@ class RetinotopicMappingTrial(object):
 
         # remove isolated Patches
         rawPatches2 = dict(rawPatches)
-        for key in rawPatches2.keys():
-            isTouching = 0
-            for key2 in rawPatches2.keys():
-                if key != key2:
-                    if rawPatches2[key].isTouching(rawPatches2[key2], borderWidth * 2):
-                        isTouching = 1
-                        break
-
-            if isTouching == 0:
-                rawPatches.pop(key)
+        if self.accelerated and (borderWidth * 2 >= 1) and (len(rawPatches2) > 0):
+            touching = touchingPatches([value.array for value in rawPatches2.values()],
+                                       distance=borderWidth * 2)
+            np.fill_diagonal(touching, False)
+            for key, isTouching in zip(list(rawPatches2.keys()), np.any(touching, axis=1)):
+                if not isTouching:
+                    rawPatches.pop(key)
+        else:
+            for key in rawPatches2.keys():
+                isTouching = 0
+                for key2 in rawPatches2.keys():
+                    if key != key2:
+                        if rawPatches2[key].isTouching(rawPatches2[key2], borderWidth * 2):
+                            isTouching = 1
+                            break
+
+                if isTouching == 0:
+                    rawPatches.pop(key)
 
         rawPatches = sortPatches(rawPatches)
 
@@ -1264,7 +1385,8 @@ class RetinotopicMappingTrial(object):
             visualSpace, AU, _, _ = value.getVisualSpace(altPosMapf,
                                                          aziPosMapf,
                                                          pixelSize=visualSpacePixelSize,
-                                                         closeIter=visualSpaceCloseIter)
+                                                         closeIter=visualSpaceCloseIter,
+                                                         vectorized=self.accelerated)
             AS = value.getSigmaArea(detMap)
             print(key + 'AU=' + str(AU) + ' AS=' + str(AS) + ' ratio=' + str(AS / AU))
 
@@ -1289,7 +1411,8 @@ class RetinotopicMappingTrial(object):
                                               patchName=key,
                                               cutStep=splitLocalMinCutStep,
                                               borderWidth=borderWidth,
-                                              isplot=False)
+                                              isplot=False,
+                                              accelerated=self.accelerated)
 
                     # plotting splitted patches
                     if len(newPatches) > 1 and isPlot:
@@ -1310,7 +1433,8 @@ class RetinotopicMappingTrial(object):
                             currVisualSpace, _, _, _ = value2.getVisualSpace(altPosMapf,
                                                                              aziPosMapf,
                                                                              pixelSize=visualSpacePixelSize,
-                                                                             closeIter=visualSpaceCloseIter)
+                                                                             closeIter=visualSpaceCloseIter,
+                                                                             vectorized=self.accelerated)
                             currVisualSpace = currVisualSpace.astype(np.float32)
                             currVisualSpace[currVisualSpace == 0] = np.nan
                             currVisualSpace[currVisualSpace == 1] = currPatchValue
@@ -1387,6 +1511,40 @@ class RetinotopicMappingTrial(object):
         # fifth column: negative of unique visual space area (AU) of the merged patch
         mergePairs = []
 
+        # accelerated mode: merged patches and visual spaces are kept from one
+        # iteration to the next (a patch name always refers to the same patch)
+        mergedPatches, visualSpaces = {}, {}
+
+        def getMergedPatch(pair, patch1, patch2):
+            if not self.accelerated:
+                return Patch(mergePatches(patch1.array, patch2.array, borderWidth=borderWidth),
+                             sign=patch1.sign)
+            if pair not in mergedPatches:
+                try:
+                    mergedPatches[pair] = Patch(mergePatches(patch1.array, patch2.array,
+                                                             borderWidth=borderWidth,
+                                                             accelerated=True),
+                                                sign=patch1.sign)
+                except LookupError as le:
+                    mergedPatches[pair] = le
+            if isinstance(mergedPatches[pair], LookupError):
+                raise mergedPatches[pair]
+            return mergedPatches[pair]
+
+        def getVisualSpace(key, patch):
+            if not self.accelerated:
+                return patch.getVisualSpace(altPosMapf,
+                                            aziPosMapf,
+                                            pixelSize=visualSpacePixelSize,
+                                            closeIter=visualSpaceCloseIter)
+            if key not in visualSpaces:
+                visualSpaces[key] = patch.getVisualSpace(altPosMapf,
+                                                         aziPosMapf,
+                                                         pixelSize=visualSpacePixelSize,
+                                                         closeIter=visualSpaceCloseIter,
+                                                         vectorized=True)
+            return visualSpaces[key]
+
         while (mergeIter == 1) or (len(mergePairs) > 0):
 
             print('merge iteration: ' + str(mergeIter))
@@ -1394,7 +1552,8 @@ class RetinotopicMappingTrial(object):
             mergePairs = []
 
             # get adjacent pairs
-            adjPairs = adjacentPairs(patches, borderWidth=borderWidth + 1)
+            adjPairs = adjacentPairs(patches, borderWidth=borderWidth + 1,
+                                     accelerated=self.accelerated)
 
             for ind, pair in enumerate(adjPairs):  # for every adjacent pair
                 patch1 = patches[pair[0]]
@@ -1402,27 +1561,17 @@ class RetinotopicMappingTrial(object):
 
                 try:
                     # merge these two patches
-                    currMergedPatch = Patch(mergePatches(patch1.array, patch2.array, borderWidth=borderWidth),
-                                            sign=patch1.sign)
+                    currMergedPatch = getMergedPatch(pair, patch1, patch2)
 
                     # calculate unique area of the merged patch
-                    _, AU, _, _ = currMergedPatch.getVisualSpace(altPosMapf,
-                                                                 aziPosMapf,
-                                                                 pixelSize=visualSpacePixelSize,
-                                                                 closeIter=visualSpaceCloseIter)
+                    _, AU, _, _ = getVisualSpace(pair, currMergedPatch)
 
                     # calculate the visual space and unique area of the first patch
-                    visualSpace1, AU1, _, _ = patch1.getVisualSpace(altPosMapf,
-                                                                    aziPosMapf,
-                                                                    pixelSize=visualSpacePixelSize,
-                                                                    closeIter=visualSpaceCloseIter)
+                    visualSpace1, AU1, _, _ = getVisualSpace(pair[0], patch1)
                     visualSpace1 = visualSpace1.astype(np.uint8)
 
                     # calculate the visual space and unique area of the second patch
-                    visualSpace2, AU2, _, _ = patch2.getVisualSpace(altPosMapf,
-                                                                    aziPosMapf,
-                                                                    pixelSize=visualSpacePixelSize,
-                                                                    closeIter=visualSpaceCloseIter)
+                    visualSpace2, AU2, _, _ = getVisualSpace(pair[1], patch2)
                     visualSpace2 = visualSpace2.astype(np.uint8)
 
                     # calculate the overlapping area of these two patches
@@ -2748,10 +2897,13 @@ class Patch(object):
         else:
             return False
 
-    def getVisualSpace(self, altMap, aziMap, visualFieldOrigin=None, pixelSize=1., closeIter=None, isplot=False):
+    def getVisualSpace(self, altMap, aziMap, visualFieldOrigin=None, pixelSize=1., closeIter=None, isplot=False,
+                       vectorized=False):
         """
         get the visual response space, visual response space center unique area and
         eccentricity map of a cortical patch
+
+        vectorized: pixels of the patch projected at once, closing in the bounding box
         """
 
         #        altRange = np.array([np.amin(altMap)-10., np.amax(altMap)+10.])
@@ -2770,18 +2922,32 @@ class Patch(object):
                                 int(np.ceil((AZIMUTH_RANGE[1] - AZIMUTH_RANGE[0]) / pixelSize))))
 
         patchArray = self.array
-        for i in range(patchArray.shape[0]):
-            for j in range(patchArray.shape[1]):
-                if patchArray[i, j]:
-                    corAlt = altMap[i, j]
-                    corAzi = aziMap[i, j]
-                    if (corAlt >= ALTITUDE_RANGE[0]) & (corAlt < ALTITUDE_RANGE[1]) & (corAzi >= AZIMUTH_RANGE[0]) & (
-                        corAzi < AZIMUTH_RANGE[1]):
-                        indAlt = (corAlt - ALTITUDE_RANGE[0]) // pixelSize
-                        indAzi = (corAzi - AZIMUTH_RANGE[0]) // pixelSize
-                        visualSpace[np.int16(indAlt), np.int16(indAzi)] = 1
-
-        if closeIter >= 1:
+        if vectorized:
+            corAlt, corAzi = altMap[patchArray != 0], aziMap[patchArray != 0]
+            cond = (corAlt >= ALTITUDE_RANGE[0]) & (corAlt < ALTITUDE_RANGE[1]) &\
+                (corAzi >= AZIMUTH_RANGE[0]) & (corAzi < AZIMUTH_RANGE[1])
+            visualSpace[np.int16((corAlt[cond] - ALTITUDE_RANGE[0]) // pixelSize),
+                        np.int16((corAzi[cond] - AZIMUTH_RANGE[0]) // pixelSize)] = 1
+        else:
+            for i in range(patchArray.shape[0]):
+                for j in range(patchArray.shape[1]):
+                    if patchArray[i, j]:
+                        corAlt = altMap[i, j]
+                        corAzi = aziMap[i, j]
+                        if (corAlt >= ALTITUDE_RANGE[0]) & (corAlt < ALTITUDE_RANGE[1]) & (corAzi >= AZIMUTH_RANGE[0]) & (
+                            corAzi < AZIMUTH_RANGE[1]):
+                            indAlt = (corAlt - ALTITUDE_RANGE[0]) // pixelSize
+                            indAzi = (corAzi - AZIMUTH_RANGE[0]) // pixelSize
+                            visualSpace[np.int16(indAlt), np.int16(indAzi)] = 1
+
+        if vectorized and (closeIter >= 1):
+            # closing in the bounding box
+            box = boundingBox(visualSpace, closeIter + 1)
+            closedSpace = np.zeros(visualSpace.shape, dtype=np.int16)
+            if box is not None:
+                closedSpace[box] = ni.binary_closing(visualSpace[box], iterations=closeIter)
+            visualSpace = closedSpace
+        elif closeIter >= 1:
             visualSpace = ni.binary_closing(visualSpace, iterations=closeIter).astype(np.int16)
 
         uniqueArea = np.sum(visualSpace[:]) * (pixelSize ** 2)
@@ -2853,23 +3019,32 @@ class Patch(object):
         eccMap[self.array == 0] = np.nan
         return eccMap
 
-    def split2(self, eccMap, patchName='patch00', cutStep=1, borderWidth=2, isplot=False):
+    def split2(self, eccMap, patchName='patch00', cutStep=1, borderWidth=2, isplot=False,
+               accelerated=False):
         """
         split this patch into two or more patch, according to the eccentricity
         map (in degree). return a dictionary of patches after split
 
         patchName: str, original patch name
+        accelerated: split computed in the bounding box of the patch
+                     (eccMap should be NaN outside of the patch)
         """
+        if accelerated:
+            box = boundingBox(self.array, borderWidth + 2)
+        else:
+            box = tuple(slice(0, n) for n in self.array.shape)
+        selfArray, eccMap = self.array[box], eccMap[box]
+
         minMarker = localMin(eccMap, cutStep)
 
         connectivity = np.array([[1, 1, 1], [1, 1, 1], [1, 1, 1]])
 
-        newLabel = watershed(eccMap, minMarker, connectivity=connectivity, mask=self.array)
+        newLabel = watershed(eccMap, minMarker, connectivity=connectivity, mask=selfArray)
 
-        border = ni.binary_dilation(self.array).astype(np.int8) - self.array
+        border = ni.binary_dilation(selfArray).astype(np.int8) - selfArray
 
         for i in range(1, np.amax(newLabel) + 1):
-            currArray = np.zeros(self.array.shape, dtype=np.int8)
+            currArray = np.zeros(selfArray.shape, dtype=np.int8)
             currArray[newLabel == i] = 1
             currBorder = ni.binary_dilation(currArray).astype(np.int8) - currArray
             border = border + currBorder
@@ -2880,7 +3055,7 @@ class Patch(object):
         if borderWidth > 1:
             border = ni.binary_dilation(border, iterations=borderWidth - 1).astype(np.int8)
 
-        newPatchMap = ni.binary_dilation(self.array).astype(np.int8) * (-1 * (border - 1))
+        newPatchMap = ni.binary_dilation(selfArray).astype(np.int8) * (-1 * (border - 1))
 
         labeledNewPatchMap, patchNum = ni.label(newPatchMap)
 
@@ -2894,7 +3069,7 @@ class Patch(object):
 
             currPatchName = patchName + '.' + str(j)
             currArray = np.zeros(self.array.shape, dtype=np.int8)
-            currArray[labeledNewPatchMap == j] = 1
+            currArray[box][labeledNewPatchMap == j] = 1
             currArray = currArray * self.array
 
             if np.sum(currArray[:]) > 0:
@@ -2903,7 +3078,7 @@ class Patch(object):
         if isplot:
             plt.figure()
             plt.subplot(121)
-            plt.imshow(self.array, interpolation='nearest')
+            plt.imshow(selfArray, interpolation='nearest')
             plt.title(patchName + ': before split')
             plt.subplot(122)
             plt.imshow(labeledNewPatchMap, interpolation='nearest')
@@ -3028,6 +3203,54 @@ class Patch(object):
 
         return cor
 
+# ----------------------------------------------------------------
+#           parameter sweeps
+# ----------------------------------------------------------------
+
+WORKER = {}
+
+def initTrialWorker(trialData):
+    WORKER['trialData'] = trialData
+
+
+def processTrialWorker(params):
+    """
+    segmentation of the maps of the worker with a given set of parameters
+    """
+    trialData = dict(WORKER['trialData'])
+    if 'params' in trialData:
+        params = dict(trialData['params'], **params)
+    trialData['params'] = params
+
+    trial = RetinotopicMappingTrial(**trialData)
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        trial.processTrial(isPlot=False)
+
+    return trial.finalPatches
+
+
+def processTrials(trialData, PARAMS,
+                  nproc=max([1, multiprocessing.cpu_count()-1])):
+    """
+    segmentation of the same maps with several sets of parameters
+        (e.g. a sweep of "signMapThr"), in a pool of "nproc" processes
+
+    trialData: arguments of RetinotopicMappingTrial (e.g. from intrinsic.tools.build_trial_data)
+    PARAMS: list of parameters dictionaries (updating trialData['params'] if present)
+
+    returns the list of the final patches dictionaries
+    """
+    if (nproc>1) and (len(PARAMS)>1):
+        with ProcessPoolExecutor(max_workers=min([nproc, len(PARAMS)]),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=initTrialWorker,
+                                 initargs=(trialData,)) as pool:
+            return list(pool.map(processTrialWorker, PARAMS))
+    else:
+        initTrialWorker(trialData)
+        return [processTrialWorker(params) for params in PARAMS]
+
+
 # ----------------------------------------------------------------
 #           plot functions 
 # ----------------------------------------------------------------
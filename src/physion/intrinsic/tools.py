@@ -141,15 +141,37 @@ def load_single_datafile(datafile):
     return real_t, interp_func(real_t)
     # return t, nwbfile.acquisition['image_timeseries'].data[:,:,:]
 
-def load_raw_data(datafolder, protocol,
-                  run_id='sum'):
+def load_params(datafolder):
 
+    params = {}
     if os.path.isfile(os.path.join(datafolder, 'metadata.json')):
         with open(os.path.join(datafolder, 'metadata.json'), 'r') as f:
             params = json.load(f)
     elif os.path.isfile(os.path.join(datafolder, 'metadata.npy')):
         params = np.load(os.path.join(datafolder, 'metadata.npy'),
                        allow_pickle=True).item()
+    return params
+
+def get_datafiles(datafolder, protocol, run_id='sum'):
+    """
+    list of the NWB files of a protocol ("sum" -> all repeats)
+    """
+    if run_id=='sum':
+        # no more than 15 repeats...(but some can be removed)
+        return [os.path.join(datafolder, '%s-%i.nwb' % (protocol, i))\
+                for i in range(1, 15) if os.path.isfile(\
+                    os.path.join(datafolder, '%s-%i.nwb' % (protocol, i)))]
+    elif os.path.isfile(os.path.join(datafolder, '%s-%s.nwb' % (protocol, run_id))):
+        return [os.path.join(datafolder, '%s-%s.nwb' % (protocol, run_id))]
+    else:
+        print('"%s" file not found' % os.path.join(datafolder, '%s-%s.nwb' % (protocol, run_id)))
+        return []
+
+def load_raw_data(datafolder, protocol,
+                  run_id='sum'):
+
+    params = load_params(datafolder)
+
     if run_id=='sum':
         Data, n = None, 0
         for i in range(1, 15): # no more than 15 repeats...(but some can be removed, hence the "for" loop)
@@ -200,6 +222,75 @@ def perform_fft_analysis(data, nrepeat):
 
     return rel_power, phase
 
+def nearest_frame_indices(t, new_t):
+    """
+    index of the frame taken at each time of "new_t"
+        (same as interp1d(t, x, kind='nearest', fill_value='extrapolate'))
+    """
+    order = np.argsort(t, kind='mergesort')
+    bounds = t[order]/2.
+    bounds = bounds[1:]+bounds[:-1]
+    return order[np.searchsorted(bounds, new_t, side='left').clip(0, len(t)-1)]
+
+def single_bin_dft(datafile, nrepeat,
+                   spatial_subsampling=0,
+                   chunk_size=100):
+    """
+    Fourier component at the frequency bin "nrepeat" of a single recording,
+        streamed in chunks of "chunk_size" frames from the NWB file
+
+    the data resampled at the stimulus times (nearest frame) are never built:
+        each frame is weighted by the sum of the Fourier factors
+        of the stimulus times where it is the nearest frame
+
+    returns the complex Fourier component, the mean image and the number of samples
+        (i.e. np.fft.fft(data, axis=0)[nrepeat], data.mean(axis=0), data.shape[0])
+    """
+    io = pynwb.NWBHDF5IO(datafile, 'r')
+    nwbfile = io.read()
+
+    t = nwbfile.acquisition['image_timeseries'].timestamps[:].astype(np.float64)
+    real_t = nwbfile.acquisition['angle_timeseries'].timestamps[:]
+    indices = nearest_frame_indices(t, real_t)
+
+    # weights of each frame: real part, imaginary part and mean
+    N = len(real_t)
+    theta = 2.*np.pi*nrepeat*np.arange(N)/N
+    weights = np.array([np.bincount(indices, weights=w, minlength=len(t))\
+                            for w in [np.cos(theta), -np.sin(theta), np.ones(N)/N]])
+
+    data = nwbfile.acquisition['image_timeseries'].data
+    result = 0.
+    for i in range(indices.min(), indices.max()+1, chunk_size):
+        chunk = slice(i, min([i+chunk_size, indices.max()+1]))
+        x = resample_img(data[chunk].astype(np.float64), spatial_subsampling)
+        result = result+np.dot(weights[:,chunk],
+                               x.reshape(x.shape[0], -1)).reshape(3, *x.shape[1:])
+
+    io.close()
+    return result[0]+1j*result[1], result[2], N
+
+def perform_streaming_fft_analysis(datafiles, nrepeat,
+                                   spatial_subsampling=0,
+                                   chunk_size=100):
+    """
+    same as "perform_fft_analysis" on the data of "load_raw_data"
+        (average over the repeats), with a memory independent of the recording length
+    """
+    spectrum, mean = 0., 0.
+    for datafile in datafiles:
+        s, m, N = single_bin_dft(datafile, nrepeat,
+                                 spatial_subsampling=spatial_subsampling,
+                                 chunk_size=chunk_size)
+        spectrum, mean = spectrum+s/len(datafiles), mean+m/len(datafiles)
+
+    # relative power w.r.t. luminance
+    rel_power = np.abs(spectrum)/N/mean
+
+    phase = np.angle(spectrum)
+
+    return rel_power, phase
+
 def perform_phase_shift(phase, shift):
     """
     need phase in [-pi:pi] and shift in [0,2pi]
@@ -241,18 +332,27 @@ def find_ellipse_cond(maps, shape):
 def compute_phase_power_maps(datafolder, direction,
                              maps={},
                              p=None, t=None, data=None,
-                             run_id='sum'):
+                             run_id='sum',
+                             spatial_subsampling=0):
+    """
+    if the data are not provided, they are streamed from the NWB files
+        (see "perform_streaming_fft_analysis")
+    """
 
-    # load raw data
     if (p is None) or (t is None) or (data is None):
-        p, (t, data) = load_raw_data(datafolder, direction, run_id=run_id)
-
-    # FFT and write maps
-    maps['%s-power' % direction],\
-           maps['%s-phase' % direction] = perform_fft_analysis(data, p['Nrepeat'])
+        # FFT streamed from the raw data
+        p = load_params(datafolder)
+        maps['%s-power' % direction],\
+            maps['%s-phase' % direction] = perform_streaming_fft_analysis(\
+                        get_datafiles(datafolder, direction, run_id=run_id),
+                        p['Nrepeat'], spatial_subsampling=spatial_subsampling)
+    else:
+        # FFT of the loaded data
+        maps['%s-power' % direction],\
+            maps['%s-phase' % direction] = perform_fft_analysis(data, p['Nrepeat'])
 
     if 'ROI' in maps:
-        ellipse = find_ellipse_cond(maps, (data.shape[1], data.shape[2]))
+        ellipse = find_ellipse_cond(maps, maps['%s-power' % direction].shape)
         maps['%s-power' % direction][~ellipse] = 0
         maps['%s-phase' % direction][~ellipse] = 0
 
@@ -323,8 +423,7 @@ def compute_retinotopic_maps(datafolder, map_type,
 
         if (('%s-power'%direction) not in maps) and not keep_maps:
             compute_phase_power_maps(datafolder, direction,
-                                     maps=maps,
-                                     phase_shift=phase_shift)
+                                     maps=maps)
 
     # phase shift maps
     maps = phase_shift_maps(maps, directions, phase_shift)
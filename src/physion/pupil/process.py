@@ -1,4 +1,5 @@
-import sys, os, pathlib, time
+import sys, os, pathlib, time, types, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy import optimize
 from scipy.ndimage import gaussian_filter
@@ -120,12 +121,14 @@ def perform_fit(cls,
     # evaluate basiv props
     mu, stds, [angle, _] = find_ellipse_props_of_binary_image_from_PCA(cls.x, cls.y, cls.img_fit)
     inside_ellipse = inside_ellipse_cond(cls.x, cls.y, *mu, inside_std_factor*stds[0], inside_std_factor*stds[1], angle)
+    # the reflector areas do not change across iterations
+    inside_reflectors = np.zeros(inside_ellipse.shape, dtype=bool)
+    for r in reflectors:
+        inside_reflectors = inside_reflectors | inside_ellipse_cond(cls.x, cls.y, *r)
     # iteratively excluding what is not around the center of mass (factor*std away !)
     for i in range(N_iterations):
         # re-introducing the overlap between reflector and ellipse fit
-        overlap_cond = np.zeros(inside_ellipse.shape, dtype=bool)
-        for r in reflectors:
-            overlap_cond = overlap_cond | (inside_ellipse & inside_ellipse_cond(cls.x, cls.y, *r))
+        overlap_cond = inside_ellipse & inside_reflectors
         cls.img_fit[overlap_cond] = 1
         # re-evaluate props
         mu, stds, [angle, _] = find_ellipse_props_of_binary_image_from_PCA(cls.x, cls.y, cls.img_fit)
@@ -177,6 +180,133 @@ def perform_loop(parent,
     temp['blinking'] = np.zeros(len(temp['cx']), dtype=np.uint)
     
     return temp
+
+
+def read_frames(camData, frames):
+    """
+    reads a set of frames, 
+        from the memory-mapped binary file when available (see CameraData)
+
+    a frame that can not be read is replaced by the previous one (as in "preprocess")
+    """
+    frames = np.array(frames)
+    if camData.frames is not None:
+        return camData[frames]
+
+    IMGS = []
+    for frame in frames:
+        try:
+            IMGS.append(camData.get(frame))
+        except ValueError:
+            print(' [!!] Problem with frame #%i, replaced with #%i ' % (frame, frame-1))
+            IMGS.append(camData.get(frame-1))
+    return IMGS
+
+
+def init_batch_fit(camData, config):
+    """
+    fit area built from the "pupil.npy" config only (no GUI object)
+    """
+    cls = types.SimpleNamespace(camData=camData)
+    fullimg = camData.get(0)
+    cls.Lx, cls.Ly = fullimg.shape
+    init_fit_area(cls,
+                  fullimg=fullimg,
+                  ellipse=config['ROIellipse'],
+                  blanks=(config['blanks'] if 'blanks' in config else []))
+    return cls
+
+
+def fit_frames(args):
+    """
+    fits the pupil on a shard of frames (run in the worker processes)
+
+    args = (folder, name, frames, config, block_size)
+
+    returns an array of shape (len(frames), 6) with: cx, cy, sx, sy, angle, residual
+    """
+    # import here to keep the worker processes light at startup
+    from physion.utils.camera import CameraData
+
+    folder, name, frames, config, block_size = args
+
+    camData = CameraData(name, folder=folder, verbose=False)
+    cls = init_batch_fit(camData, config)
+
+    saturation = config['ROIsaturation']
+    gaussian_smoothing = (config['gaussian_smoothing']\
+                            if 'gaussian_smoothing' in config else 0)
+    reflectors = (config['reflectors'] if 'reflectors' in config else [])
+
+    results = np.zeros((len(frames), 6))
+    for i0 in range(0, len(frames), block_size):
+        for i, img in enumerate(read_frames(camData, frames[i0:i0+block_size])):
+            preprocess(cls, img=img,
+                       with_reinit=False,
+                       gaussian_smoothing=gaussian_smoothing,
+                       saturation=saturation)
+            coords, _, res = perform_fit(cls,
+                                         saturation=saturation,
+                                         reflectors=reflectors)
+            results[i0+i,:5], results[i0+i,5] = coords, res
+
+    return results
+
+
+def perform_batch(camData, config,
+                  subsampling=1,
+                  nproc=None,
+                  shards_per_proc=4,
+                  block_size=500,
+                  with_ProgressBar=False):
+    """
+    stateless version of "perform_loop" (no GUI object is modified):
+        the frames are split into contiguous shards fitted in a process pool,
+        each worker reads its frames by blocks of "block_size" frames
+
+    config: the dictionary of the "pupil.npy" file
+        (keys: "ROIellipse", "ROIsaturation", "gaussian_smoothing", "reflectors", "blanks")
+
+    nproc: number of processes (default: all cpus but one)
+
+    returns the same data as "perform_loop"
+    """
+    frames = np.array(list(range(camData.nFrames-1)[::subsampling])+[camData.nFrames-1])
+
+    if nproc is None:
+        nproc = max([1, multiprocessing.cpu_count()-1]) # leaving 1 cpu for the rest
+
+    SHARDS = np.array_split(frames, min([len(frames), nproc*shards_per_proc]))
+    ARGS = [(camData.folder, camData.name, shard, config, block_size) for shard in SHARDS]
+
+    if with_ProgressBar:
+        printProgressBar(0, len(SHARDS))
+
+    RESULTS = []
+    if nproc>1:
+        # "spawn" for fresh states in the workers (no forked video captures)
+        with ProcessPoolExecutor(max_workers=nproc,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            for results in pool.map(fit_frames, ARGS):
+                RESULTS.append(results)
+                if with_ProgressBar:
+                    printProgressBar(len(RESULTS), len(SHARDS))
+    else:
+        for args in ARGS:
+            RESULTS.append(fit_frames(args))
+            if with_ProgressBar:
+                printProgressBar(len(RESULTS), len(SHARDS))
+
+    print('Pupil size calculation over !')
+
+    RESULTS = np.concatenate(RESULTS)
+    temp = {'frame':frames}
+    for i, key in enumerate(['cx', 'cy', 'sx', 'sy', 'angle', 'residual']):
+        temp[key] = RESULTS[:,i]
+    temp['residual'] = np.array(temp['residual'], dtype=int)
+    temp['blinking'] = np.zeros(len(temp['cx']), dtype=np.uint)
+
+    return temp
     
 def extract_boundaries_from_ellipse(ellipse, Lx, Ly):
     if len(ellipse)==5:
@@ -209,6 +339,8 @@ def init_fit_area(cls,
         cls.zoom_cond = (cls.fullx>=bfe['xmin']) & (cls.fullx<=bfe['xmax']) &\
                         (cls.fully>=bfe['ymin']) & (cls.fully<=bfe['ymax'])
         Nx, Ny = bfe['xmax']-bfe['xmin']+1, bfe['ymax']-bfe['ymin']+1
+        cls.zoom = (slice(bfe['xmin'], bfe['xmax']+1),
+                    slice(bfe['ymin'], bfe['ymax']+1))
     else:
         cls.zoom_cond = ((cls.fullx>=np.min(cls.ROI.x[cls.ROI.ellipse])) &\
                          (cls.fullx<=np.max(cls.ROI.x[cls.ROI.ellipse])) &\
@@ -217,6 +349,10 @@ def init_fit_area(cls,
     
         Nx=np.max(cls.ROI.x[cls.ROI.ellipse])-np.min(cls.ROI.x[cls.ROI.ellipse])+1
         Ny=np.max(cls.ROI.y[cls.ROI.ellipse])-np.min(cls.ROI.y[cls.ROI.ellipse])+1
+        cls.zoom = (slice(np.min(cls.ROI.x[cls.ROI.ellipse]), 
+                          np.max(cls.ROI.x[cls.ROI.ellipse])+1),
+                    slice(np.min(cls.ROI.y[cls.ROI.ellipse]),
+                          np.max(cls.ROI.y[cls.ROI.ellipse])+1))
 
     cls.Nx, cls.Ny = Nx, Ny
     
@@ -232,8 +368,8 @@ def init_fit_area(cls,
 
     if hasattr(cls, 'bROI'):
         blanks = [r.extract_props() for r in cls.bROI]
-        for r in blanks:
-            cls.fit_area = cls.fit_area & ~inside_ellipse_cond(cls.x, cls.y, *r)
+    for r in blanks:
+        cls.fit_area = cls.fit_area & ~inside_ellipse_cond(cls.x, cls.y, *r)
 
 def clip_to_finite_values(data, keys):
     
@@ -265,7 +401,8 @@ def preprocess(cls, with_reinit=True,
 
     if with_reinit:
         init_fit_area(cls)
-    cls.img = img[cls.zoom_cond].reshape(cls.Nx, cls.Ny)
+    # the zoom area is a rectangle -> slicing (instead of the full-image mask)
+    cls.img = np.array(img[cls.zoom])
     
     # first smooth
     if gaussian_smoothing>0:
@@ -356,6 +493,7 @@ if __name__=='__main__':
     # parser.add_argument("--saturation", type=float, default=75)
     parser.add_argument("--maxiter", type=int, default=100)
     parser.add_argument('-s', "--subsampling", type=int, default=1)
+    parser.add_argument("--nproc", type=int, default=None)
     # parser.add_argument("--gaussian_smoothing", type=float, default=0)
     # parser.add_argument("--ellipse", type=float, default=[], nargs=)
     # parser.add_argument("--gaussian_smoothing", type=float, default=0)
@@ -416,24 +554,20 @@ if __name__=='__main__':
     else:
         if os.path.isfile(os.path.join(args.datafolder, 'pupil.npy')):
             print('Processing pupil for "%s" [...]' % os.path.join(args.datafolder, 'pupil.npy'))
-            args.imgfolder = os.path.join(args.datafolder, 'FaceCamera-imgs')
-            load_folder(args)
+            from physion.utils.camera import CameraData
+            camData = CameraData('FaceCamera', folder=args.datafolder,
+                                 verbose=args.verbose)
             args.data = np.load(os.path.join(args.datafolder, 'pupil.npy'),
                            allow_pickle=True).item()
-            init_fit_area(args,
-                          fullimg=None,
-                          ellipse=args.data['ROIellipse'],
-                          blanks=(args.data['blanks'] if 'blanks' in args.data else []))
-            temp = perform_loop(args,
-                                subsampling=args.subsampling,
-                                gaussian_smoothing=args.data['gaussian_smoothing'],
-                                saturation=args.data['ROIsaturation'],
-                                reflectors=(args.data['reflectors'] if 'reflectors'  in args.data else []),
-                                with_ProgressBar=args.verbose)
-            temp['t'] = args.times[np.array(temp['frame'])]
+            temp = perform_batch(camData, args.data,
+                                 subsampling=args.subsampling,
+                                 nproc=args.nproc,
+                                 with_ProgressBar=args.verbose)
+            temp['times'] = camData.times[temp['frame']]
             for key in temp:
                 args.data[key] = temp[key]
-            args.data = clip_to_finite_values(args.data)
+            args.data = clip_to_finite_values(args.data, 
+                                    ['cx', 'cy', 'sx', 'sy', 'residual', 'angle'])
             np.save(os.path.join(args.datafolder, 'pupil.npy'), args.data)
             print('Data successfully saved as "%s"' % os.path.join(args.datafolder, 'pupil.npy'))
         else:
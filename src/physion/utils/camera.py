@@ -1,7 +1,8 @@
 """
 a common Movie object to load movie data either from 
         1) a folder of single frames
-        2) or from a movie format
+        2) or from a binary file (memory-mapped, see "convert_to_binary")
+        3) or from a movie format
 
 the data for the modality "X" need to have the following specs:
     i) for data stored as frames:
@@ -9,6 +10,19 @@ the data for the modality "X" need to have the following specs:
     i) or data stored as video:
             - the video should be called "X.mp4" or "X.[format]" (see format option)
             - there should be a "X-summary.npy" file
+    iii) or data stored as binary:
+            - "X.bin" with the contiguous frames (C-order, shape: nFrames x Ly x Lx)
+            - the "X-summary.npy" file stores the index: "times_binary", 
+                   "imageSize_binary"=(Lx, Ly) and "dtype_binary" (default: uint8)
+
+frames are accessed with:
+    - camData.get(index)
+    - camData.get_block(start, stop) -> array of shape (stop-start, Lx, Ly)
+    - camData[indices] (integer, slice or array of indices)
+
+to convert a folder of single frames or a movie to binary:
+
+    python -m physion.utils.camera /path/to/your/folder to-binary
 """
 
 import os, sys
@@ -37,23 +51,24 @@ class CameraData:
         self.FRAMES, self.FILES = None, None
         self.verbose = verbose
         self.summary = None
-        self.binary_file = None
+        self.binary_file, self.frames = None, None
 
-        if os.path.isdir(\
-                os.path.join(self.folder, '%s-imgs' % name)):
+        # the binary file is preferred (zero-copy frame access)
+        if os.path.isfile(\
+                     os.path.join(self.folder, '%s.bin' % (name))):
             print("""
                   %s
-            camera data loaded from the set of *.npy frames 
+            camera data loaded from the binary file 
             """ % folder)
-            self.load_from_set_of_npy_frames(name)
+            self.load_from_binary(name)
 
-        elif os.path.isfile(\
-                     os.path.join(self.folder, '%s.bin' % (name))):
+        elif os.path.isdir(\
+                os.path.join(self.folder, '%s-imgs' % name)):
             print("""
                   %s
-            camera data loaded from the binary file 
+            camera data loaded from the set of *.npy frames 
             """ % folder)
-            self.load_from_binary(name)
+            self.load_from_set_of_npy_frames(name)
         
         elif np.sum([\
                 os.path.isfile(\
@@ -122,14 +137,33 @@ class CameraData:
             # print(self.nFrames/(self.times[-1]-self.times[0]))
 
     def load_from_binary(self, name):
+        """
+        the binary file is memory-mapped once (in "self.frames"),
+            frames are then read on demand by the OS, without copy
+        """
 
         self.load_summary()
         self.binary_file = os.path.join(self.folder, '%s.bin' % name)
         self.Lx, self.Ly = self.summary['imageSize_binary']
         self.times = self.summary['times_binary']
-        self.nbytesread = np.int64( 2 * self.Lx * self.Ly )
         self.nFrames = len(self.summary['times_binary'])
 
+        dtype = np.dtype(self.summary['dtype_binary']\
+                            if 'dtype_binary' in self.summary else np.uint8)
+        nFrames_file = int(os.path.getsize(self.binary_file)/\
+                                (self.Lx*self.Ly*dtype.itemsize))
+        if nFrames_file!=self.nFrames:
+            print(' [!!] %i frames in binary file, %i frames in summary ' % (\
+                                        nFrames_file, self.nFrames))
+            if len(self.original_times)==self.nFrames:
+                # one original timestamp per binary frame (converted from frames)
+                self.original_times = self.original_times[:nFrames_file]
+            self.nFrames = min([nFrames_file, self.nFrames])
+            self.times = self.times[:self.nFrames]
+
+        self.frames = np.memmap(self.binary_file, dtype=dtype, mode='r',
+                                shape=(self.nFrames, self.Ly, self.Lx))
+
     def load_from_movie(self, name, video_formats):
 
         # find video extension
@@ -212,13 +246,10 @@ class CameraData:
     def get(self, index, 
             from_relative_time=None):
 
-        if self.binary_file is not None:
+        if self.frames is not None:
 
-            with open(self.binary_file, 'r') as f:
-                data = np.fromfile(f, count=self.Lx*self.Ly, 
-                            dtype=np.uint8, 
-                            offset=index*self.Lx*self.Ly)
-            return np.reshape(data, (self.Ly, self.Lx)).T
+            # read-only view on the memory-mapped file
+            return self.frames[index].T
 
         elif self.FILES is not None:
             return np.load(os.path.join(self.folder, 
@@ -277,11 +308,46 @@ class CameraData:
         else:
             return None
 
+    def get_block(self, start, stop):
+        """
+        contiguous frames [start, stop[ -> array of shape (stop-start, Lx, Ly)
+
+        a (read-only) view for binary files, a stack of frames otherwise
+        """
+        if self.frames is not None:
+            return self.frames[start:stop].transpose(0,2,1)
+        else:
+            return np.array([self.get(i) for i in range(start, min([stop, self.nFrames]))])
+
+    def __getitem__(self, index):
+        """
+        camData[i], camData[start:stop:step], camData[array_of_indices]
+        """
+        if isinstance(index, (int, np.integer)):
+            return self.get(index)
+        elif self.frames is not None:
+            return self.frames[index].transpose(0,2,1)
+        else:
+            return np.array([self.get(i) for i in np.arange(self.nFrames)[index]])
+
+    def __len__(self):
+        return self.nFrames
+
     def convert_to_binary(self,
                           subsampling=1,
                           dtype='uint8'):
+        """
+        builds the "X.bin" file (and its index in "X-summary.npy")
+            from the folder of single frames or from the movie
 
-        if self.cap is not None:
+        the subsampling only applies to movies
+        """
+
+        if self.FILES is not None:
+
+            self.convert_frames_to_binary()
+
+        elif self.cap is not None:
 
             ok, img = self.cap.read()
 
@@ -307,6 +373,52 @@ class CameraData:
 
             self.save_summary()
 
+            self.load_from_binary(self.name)
+
+    def convert_frames_to_binary(self):
+        """
+        one-shot conversion of the folder of single *.npy frames 
+            into a single contiguous binary file
+
+        frames that can not be read are replaced by the previous frame
+            (see "Frames_succesfully_in_binary" in the summary)
+        """
+        img = np.load(os.path.join(self.folder, '%s-imgs' % self.name,
+                                   self.FILES[0]))
+        success = np.zeros(len(self.FILES), dtype=bool)
+
+        # written to a temporary file, renamed when complete
+        filename = os.path.join(self.folder, '%s.bin' % self.name)
+        with open(filename+'.tmp', 'wb') as f:
+            for i, fn in enumerate(self.FILES):
+                try:
+                    img = np.load(os.path.join(self.folder, 
+                                               '%s-imgs' % self.name, fn))
+                    success[i] = True
+                except BaseException as be:
+                    print(be)
+                    print('problem with frame:', fn)
+                f.write(np.ascontiguousarray(img).tobytes())
+                if i%100==0:
+                    printProgressBar(i, len(self.FILES))
+        printProgressBar(len(self.FILES), len(self.FILES))
+        os.replace(filename+'.tmp', filename)
+
+        if os.path.isfile(os.path.join(self.folder, '%s-summary.npy' % self.name)):
+            self.load_summary()
+        else:
+            self.summary = {}
+        self.summary['times'] = self.times
+        self.summary['FILES'] = self.FILES
+        # frames are stored as in the *.npy files (get returns the transposed)
+        self.summary['imageSize_binary'] = (img.shape[1], img.shape[0])
+        self.summary['times_binary'] = self.times
+        self.summary['dtype_binary'] = str(img.dtype)
+        self.summary['Frames_succesfully_in_binary'] = success
+        self.save_summary()
+
+        self.load_from_binary(self.name)
+
     def convert_to_movie(self,
                          dtype='uint8'):
 
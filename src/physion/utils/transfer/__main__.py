@@ -2,6 +2,7 @@ import argparse
 import shutil, os, glob
 
 from .types import TYPES
+from .engine import transfer
 
 Help = ''
 for t in TYPES:
@@ -14,18 +15,20 @@ parser.add_argument("source", type=str)
 parser.add_argument("destination", type=str)
 parser.add_argument("type", type=str, 
                     help="should be one of %s :" % Help)
+parser.add_argument("--nthreads", type=int, default=4,
+                    help="number of files copied in parallel")
 args = parser.parse_args()
 
 
 if args.type in TYPES:
     
-    for f in [f for f in os.listdir(args.source) if not f.startswith('.')]:
-
-        print(' - copying "%s" [...] ' % os.path.join(args.source, f))
-        shutil.copytree(os.path.join(args.source, f),
-                        os.path.join(args.destination, f),
-                        dirs_exist_ok=True,
-                        ignore=TYPES[args.type])
+    # each (non-hidden) top-level folder is copied as with shutil.copytree
+    transfer(args.source, args.destination,
+             ignore=TYPES[args.type],
+             folders=[f for f in sorted(os.listdir(args.source))\
+                        if not f.startswith('.') and\
+                            os.path.isdir(os.path.join(args.source, f))],
+             nthreads=args.nthreads)
 
 else:
     print(' need to choose a key from types:')
@@ -0,0 +1,179 @@
+"""
+Transfer engine: parallel, resumable and checksummed copy of a data folder
+
+    1) a manifest of the files is built with the ignore functions of
+        "physion.utils.transfer.types.TYPES" (same selection as shutil.copytree)
+    2) the files are copied in a thread pool ("nthreads" workers):
+        - a file whose size, modification time and checksum already match
+            at the destination is skipped (an interrupted transfer restarts
+            where it stopped)
+        - the data are written to "[file].part" then renamed, so that a killed
+            transfer never leaves a truncated file under its final name
+        - the copy is read back and its checksum compared to the source one
+    3) a verification report is written in:
+            "[destination]/.transfer-reports/[date]-[time].json"
+
+usage:
+    python -m physion.utils.transfer SOURCE DESTINATION TYPE --nthreads 4
+"""
+import os, time, json, shutil, hashlib, datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+def build_manifest(source, ignore=None, folders=None):
+    """
+    files to transfer, as selected by shutil.copytree(source, ..., ignore=ignore)
+
+    folders: sub-folders of source copied one by one (then the ignore function
+                does not apply to the content of source itself)
+
+    returns (FOLDERS, FILES)
+        FOLDERS: relative paths of the folders
+        FILES: list of {'path':relative path, 'size':bytes, 'mtime_ns':int}
+    """
+    FOLDERS, FILES = [], []
+
+    def walk(relpath):
+        FOLDERS.append(relpath)
+        path = os.path.join(source, relpath)
+        names = os.listdir(path)
+        ignored = ignore(path, names) if (ignore is not None) else set()
+        for name in sorted(names):
+            if name in ignored:
+                continue
+            if os.path.isdir(os.path.join(path, name)):
+                walk(os.path.join(relpath, name))
+            else:
+                stat = os.stat(os.path.join(path, name))
+                FILES.append({'path':os.path.join(relpath, name),
+                              'size':stat.st_size,
+                              'mtime_ns':stat.st_mtime_ns})
+
+    if folders is None:
+        walk('')
+    else:
+        for folder in folders:
+            walk(folder)
+
+    return FOLDERS, FILES
+
+
+def file_checksum(filename, chunk_size=2**23):
+    """ sha1 of the file content """
+    checksum = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_file(source, destination, chunk_size=2**23):
+    """
+    copy (via a ".part" file) with the metadata of shutil.copy2,
+        returns the sha1 of the data read from the source
+    """
+    checksum = hashlib.sha1()
+    with open(source, 'rb') as fsrc, open(destination+'.part', 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(chunk_size), b''):
+            checksum.update(chunk)
+            fdst.write(chunk)
+    shutil.copystat(source, destination+'.part')
+    os.replace(destination+'.part', destination)
+    return checksum.hexdigest()
+
+
+def transfer_file(source, destination, entry):
+    """
+    transfer of a manifest entry (run in the worker threads)
+
+    returns the entry with keys:
+        status ("copied", "skipped" or "failed"), sha1, time, error
+    """
+    tic = time.time()
+    src, dst = os.path.join(source, entry['path']),\
+                    os.path.join(destination, entry['path'])
+    result = dict(entry, status='failed', sha1='', time=0, error='')
+    try:
+        if os.path.isfile(dst) and (os.stat(dst).st_size==entry['size']) and\
+                (os.stat(dst).st_mtime_ns==entry['mtime_ns']):
+            result['sha1'] = file_checksum(src)
+            if file_checksum(dst)==result['sha1']:
+                result['status'] = 'skipped'
+
+        if result['status']!='skipped':
+            result['sha1'] = copy_file(src, dst)
+            if file_checksum(dst)==result['sha1']:
+                result['status'] = 'copied'
+            else:
+                result['error'] = 'checksum mismatch after copy'
+
+    except BaseException as be:
+        result['error'] = str(be) if str(be)!='' else type(be).__name__
+
+    result['time'] = time.time()-tic
+    return result
+
+
+def print_summary(RESULTS):
+    """
+    summary of the transfer (the failed files are listed)
+    """
+    print('')
+    for r in RESULTS:
+        if r['status']=='failed':
+            print('   [!!] %s: %s' % (r['path'], r['error']))
+    print(' n=%i copied (%.1f MB), n=%i skipped (up-to-date), n=%i failed' % (\
+            len([r for r in RESULTS if r['status']=='copied']),
+            sum([r['size'] for r in RESULTS if r['status']=='copied'])/1e6,
+            len([r for r in RESULTS if r['status']=='skipped']),
+            len([r for r in RESULTS if r['status']=='failed'])))
+    print('')
+
+
+def transfer(source, destination,
+             ignore=None,
+             folders=None,
+             nthreads=4,
+             verbose=True):
+    """
+    source, destination: root folders
+    ignore: an ignore function of shutil.copytree (see TYPES)
+    folders: sub-folders of source to transfer (all the content if None)
+    nthreads: number of files copied in parallel
+
+    returns the list of results of "transfer_file"
+    """
+    tic = time.time()
+    FOLDERS, FILES = build_manifest(source, ignore=ignore, folders=folders)
+    if verbose:
+        print(' - manifest: %i files (%.1f MB) in %i folders ' % (len(FILES),
+                sum([f['size'] for f in FILES])/1e6, len(FOLDERS)))
+
+    for folder in FOLDERS:
+        os.makedirs(os.path.join(destination, folder), exist_ok=True)
+
+    RESULTS = []
+    with ThreadPoolExecutor(max_workers=nthreads) as pool:
+        # largest files first, for a better load balance
+        for result in pool.map(lambda entry: transfer_file(source, destination, entry),
+                               sorted(FILES, key=lambda f: -f['size'])):
+            RESULTS.append(result)
+            if verbose:
+                print(' [%i/%i] %s: "%s" ' % (len(RESULTS), len(FILES),
+                                               result['status'], result['path']))
+
+    # verification report
+    report = os.path.join(destination, '.transfer-reports',
+                          datetime.datetime.now().strftime('%Y_%m_%d-%H-%M-%S.json'))
+    os.makedirs(os.path.dirname(report), exist_ok=True)
+    with open(report, 'w') as f:
+        json.dump({'source':os.path.abspath(source),
+                   'destination':os.path.abspath(destination),
+                   'time':time.time()-tic,
+                   'files':RESULTS}, f, indent=1)
+
+    if verbose:
+        print_summary(RESULTS)
+        print(' [ok] verification report: "%s" ' % report)
+
+    return RESULTS
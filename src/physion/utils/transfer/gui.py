@@ -7,6 +7,7 @@ from physion.utils.paths import FOLDERS
 
 # include/exclude functions here !
 from physion.utils.transfer.types import TYPES
+from physion.utils.transfer.engine import transfer
 
 def transfer_gui(self,
                  tab_id=3):
@@ -100,9 +101,8 @@ def run_transfer(self):
         print(' copying "%s" ' % self.typeBox.currentText())
         print('     from "%s"' % self.source_folder)
         print('       to "%s"' % self.destination_folder)
-        shutil.copytree(self.source_folder, self.destination_folder, 
-                        dirs_exist_ok=True,
-                        ignore=TYPES[self.typeBox.currentText()])
+        transfer(self.source_folder, self.destination_folder, 
+                 ignore=TYPES[self.typeBox.currentText()])
         print('    ==> done !')
         print()
 
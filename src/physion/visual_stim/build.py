@@ -1,6 +1,7 @@
-import sys
+import sys, os, time, multiprocessing, collections
 import cv2 as cv
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 import physion
 
@@ -87,14 +88,17 @@ class MonitoringSquare:
         """
         't' is the time from stimulus start !
         """
-        image[self.mask] = -1. # black by default
+        image[self.mask] = self.color(t, tstart, tstop)
+        return image
+
+    def color(self, t, tstart, tstop):
         if (t<tstop) & (t>=tstart):
             iT = int(1000*(t-tstart))
             if (iT%1000)<150:
-                image[self.mask] = 1.
+                return 1.
             elif (iT>=500) & (iT<650):
-                image[self.mask] = 1.
-        return image
+                return 1.
+        return -1. # black by default
 
     def find_mask(self, Stim):
         """ find the position of the square """
@@ -119,6 +123,246 @@ class MonitoringSquare:
             self.mask[:S,:S] = True
         
 
+######################################################
+##  ----         MOVIE BUILDING             --- #####
+######################################################
+
+# memory budget of the cache of static frames, per process (see "FrameCache")
+FRAME_CACHE_BYTES = 256e6
+
+class FrameCache:
+    """
+    cache of the rendered static frames (lists of uint8 arrays, one per screen)
+
+    least-recently-used eviction above "max_bytes" (FRAME_CACHE_BYTES by default),
+        the frames of the blank periods are never evicted
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = FRAME_CACHE_BYTES if max_bytes is None else max_bytes
+        self.frames, self.nbytes = collections.OrderedDict(), 0
+
+    def __contains__(self, key):
+        return key in self.frames
+
+    def __getitem__(self, key):
+        self.frames.move_to_end(key)
+        return self.frames[key]
+
+    def __setitem__(self, key, frames):
+        if key in self.frames:
+            self.nbytes -= np.sum([f.nbytes for f in self.frames.pop(key)])
+        self.frames[key] = frames
+        self.nbytes += np.sum([f.nbytes for f in frames])
+        # evict the oldest frames (except the new ones and the blank ones)
+        for k in list(self.frames.keys())[:-1]:
+            if self.nbytes<=self.max_bytes:
+                break
+            if k[0]!='blank':
+                self.nbytes -= np.sum([f.nbytes for f in self.frames.pop(k)])
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def movie_timeline(Stim):
+    """
+    time and episode of each frame of the movie
+
+    returns T, INDICES, TSTART, TSTOP (arrays of length nFrames)
+        with INDICES=-1 and TSTART=TSTOP=np.inf after the last episode
+    """
+    T, INDICES, TSTART, TSTOP = [], [], [], []
+
+    t, tend = 0, Stim.experiment['time_stop'][-1]+\
+            Stim.experiment['interstim'][-1]
+    nEpisodes = len(Stim.experiment['index'])
+    index = 0
+    tstart, tstop = Stim.experiment['time_start'][0], Stim.experiment['time_stop'][0]
+
+    while t<tend:
+
+        if t>=tstop:
+            index += 1
+            if index<nEpisodes:
+                tstart = Stim.experiment['time_start'][index]
+                tstop = Stim.experiment['time_stop'][index]
+            else:
+                tstart, tstop = np.inf, np.inf
+
+        T.append(t)
+        INDICES.append(index if index<nEpisodes else -1)
+        TSTART.append(tstart)
+        TSTOP.append(tstop)
+
+        # same accumulation of the time step than the real-time loop
+        t+= 1./Stim.movie_refresh_freq
+
+    return np.array(T), np.array(INDICES), np.array(TSTART), np.array(TSTOP)
+
+
+def render_frames(Stim, t, index, tstart, tstop, 
+                  square=None,
+                  cache=None):
+    """
+    frames at time "t" (list of uint8 arrays, one per screen)
+
+    the frames of time-invariant episodes and of the blank periods are cached
+        keyed on the episode parameters (shared between the repeats)
+        and on the color of the monitoring square (see "FrameCache")
+    """
+    on_episode = (t>=tstart) and (t<tstop)
+
+    key = None
+    if (cache is not None) and ((not on_episode) or Stim.is_static(index)):
+        key = (Stim.episode_key(index) if on_episode else 'blank',
+               square.color(t, tstart, tstop) if (square is not None) else None)
+        if key in cache:
+            return cache[key]
+
+    # data in [0,1]
+    if on_episode:
+        data = Stim.gamma_correction(\
+                Stim.get_image(index, t-tstart))
+    else:
+        data = Stim.blank_color+\
+                    Stim.get_null_image()
+
+    # put the monitoring square
+    if square is not None:
+        data = square.draw(data, t, tstart, tstop)
+
+    frames = [np.array(255*np.rot90(Stim.restrict_to_screen(data, 
+                                                            screen_id=s+1), k=1),
+                       dtype='uint8')\
+                for s in range(Stim.screen['nScreens'])]
+    if key is not None:
+        cache[key] = frames
+
+    return frames
+
+
+def render_chunk(Stim, T, INDICES, TSTART, TSTOP, filename,
+                 cache=None):
+    """
+    renders a chunk of frames, 
+        the frames of screen "s" are stored in "[filename]-[s].npy"
+    """
+    square = MonitoringSquare(Stim) if 'monitoring_square' in Stim.screen else None
+
+    FRAMES = [[] for s in range(Stim.screen['nScreens'])]
+    for t, index, tstart, tstop in zip(T, INDICES, TSTART, TSTOP):
+        for s, frame in enumerate(render_frames(Stim, t, index, tstart, tstop,
+                                                square=square,
+                                                cache=cache)):
+            FRAMES[s].append(frame)
+
+    for s in range(Stim.screen['nScreens']):
+        np.save('%s-%i.npy' % (filename, s), np.array(FRAMES[s]))
+
+    return filename
+
+
+# the stimulus and the cache of static frames of the worker processes
+#       (sent once per worker, kept between the chunks)
+WORKER = {}
+
+def init_worker(Stim):
+    WORKER['Stim'], WORKER['cache'] = Stim, FrameCache()
+
+def render_chunk_worker(args):
+    return render_chunk(WORKER['Stim'], *args, cache=WORKER['cache'])
+
+
+def build_movie(Stim, protocol_folder,
+                Format='mp4',
+                nproc=1,
+                chunk_duration=10.,
+                verbose=False):
+    """
+    builds the movie file(s) of the protocol
+
+    the frames are rendered by chunks of "chunk_duration" seconds, 
+        in parallel if nproc>1 (the chunks are then concatenated in order)
+    """
+    tic = time.time()
+
+    # prepare video file
+    out = []
+    for s in range(Stim.screen['nScreens']):
+
+        if s==0 and Stim.screen['nScreens']==1:
+            filename = os.path.join(protocol_folder, 
+                                    'movie.%s' % Format)
+        else:
+            filename = os.path.join(protocol_folder, 
+                                    'movie-%i.%s' % (s+1, Format))
+        print("""
+            Screen %i, %s""" % (s+1, filename))
+        
+        out.append(cv.VideoWriter(filename,
+                        cv.VideoWriter_fourcc(*'mp4v'), 
+                        Stim.movie_refresh_freq,
+                        Stim.screen['resolution'],
+                        False))
+    print()
+
+    T, INDICES, TSTART, TSTOP = movie_timeline(Stim)
+    nChunk = max([1, int(chunk_duration*Stim.movie_refresh_freq)])
+    CHUNKS = [(T[i:i+nChunk], INDICES[i:i+nChunk],
+               TSTART[i:i+nChunk], TSTOP[i:i+nChunk],
+               os.path.join(protocol_folder, 'chunk-%i' % i))\
+                    for i in range(0, len(T), nChunk)]
+
+    def write_chunk(i, filename):
+        for s, o in enumerate(out):
+            for frame in np.load('%s-%i.npy' % (filename, s), mmap_mode='r'):
+                o.write(np.array(frame))
+            os.remove('%s-%i.npy' % (filename, s))
+        print_chunk(i)
+
+    def print_chunk(i):
+        episodes = np.unique(CHUNKS[i][1][CHUNKS[i][1]>=0])
+        print(' - frames %i-%i/%i %s' % (i*nChunk+1, 
+                                        min([(i+1)*nChunk, len(T)]), len(T),
+                        '(episodes %i-%i/%i)' % (episodes[0]+1, episodes[-1]+1,
+                                                 len(Stim.experiment['index']))\
+                                if len(episodes)>0 else ''))
+        if verbose:
+            for index in episodes:
+                for k in Stim.experiment:
+                    print(18*' '+'- %s:%s ' % (k, Stim.experiment[k][index]))
+
+    if (nproc>1) and (len(CHUNKS)>1):
+        # "spawn" for clean worker processes (video and GUI libraries)
+        with ProcessPoolExecutor(max_workers=min([nproc, len(CHUNKS)]),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(Stim,)) as pool:
+            # at most 2 chunks per worker waiting on disk (raw frames are large)
+            FUTURES = collections.deque()
+            for i, chunk in enumerate(CHUNKS):
+                FUTURES.append(pool.submit(render_chunk_worker, chunk))
+                if len(FUTURES)>=2*nproc:
+                    write_chunk(i-len(FUTURES)+1, FUTURES.popleft().result())
+            while len(FUTURES)>0:
+                write_chunk(len(CHUNKS)-len(FUTURES), FUTURES.popleft().result())
+    else:
+        # frames directly written to the video files
+        square = MonitoringSquare(Stim) if 'monitoring_square' in Stim.screen else None
+        cache = FrameCache()
+        for i, chunk in enumerate(CHUNKS):
+            for t, index, tstart, tstop in zip(*chunk[:4]):
+                for o, frame in zip(out, render_frames(Stim, t, index, tstart, tstop,
+                                                       square=square,
+                                                       cache=cache)):
+                    o.write(frame)
+            print_chunk(i)
+
+    for o in out:
+        o.release()
+
+    print('\n [ok] movie of %i frames built in %.1fs' % (len(T), time.time()-tic))
+
 
 if __name__=='__main__':
 
@@ -133,8 +377,18 @@ if __name__=='__main__':
                         action="store_true")
     parser.add_argument('-v', "--verbose", 
                         action="store_true")
+    parser.add_argument("--nproc", 
+                        help="number of processes rendering the movie chunks", 
+                        type=int, 
+                        default=max([1, multiprocessing.cpu_count()-1]))
+    parser.add_argument("--chunk_duration", 
+                        help="duration (in s) of the movie chunks", 
+                        type=float, default=10.)
     args = parser.parse_args()
 
+    # functions from the package module (for the worker processes)
+    from physion.visual_stim.build import build_stim, build_movie
+
     if os.path.isfile(args.protocol) and args.protocol.endswith('.json'):
             
             # create the associated protocol folder in the movies folder
@@ -166,85 +420,12 @@ if __name__=='__main__':
             with open(os.path.join(protocol_folder, 'protocol.json'), 'w') as f:
                 json.dump(Stim.protocol, f, indent=4)
 
-            def update(Stim, index):
-                if index<len(Stim.experiment['index']):
-                    print(' - episode %i/%i ' % (\
-                            index+1, len(Stim.experiment['index'])),
-                          '   duration: ', 
-                        #   Stim.experiment['time_duration'][index],
-                        #   '   contrast: ', 
-                        #   Stim.experiment['contrast'][index],
-                        #   '   protocol-id : ', 
-                          Stim.experiment['protocol_id'][index])
-                    if 'verbose' in protocol:
-                        for k in Stim.experiment:
-                            print(18*' '+'- %s:%.1f ' %\
-                                    (k, Stim.experiment[k][index]))
-                    tstart = Stim.experiment['time_start'][index]
-                    tstop= Stim.experiment['time_stop'][index]
-                    return tstart, tstop
-                else:
-                    return np.inf, np.inf
-
-            # prepare the monitoring square properties
-            if 'monitoring_square' in Stim.screen:
-                square = MonitoringSquare(Stim)
-
-            # prepare video file
             Format = 'mp4' if (('linux' in sys.platform) or args.mp4) else 'wmv'
-            out = []
-            for s in range(Stim.screen['nScreens']):
-
-                if s==0 and Stim.screen['nScreens']==1:
-                    filename = os.path.join(protocol_folder, 
-                                            'movie.%s' % Format)
-                else:
-                    filename = os.path.join(protocol_folder, 
-                                            'movie-%i.%s' % (s+1, Format))
-                print("""
-                    Screen %i, %s""" % (s+1, filename))
-                
-                out.append(cv.VideoWriter(filename,
-                                cv.VideoWriter_fourcc(*'mp4v'), 
-                                Stim.movie_refresh_freq,
-                                Stim.screen['resolution'],
-                                False))
-            print()
-            # prepare the loop
-            t, tend = 0, Stim.experiment['time_stop'][-1]+\
-                    Stim.experiment['interstim'][-1]
-            index = 0
-            tstart, tstop = update(Stim, index)
-
-            # LOOP over time to build the movie
-            while t<tend:
-
-                if t>=tstop:
-                    index += 1
-                    tstart, tstop = update(Stim, index)
-                    
-                # data in [0,1]
-                if (t>=tstart) and (t<tstop):
-                    data = Stim.gamma_correction(\
-                            Stim.get_image(index, t-tstart))
-                else:
-                    data = Stim.blank_color+\
-                                Stim.get_null_image()
-
-                # put the monitoring square
-                if 'monitoring_square' in Stim.screen:
-                    data = square.draw(data, t, tstart, tstop)
-
-                for s, o in enumerate(out):
-                    dataS = Stim.restrict_to_screen(data, 
-                                                    screen_id=s+1)
-                    o.write(np.array(255*np.rot90(dataS, k=1),
-                                    dtype='uint8'))
-
-                t+= 1./Stim.movie_refresh_freq
-
-            for o in out:
-                o.release()
+            build_movie(Stim, protocol_folder,
+                        Format=Format,
+                        nproc=args.nproc,
+                        chunk_duration=args.chunk_duration,
+                        verbose=('verbose' in protocol))
 
             np.save(os.path.join(protocol_folder, 'visual-stim.npy'), 
                     Stim.experiment)
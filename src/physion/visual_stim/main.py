@@ -6,6 +6,7 @@ color in grayscale in range [0,1]
 
 import numpy as np
 import itertools
+import collections
 import os
 import pathlib
 import time
@@ -27,6 +28,9 @@ defaults = {\
     'units':'cm',
 }
 
+# memory budget of the geometry cache of a stimulus (see "cached_geometry")
+GEOMETRY_CACHE_BYTES = 256e6
+
 class visual_stim:
     """
     """
@@ -111,13 +115,106 @@ class visual_stim:
             geometry.set_angle_meshgrid_U3Screens(self, 
                                     force_degree=force_degree)
 
+        self.reset_geometry_cache()
+
+    def reset_geometry_cache(self):
+        """
+        the cached geometry depends on the (x,z) meshgrid
+            -> to be called when it changes
+        """
+        self.geometry_cache = collections.OrderedDict()
+        # extent of each row (in x) and each column (in z) of the meshgrid
+        self.x_rows = (self.x.min(axis=1), self.x.max(axis=1))
+        self.z_columns = (self.z.min(axis=0), self.z.max(axis=0))
+
+    def cached_geometry(self, key, func):
+        """
+        returns the value of func() stored under "key"
+
+        least-recently-used eviction above GEOMETRY_CACHE_BYTES,
+            cached arrays are read-only (they are shared between frames)
+        """
+        if key in self.geometry_cache:
+            self.geometry_cache.move_to_end(key)
+            return self.geometry_cache[key]
+
+        value = func()
+        for v in (value if isinstance(value, tuple) else [value]):
+            if isinstance(v, np.ndarray):
+                v.setflags(write=False)
+        self.geometry_cache[key] = value
+
+        def nbytes(value):
+            return np.sum([getattr(v, 'nbytes', 0) for v in\
+                    (value if isinstance(value, tuple) else [value])])
+        while (len(self.geometry_cache)>1) and\
+            (np.sum([nbytes(v) for v in self.geometry_cache.values()])>GEOMETRY_CACHE_BYTES):
+            self.geometry_cache.popitem(last=False)
+
+        return value
+
+    def bounding_box(self, xlim, zlim):
+        """
+        slices of the meshgrid containing all the points 
+            with x in ]xlim[0],xlim[1][ and z in ]zlim[0],zlim[1][  
+
+        (None if there is no such point)
+        """
+        margin = 1e-6 # for the rounding errors of the conditions on the points
+        rows = np.flatnonzero((self.x_rows[1]>(xlim[0]-margin)) &\
+                                    (self.x_rows[0]<(xlim[1]+margin)))
+        columns = np.flatnonzero((self.z_columns[1]>(zlim[0]-margin)) &\
+                                    (self.z_columns[0]<(zlim[1]+margin)))
+        if (len(rows)==0) or (len(columns)==0):
+            return None
+        return (slice(rows[0], rows[-1]+1), slice(columns[0], columns[-1]+1))
+
+    def disk(self, xcenter, zcenter, radius):
+        """
+        (box, mask) of the points at a distance < radius from the center
+            box: slices of the bounding box, mask: condition within the box
+                            (Ellipsis if all the points of the box)
+        (cached, None if no point)
+        """
+        def compute():
+            box = self.bounding_box((xcenter-radius, xcenter+radius),
+                                    (zcenter-radius, zcenter+radius))
+            if box is None:
+                return None
+            x, z = self.x[box], self.z[box]
+            cond = ((x-xcenter)**2+(z-zcenter)**2)<radius**2
+            return box, (Ellipsis if np.all(cond) else cond)
 
+        return self.cached_geometry(('disk', xcenter, zcenter, radius), compute)
 
     # some general grating functions
     def compute_rotated_coords(self, angle,
                                xcenter=0, zcenter=0):
-        return (self.x-xcenter)*np.cos(angle/180.*np.pi)+\
-                    (self.z-zcenter)*np.sin(angle/180.*np.pi)
+        """ (cached, read-only) """
+        return self.cached_geometry(('rotated-coords', angle, xcenter, zcenter),
+                    lambda: (self.x-xcenter)*np.cos(angle/180.*np.pi)+\
+                                (self.z-zcenter)*np.sin(angle/180.*np.pi))
+
+    def grating_planes(self, angle, xcenter, zcenter, radius,
+                       spatial_freq, phase_shift_Deg):
+        """
+        cosine and sine of the grating phase at the points of the disk
+            -> the grating at any time phase is then:
+            0.5+(C*cos(2*pi*time_phase)+S*sin(2*pi*time_phase))/2.
+        (cached, None if no point in the disk)
+        """
+        def compute():
+            disk = self.disk(xcenter, zcenter, radius)
+            if disk is None:
+                return None
+            box, cond = disk
+            phase = phase_shift_Deg*np.pi/180.+\
+                2*np.pi*spatial_freq*self.compute_rotated_coords(angle,
+                                    xcenter=xcenter, zcenter=zcenter)[box][cond]
+            return np.cos(phase), np.sin(phase)
+
+        return self.cached_geometry(('grating', angle, xcenter, zcenter, radius,
+                                     spatial_freq, phase_shift_Deg), compute)
 
 
     def compute_grating(self, xrot,
@@ -143,17 +240,28 @@ class visual_stim:
                           xcenter=0,
                           zcenter=0):
         """ add a grating patch, drifting when varying the time phase"""
+        if screen_id is None:
+            # precomputed planes, restricted to the bounding box of the patch
+            planes = self.grating_planes(angle, xcenter, zcenter, radius,
+                                         spatial_freq, phase_shift_Deg)
+            if planes is not None:
+                box, cond = self.disk(xcenter, zcenter, radius)
+                if time_phase==0:
+                    image[box][cond] += contrast*planes[0]/2.
+                else:
+                    image[box][cond] += contrast*(\
+                            planes[0]*np.cos(2*np.pi*time_phase)+\
+                            planes[1]*np.sin(2*np.pi*time_phase))/2.
+            return
+
         xrot = self.compute_rotated_coords(angle,
                                            xcenter=xcenter,
                                            zcenter=zcenter)
 
-        if screen_id is not None:
-            cond0 = (self.screen_ids==screen_id)
-            x= self.x[cond0].reshape(self.screen['resolution'])
-            z= self.z[cond0].reshape(self.screen['resolution'])
-            xrot = xrot[cond0].reshape(self.screen['resolution'])
-        else:
-            x, z = self.x, self.z
+        cond0 = (self.screen_ids==screen_id)
+        x= self.x[cond0].reshape(self.screen['resolution'])
+        z= self.z[cond0].reshape(self.screen['resolution'])
+        xrot = xrot[cond0].reshape(self.screen['resolution'])
 
         cond = ((x-xcenter)**2+(z-zcenter)**2)<radius**2
 
@@ -180,13 +288,25 @@ class visual_stim:
     def add_dot(self, image, pos, size, color, type='square'):
         """
         add dot, either square or circle
+
+        (the condition is only evaluated in the bounding box of the dot)
         """
         if type=='square':
-            cond = (self.x>(pos[0]-size/2)) & (self.x<(pos[0]+size/2)) &\
-                    (self.z>(pos[1]-size/2)) & (self.z<(pos[1]+size/2))
+            box = self.bounding_box((pos[0]-size/2, pos[0]+size/2),
+                                    (pos[1]-size/2, pos[1]+size/2))
         else:
-            cond = np.sqrt((self.x-pos[0])**2+(self.z-pos[1])**2)<size
-        image[cond] = color
+            box = self.bounding_box((pos[0]-size, pos[0]+size),
+                                    (pos[1]-size, pos[1]+size))
+        if box is None:
+            return
+        x, z = self.x[box], self.z[box]
+
+        if type=='square':
+            cond = (x>(pos[0]-size/2)) & (x<(pos[0]+size/2)) &\
+                    (z>(pos[1]-size/2)) & (z<(pos[1]+size/2))
+        else:
+            cond = np.sqrt((x-pos[0])**2+(z-pos[1])**2)<size
+        image[box][cond] = color
 
     def blank_surround(self, image,
                       radius=10,
@@ -195,9 +315,14 @@ class visual_stim:
                             bg_color=0.5):
         """ blank surround """
 
-        cond = ((self.x-xcenter)**2+(self.z-zcenter)**2)<radius**2
-
-        image[~cond] = bg_color
+        disk = self.disk(xcenter, zcenter, radius)
+        if disk is None:
+            image[:] = bg_color
+        else:
+            box, cond = disk
+            center = np.array(image[box][cond])
+            image[:] = bg_color
+            image[box][cond] = center
 
         return image
 
@@ -409,6 +534,24 @@ class visual_stim:
         return 0.5+\
             self.get_null_image()
 
+    def is_static(self, episode):
+        """
+        time-invariant episode (the image does not depend on the time)
+            -> a single frame is rendered for the movie (see build.py)
+        False by default, should be overriden by method in children class
+        """
+        return False
+
+    def episode_key(self, episode):
+        """
+        parameters of the episode (without its timing), 
+            identical keys have identical images 
+        """
+        return tuple((key, self.experiment[key][episode])\
+                    for key in sorted(self.experiment)\
+                        if key not in ['repeat', 'time_start', 'time_stop', 
+                                       'time_duration', 'interstim'])
+
     def get_prestim_image(self,
                           screen_id=None):
         if 'presentation-prestim-screen' in self.protocol:
@@ -706,6 +849,15 @@ class multiprotocol(visual_stim):
         return getattr(self.STIM[self.experiment['protocol_id'][index]],
                        'get_frames_sequence')(self.experiment['index'][index])
 
+    def is_static(self, index):
+        return getattr(self.STIM[self.experiment['protocol_id'][index]],
+                       'is_static')(self.experiment['index'][index])
+
+    def episode_key(self, index):
+        return (self.experiment['protocol_id'][index],
+                getattr(self.STIM[self.experiment['protocol_id'][index]],
+                       'episode_key')(self.experiment['index'][index]))
+
     def plot_stim_picture(self, index, 
                           ax=None, label=None, vse=False):
         return getattr(self.STIM[self.experiment['protocol_id'][index]],
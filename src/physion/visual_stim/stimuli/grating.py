@@ -84,6 +84,12 @@ class stim(visual_stim):
 
         return img
 
+    def is_static(self, episode):
+        """ no drifting grating """
+        return (self.experiment['speed'][episode]==0) and\
+                ((self.experiment['radius-surround'][episode]<=0) or\
+                    (self.experiment['speed-surround'][episode]==0))
+
 """
     def plot_stim_picture(self, episode,
                           ax=None, parent=None, label=None, vse=False,
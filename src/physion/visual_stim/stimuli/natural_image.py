@@ -59,6 +59,9 @@ class stim(visual_stim):
                           xcenter=self.experiment['x-center'][index],
                           zcenter=self.experiment['y-center'][index],
                           radius = self.experiment['radius'][index])
+
+    def is_static(self, index):
+        return True
     
 """
     def plot_stim_picture(self, episode, parent=None, 
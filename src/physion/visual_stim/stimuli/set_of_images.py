@@ -53,6 +53,9 @@ class stim(visual_stim):
                 self.images[int(self.experiment['Image-ID'][index])-1]))[:,:,0]/255*1.0
         return im.T
 
+    def is_static(self, index):
+        return True
+
 """
     def plot_stim_picture(self, episode, parent=None, 
                           vse=True, ax=None, label=None,
@@ -99,6 +99,9 @@ class stim(visual_stim):
 
         return img
 
+    def is_static(self, index):
+        return True
+
     def reverse_correlation_analysis(self, 
                                      weight_array):
 
@@ -28,6 +28,9 @@ class stim(visual_stim):
         """
         return init_bg_image(self, index)
 
+    def is_static(self, index):
+        return True
+
 
 if __name__=='__main__':
 
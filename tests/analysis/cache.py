@@ -0,0 +1,137 @@
+"""
+test of the memoization of the dFoF (analysis.cache)
+
+    a synthetic NWB file (suite2p output of random ROIs) is written, then:
+        - a cache hit returns the same dFoF than the computation,
+            in writable arrays not shared between the Data objects
+        - rawFluo and neuropil are not stored in the cache
+        - a modified file (or "invalidate_cache") forces the recomputation
+        - the least-recently-used entries are evicted above "max_bytes"
+
+usage:
+    python tests/analysis/cache.py --nROIs 50 --nFrames 3000
+"""
+import argparse, time, sys, os, pathlib, tempfile, datetime
+import numpy as np
+import pynwb
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.analysis.read_NWB import Data
+from physion.analysis.cache import CACHE, ProcessingCache
+from physion.imaging.suite2p.to_nwb import add_ophys_processing_from_suite2p
+
+
+def write_nwb(filename, nROIs, nFrames,
+              fs=30.,
+              stimulus={}):
+    """
+    NWB file with the ophys processing of a synthetic suite2p folder
+
+    stimulus: {key:array} of the episodes (e.g. time_start, time_stop, ...)
+    """
+    folder = os.path.join(tempfile.mkdtemp(), 'suite2p')
+    os.makedirs(os.path.join(folder, 'plane0'))
+    Ly, Lx = 64, 64
+    np.save(os.path.join(folder, 'plane0', 'ops.npy'),
+            {'fs':fs, 'nplanes':1, 'nchannels':1, 'Ly':Ly, 'Lx':Lx,
+             'meanImg':np.zeros((Ly, Lx), np.float32)})
+    t = np.arange(nFrames)/fs
+    F = 100+20*np.random.rand(nROIs, 1)*(1+np.sin(2*np.pi*t/10.))+\
+            5*np.random.randn(nROIs, nFrames)
+    np.save(os.path.join(folder, 'plane0', 'F.npy'), F.astype(np.float32))
+    np.save(os.path.join(folder, 'plane0', 'Fneu.npy'),
+            (0.3*F+5*np.random.randn(nROIs, nFrames)).astype(np.float32))
+    np.save(os.path.join(folder, 'plane0', 'iscell.npy'), np.ones((nROIs, 2)))
+    np.save(os.path.join(folder, 'plane0', 'stat.npy'),
+            np.array([{'ypix':np.array([i%Ly]), 'xpix':np.array([i//Ly]),
+                       'lam':np.array([1.])} for i in range(nROIs)]))
+
+    nwbfile = pynwb.NWBFile(session_description="{'protocol':'None'}",
+                            identifier='cache-test',
+                            session_start_time=datetime.datetime.now(datetime.timezone.utc),
+                            experiment_description='None',
+                            subject=pynwb.file.Subject(subject_id='mouse'))
+    device = nwbfile.create_device(name='Microscope')
+    optical_channel = pynwb.ophys.OpticalChannel(name='OpticalChannel',
+                                                 description='', emission_lambda=500.)
+    imaging_plane = nwbfile.create_imaging_plane(name='ImagingPlane',
+                optical_channel=optical_channel, imaging_rate=fs, description='',
+                device=device, excitation_lambda=920., indicator='GCaMP',
+                location='V1')
+    image_series = pynwb.ophys.TwoPhotonSeries(name='CaImaging-TimeSeries',
+                dimension=[2], data=np.ones((2,2,2)), imaging_plane=imaging_plane,
+                unit='s', timestamps=1.*np.arange(2),
+                comments='raw-data-folder=%s' % folder.replace('/', '**'))
+    nwbfile.add_acquisition(image_series)
+    for key in stimulus:
+        nwbfile.add_stimulus(pynwb.TimeSeries(name=key, unit='seconds',
+                    data=np.reshape(stimulus[key], (len(stimulus[key]), 1)),
+                    timestamps=np.array(stimulus['time_start'], dtype=float)))
+    add_ophys_processing_from_suite2p(folder, nwbfile,
+                                      {'channels':['Ch1'], 'Ch1':{'relativeTime':t}},
+                                      TwoP_trigger_delay=1e-3,
+                                      device=device, optical_channel=optical_channel,
+                                      imaging_plane=imaging_plane, image_series=image_series)
+    with pynwb.NWBHDF5IO(filename, 'w') as io:
+        io.write(nwbfile)
+
+
+def build_dFoF(filename, **kwargs):
+    """ (time, Data object) """
+    data = Data(filename)
+    tic = time.time()
+    data.build_dFoF(verbose=False, **kwargs)
+    return time.time()-tic, data
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nROIs", type=int, default=50)
+    parser.add_argument("--nFrames", type=int, default=3000)
+    args = parser.parse_args()
+
+    filename = os.path.join(tempfile.mkdtemp(), 'session.nwb')
+    write_nwb(filename, args.nROIs, args.nFrames)
+
+    # 1) opt-in
+    t0, data0 = build_dFoF(filename)
+    print(' - without cache: %.2fs, cache entries: %i' % (t0, len(CACHE.entries)))
+
+    # 2) cache hit
+    t1, data1 = build_dFoF(filename, use_cache=True)
+    t2, data2 = build_dFoF(filename, use_cache=True)
+    print(' - first call: %.2fs, cache hit: %.2fs, identical dFoF: %s' % (t1, t2,
+            np.array_equal(data0.dFoF, data1.dFoF) and np.array_equal(data1.dFoF, data2.dFoF)))
+    print('   writable: %s, shared between Data objects: %s, same rawFluo: %s' % (
+            data2.dFoF.flags.writeable,
+            np.shares_memory(data1.dFoF, data2.dFoF) or\
+                    np.shares_memory(data2.dFoF, list(CACHE.entries.values())[-1]['dFoF']),
+            np.array_equal(np.asarray(data0.rawFluo), np.asarray(data2.rawFluo))))
+    data2.dFoF[:] = 0
+    _, data3 = build_dFoF(filename, use_cache=True)
+    print('   in-place change not in the cache: %s, cached keys: %s' % (
+            np.array_equal(data3.dFoF, data0.dFoF),
+            sorted(list(CACHE.entries.values())[-1].keys())))
+
+    # 3) invalidation
+    _, data = build_dFoF(filename, use_cache=True, percentile=20.)
+    n = len(CACHE.entries)
+    data.invalidate_cache()
+    print(' - new parameter -> new entry: %s, invalidated: %i -> %i entries' % (
+            n==2, n, len(CACHE.entries)))
+    build_dFoF(filename, use_cache=True)
+    key = data1.dFoF_cache_key
+    os.utime(filename, ns=(time.time_ns(), time.time_ns()+int(1e9)))
+    _, data = build_dFoF(filename, use_cache=True)
+    print(' - modified file -> new key: %s' % (data.dFoF_cache_key!=key))
+
+    # 4) eviction
+    cache = ProcessingCache(max_bytes=2.5*data0.dFoF.nbytes)
+    for i in range(5):
+        cache.set(cache.key(filename, 'dFoF', {'i':i}), {'dFoF':data0.dFoF})
+    print(' - eviction: n=%i entries left (max. 2), last ones kept: %s' % (
+            len(cache.entries),
+            (cache.get(cache.key(filename, 'dFoF', {'i':4})) is not None) and\
+              (cache.get(cache.key(filename, 'dFoF', {'i':0})) is None)))
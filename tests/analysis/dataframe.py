@@ -0,0 +1,107 @@
+"""
+regression test & benchmark of "NWB_to_dataframe"
+
+    a synthetic "read_NWB.Data" object (dFoF, running speed, two protocols)
+    is converted with the columnar layout (one allocation per data type)
+    and with the former insertion of one column at a time:
+        - the float64 outputs should be identical
+        - the construction time and the peak memory (tracemalloc) are compared
+            for the float64, float32 and view (zero-copy dFoF) layouts
+
+usage:
+    python tests/analysis/dataframe.py --nROIs 100 1000 5000 --nTime 20000
+"""
+import argparse, time, sys, os, pathlib, tracemalloc
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.analysis import read_NWB
+from physion.analysis.dataframe import NWB_to_dataframe
+
+
+def synthetic_data(nROIs, nTime,
+                   imaging_freq=30.,
+                   nEpisodes=50):
+    """ the attributes of "read_NWB.Data" used by "NWB_to_dataframe" """
+    data = read_NWB.Data.__new__(read_NWB.Data)
+    data.filename = 'synthetic.nwb'
+    t = np.arange(nTime)/imaging_freq
+    data.dFoF = np.random.randn(nROIs, nTime)
+    data.dFoF[0,:] = 1. # a constant ROI (std=0)
+    data.nROIs = nROIs
+    data.Fluorescence = SimpleNamespace(timestamps=t)
+    running_speed = np.abs(np.random.randn(nTime))
+    data.build_running_speed = lambda specific_time_sampling=None,\
+                                      verbose=False: running_speed
+
+    tstarts = np.linspace(1, t[-1]-5, nEpisodes)
+    def quantity(x):
+        return SimpleNamespace(data=np.array(x), num_samples=len(x))
+    data.nwbfile = SimpleNamespace(processing={'ophys':None},
+                                   acquisition={'Running-Speed':None},
+                                   stimulus={\
+            'time_start':quantity(tstarts),
+            'time_start_realigned':quantity(tstarts),
+            'time_stop_realigned':quantity(tstarts+2),
+            'time_duration':quantity(2+0*tstarts),
+            'protocol_id':quantity((np.arange(nEpisodes)%2)[:,np.newaxis])})
+    data.protocols = ['drifting-gratings', 'noise']
+    return data
+
+
+def run(data, **kwargs):
+    """ (time, peak memory in MB, dataframe) """
+    tracemalloc.start()
+    tic = time.time()
+    dataframe = NWB_to_dataframe(data,
+                                 visual_stim_features='per-protocol',
+                                 add_shifted_behavior_features=True,
+                                 behavior_shifting_range=[-0.1, 0.1],
+                                 verbose=False, **kwargs)
+    t = time.time()-tic
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    return t, peak, dataframe
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nROIs", type=int, nargs='*', default=[100, 1000, 5000])
+    parser.add_argument("--nTime", type=int, default=20000)
+    args = parser.parse_args()
+
+    for nROIs in args.nROIs:
+
+        data = synthetic_data(nROIs, args.nTime)
+        print(' - %i ROIs x %i time points (dFoF: %.0fMB)' % (nROIs, args.nTime,
+                                                            data.dFoF.nbytes/1e6))
+
+        t, peak, former = run(data, columnar=False)
+        print('    former insertion: %.2fs, peak memory: %.0fMB' % (t, peak))
+        MEAN = [getattr(data, 'dFoF_ROI%i_mean' % i) for i in range(nROIs)]
+
+        t, peak, dataframe = run(data)
+        print('    columnar float64: %.2fs, peak memory: %.0fMB' % (t, peak))
+        print('       identical: %s (columns: %s, dtypes: %s, metadata: %s, ROI means: %s)' % (
+                former.equals(dataframe),
+                list(former.columns)==list(dataframe.columns),
+                np.all(former.dtypes==dataframe.dtypes),
+                (former.dt, former.filename, former.nROIs, former.running_speed_std)==\
+                  (dataframe.dt, dataframe.filename, dataframe.nROIs, dataframe.running_speed_std),
+                np.array_equal(MEAN, [getattr(data, 'dFoF_ROI%i_mean' % i)\
+                                        for i in range(nROIs)])))
+        del former
+
+        t, peak, dataframe = run(data, dtype=np.float32)
+        print('    columnar float32: %.2fs, peak memory: %.0fMB, max. error: %.1e' % (t,
+                peak, np.max(np.abs(dataframe['dFoF-ROI1']-\
+                    (data.dFoF[1]-data.dFoF_ROI1_mean)/data.dFoF_ROI1_std))))
+
+        t, peak, dataframe = run(data, view=True)
+        print('    columnar view   : %.2fs, peak memory: %.0fMB, shares memory with dFoF: %s' % (
+                t, peak, np.shares_memory(dataframe['dFoF-ROI%i' % (nROIs-1)].values,
+                                          data.dFoF)))
+        del dataframe, data
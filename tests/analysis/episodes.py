@@ -0,0 +1,54 @@
+"""
+regression test & benchmark of the episode interpolation
+
+    compares the vectorized "interpolate_episode" (used by EpisodeData)
+    to the former loop over ROIs with one interp1d per ROI
+
+usage:
+    python tests/analysis/episodes.py --nROIs 1000 --nEpisodes 50
+"""
+import argparse, time, sys, os, pathlib
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.analysis.process_NWB import episode_window,\
+        interpolate_episode, interpolate_episode_loop
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--nROIs", type=int, default=200)
+parser.add_argument("--nEpisodes", type=int, default=50)
+parser.add_argument("--dt_sampling", help="in ms", type=float, default=1)
+parser.add_argument("--imaging_freq", help="in Hz", type=float, default=30)
+args = parser.parse_args()
+
+# synthetic imaging data, with jittered frame times
+Tstim, Tinter, prestim = 2., 3., 1.5
+Ttot = args.nEpisodes*(Tstim+Tinter)+10
+tfull = np.arange(int(Ttot*args.imaging_freq))/args.imaging_freq
+tfull += 1e-3*np.random.randn(len(tfull))
+tfull = np.sort(tfull)
+dFoF = np.random.randn(args.nROIs, len(tfull)).astype(np.float32)
+running = np.random.randn(len(tfull))
+
+tstarts = 5+np.arange(args.nEpisodes)*(Tstim+Tinter)
+dt = args.dt_sampling*1e-3
+t = np.arange(-int(prestim/dt)+2, int(Tstim/dt)+int(prestim/dt))*dt
+
+RESULTS = {}
+for label, func in zip(['loop', 'vectorized'],
+                       [interpolate_episode_loop, interpolate_episode]):
+    tic = time.time()
+    RESULTS[label] = {'dFoF':np.zeros((args.nEpisodes, args.nROIs, len(t))),
+                      'running':np.zeros((args.nEpisodes, len(t)))}
+    for i, tstart in enumerate(tstarts):
+        window = episode_window(tfull, tstart, tstart+Tstim, prestim)
+        RESULTS[label]['dFoF'][i] = func(tfull[window]-tstart, dFoF[:,window], t,
+                                         bounds_error=False)
+        RESULTS[label]['running'][i] = func(tfull[window]-tstart, running[window], t)
+    print(' - %s: %.2fs' % (label, time.time()-tic))
+
+for key in ['dFoF', 'running']:
+    print(' %s [%s] identical: %s ' % (key,
+                   'x'.join([str(s) for s in RESULTS['loop'][key].shape]),
+            np.array_equal(RESULTS['loop'][key], RESULTS['vectorized'][key])))
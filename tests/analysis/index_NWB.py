@@ -0,0 +1,106 @@
+"""
+test of the persistent metadata index of the NWB files (analysis.index_NWB)
+
+    synthetic NWB files (metadata only, single and multi-protocols, plus an
+    unreadable file) are scanned with and without the index:
+        - same sessions with the index as with "scan_NWBfiles" (with and
+            without "for_protocols", with "Nmax")
+        - only the modified files are re-read when updating the index
+        - removed files are dropped from the index
+        - files that fail to read are excluded
+
+usage:
+    python tests/analysis/index_NWB.py --nFiles 12
+"""
+import argparse, sys, os, pathlib, tempfile, datetime, time
+import numpy as np
+import pynwb
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.analysis.read_NWB import scan_folder_for_NWBfiles
+from physion.analysis.index_NWB import update_index, query_index
+
+
+def write_nwb(filename, metadata, subject='mouse', age='P60D'):
+    """ NWB file with the session metadata (and a running speed) """
+    nwbfile = pynwb.NWBFile(session_description=str(metadata),
+                            identifier=os.path.basename(filename),
+                            session_start_time=datetime.datetime.now(datetime.timezone.utc),
+                            experiment_description=metadata['protocol'],
+                            subject=pynwb.file.Subject(subject_id=subject, age=age))
+    nwbfile.add_acquisition(pynwb.TimeSeries(name='Running-Speed', data=np.zeros((10, 1)),
+                                             unit='cm/s', starting_time=0., rate=10.))
+    with pynwb.NWBHDF5IO(filename, 'w') as io:
+        io.write(nwbfile)
+
+
+def scan(folder, **kwargs):
+    return scan_folder_for_NWBfiles(folder, verbose=False, nproc=1, **kwargs)
+
+
+def same(d1, d2):
+    """ same sessions (and same metadata) in the two scans """
+    return (list(d1['files'])==list(d2['files'])) and\
+        np.all([list(d1[k])==list(d2[k]) for k in ['dates', 'subjects', 'ages']]) and\
+        np.all([[str(p) for p in P1]==[str(p) for p in P2]\
+                    for P1, P2 in zip(d1['protocols'], d2['protocols'])]) and\
+        np.all([list(P1)==list(P2)\
+                    for P1, P2 in zip(d1['protocol_ids'], d2['protocol_ids'])])
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFiles", type=int, default=12)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    PROTOCOLS = ['drifting-gratings', 'moving-dots', 'looming-stim']
+    for i in range(args.nFiles):
+        day = os.path.join(folder, '2024_01_%02i' % (1+i%3))
+        os.makedirs(day, exist_ok=True)
+        filename = os.path.join(day, '2024_01_%02i-12-%02i-00.nwb' % (1+i%3, i))
+        if i%3==0:
+            metadata = {'protocol':'multiprotocol', 'Presentation':'multiprotocol',
+                        'Protocol-1':'protocols/%s.json' % PROTOCOLS[i%2],
+                        'Protocol-2':'protocols/%s.json' % PROTOCOLS[2]}
+        else:
+            metadata = {'protocol':PROTOCOLS[i%3]}
+        write_nwb(filename, metadata, subject='mouse-%i' % (i%4), age='P%iD' % (50+i))
+    with open(os.path.join(folder, '2024_01_01', '2024_01_01-99-00-00.nwb'), 'w') as f:
+        f.write('not an NWB file')
+    write_nwb(os.path.join(folder, 'up-1.nwb'), {'protocol':'None'}) # intrinsic imaging
+
+    # 1) same sessions than the serial scan
+    for kwargs in [{}, {'for_protocols':['looming-stim']},
+                   {'for_protocols':['moving-dots', 'drifting-gratings']},
+                   {'Nmax':5}, {'Nmax':5, 'for_protocols':['moving-dots']}]:
+        serial, indexed = scan(folder, **kwargs), scan(folder, use_index=True, **kwargs)
+        print(' - %s: n=%i sessions, identical: %s' % (kwargs, len(serial['files']),
+                                                       same(serial, indexed)))
+        assert same(serial, indexed)
+
+    # 2) unreadable file excluded (but indexed, with its error)
+    SESSIONS = query_index(folder)
+    print(' - unreadable file excluded: %s' % (\
+            not np.any(['99-00-00' in s['filename'] for s in SESSIONS])))
+    assert len(SESSIONS)==args.nFiles
+
+    # 3) only the modified files are re-read
+    n = update_index(folder, nproc=1, verbose=False)
+    filename = os.path.join(folder, '2024_01_02', '2024_01_02-12-01-00.nwb')
+    write_nwb(filename, {'protocol':'moving-dots'}, subject='new-mouse')
+    os.utime(filename, ns=(time.time_ns(), time.time_ns()+int(1e9)))
+    m = update_index(folder, nproc=1, verbose=False)
+    print(' - re-read files: n=%i without change, n=%i after a modification' % (n, m))
+    assert (n==0) and (m==1)
+    assert [s['subject'] for s in query_index(folder) if s['filename']==filename]==['new-mouse']
+
+    # 4) removed files dropped
+    os.remove(filename)
+    update_index(folder, nproc=1, verbose=False)
+    print(' - removed file dropped: %s' % (\
+            filename not in [s['filename'] for s in query_index(folder)]))
+    assert len(query_index(folder))==args.nFiles-1
+    assert same(scan(folder), scan(folder, use_index=True))
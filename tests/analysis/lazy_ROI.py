@@ -0,0 +1,120 @@
+"""
+regression test of the lazy reading of the ROI fluorescence (read_NWB.LazyROIArray)
+
+    1) indexing of LazyROIArray on HDF5 datasets (both orientations, chunked
+        or not, ROI subsets) compared to the same indexing of numpy arrays:
+        Ellipsis, negative indices and steps, unsorted/repeated ROI indices,
+        boolean masks, single elements and empty selections
+    2) synthetic NWB file read with Data(lazy=True) vs Data(lazy=False):
+        - rawFluo/neuropil slicing
+        - build_dFoF by blocks of ROIs (several block sizes)
+        - EpisodeData responses
+
+usage:
+    python tests/analysis/lazy_ROI.py --nROIs 60 --nFrames 3000
+"""
+import argparse, sys, os, pathlib, tempfile
+import numpy as np
+import h5py
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.analysis.read_NWB import Data, LazyROIArray
+from physion.analysis.process_NWB import EpisodeData
+
+from cache import write_nwb # synthetic NWB file of tests/analysis/cache.py
+
+
+def KEYS(nROIs, nFrames):
+    mask = np.arange(nROIs)%3==0
+    return [(slice(None),), Ellipsis, (Ellipsis, slice(10, 20)), (slice(None), Ellipsis),
+            3, -1, (-1, 5), (2, -3), (slice(2, 40, 3), 7),
+            ([5, 2, 2, 7], slice(None)), (np.array([3, 1]), slice(100, 10, -3)),
+            (slice(None, None, -1), [4, 2, 50]), (slice(-5, None), [7, 3, 3]),
+            (mask, slice(0, nFrames, 2)), (slice(None), np.arange(nFrames)%5==0),
+            (slice(5, 5), slice(None)), (slice(None), slice(10, 10)),
+            ([], slice(None)), (np.array([nROIs-1, 0]), -1)]
+
+
+def check_indexing(array, lazy):
+    """ same values, shapes and dtypes for all the KEYS """
+    for key in KEYS(*array.shape):
+        ref, value = array[key], lazy[key]
+        if not (np.array_equal(ref, value) and (np.shape(ref)==np.shape(value)) and\
+                    (np.asarray(ref).dtype==np.asarray(value).dtype)):
+            print('   [!!] different for key: %s' % str(key))
+            return False
+    return True
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nROIs", type=int, default=60)
+    parser.add_argument("--nFrames", type=int, default=3000)
+    args = parser.parse_args()
+
+    # 1) indexing
+    F = np.random.randn(args.nROIs, args.nFrames).astype(np.float32)
+    subset = np.array([7, 3, 3, 20, 11, 40, 41, 42])
+    with h5py.File(os.path.join(tempfile.mkdtemp(), 'test.h5'), 'w') as f:
+        for transposed in [False, True]:
+            for chunks in [None, (16, 16)]:
+                dataset = f.create_dataset('F-%s-%s' % (transposed, chunks),
+                                           data=(F.T if transposed else F), chunks=chunks)
+                lazy = LazyROIArray(dataset, transposed=transposed)
+                print(' - indexing (transposed=%s, chunks=%s): identical: %s, ROI subset: %s' % (
+                        transposed, chunks, check_indexing(F, lazy),
+                        check_indexing(F[subset], lazy.roi_subset(subset))))
+                assert check_indexing(F, lazy) and\
+                        check_indexing(F[subset], lazy.roi_subset(subset))
+                # (float32 sums -> summation order rounding)
+                assert np.allclose(lazy.mean(axis=1), F.mean(axis=1), atol=1e-5) and\
+                        np.allclose(lazy.sum(axis=0), F.sum(axis=0), atol=1e-4)
+
+    # 2) NWB file
+    nEpisodes = 20
+    tstarts = 5+np.arange(nEpisodes)*4.
+    filename = os.path.join(tempfile.mkdtemp(), 'session.nwb')
+    write_nwb(filename, args.nROIs, args.nFrames,
+              stimulus={'time_start':tstarts, 'time_stop':tstarts+2,
+                        'time_start_realigned':tstarts+0.01,
+                        'time_stop_realigned':tstarts+2.01,
+                        'time_duration':2+0*tstarts, 'interstim':2+0*tstarts,
+                        'angle':(np.arange(nEpisodes)%4)*90.})
+
+    data, lazy = Data(filename), Data(filename, lazy=True)
+    for key in ['rawFluo', 'neuropil']:
+        getattr(data, 'build_%s' % key)(verbose=False)
+        getattr(lazy, 'build_%s' % key)(verbose=False)
+        print(' - %s: lazy: %s, identical slicing: %s' % (key,
+                isinstance(getattr(lazy, key), LazyROIArray),
+                check_indexing(getattr(data, key), getattr(lazy, key))))
+        assert check_indexing(getattr(data, key), getattr(lazy, key))
+
+    for with_computed_neuropil_fact in [False, True]:
+        data.build_dFoF(with_computed_neuropil_fact=with_computed_neuropil_fact,
+                        verbose=False)
+        for nROIs_per_block in [1, 7, args.nROIs]:
+            # memory budget for "nROIs_per_block" ROIs (in float64)
+            LazyROIArray.memory_budget = 8*args.nFrames*nROIs_per_block
+            lazy.build_dFoF(with_computed_neuropil_fact=with_computed_neuropil_fact,
+                            verbose=False)
+            print(' - dFoF (computed neuropil factor: %s), blocks of %i ROIs: n=%i blocks, identical: %s' % (
+                    with_computed_neuropil_fact, nROIs_per_block,
+                    len(lazy.rawFluo.roi_blocks()),
+                    np.array_equal(data.dFoF, lazy.dFoF) and\
+                        np.array_equal(data.valid_roiIndices, lazy.valid_roiIndices)))
+            assert np.array_equal(data.dFoF, lazy.dFoF) and\
+                    np.array_equal(data.valid_roiIndices, lazy.valid_roiIndices)
+
+    QUANTITIES = ['dFoF', 'rawFluo', 'neuropil']
+    episodes = EpisodeData(data, protocol_id=0, quantities=QUANTITIES, verbose=False)
+    lazy_episodes = EpisodeData(lazy, protocol_id=0, quantities=QUANTITIES, verbose=False)
+    for q in QUANTITIES:
+        print(' - episodes, %s %s: identical: %s' % (q, getattr(episodes, q).shape,
+                np.array_equal(getattr(episodes, q), getattr(lazy_episodes, q))))
+        assert np.array_equal(getattr(episodes, q), getattr(lazy_episodes, q))
+    assert list(episodes.varied_parameters)==list(lazy_episodes.varied_parameters)==['angle']
+
+    lazy.close()
@@ -0,0 +1,122 @@
+"""
+regression test of the batch building of NWB files (assembling/batch.py)
+
+    on synthetic sessions (metadata + pre-computed locomotion):
+    - up-to-date sessions are skipped, "force" rebuilds them,
+        a modified input rebuilds only its session
+    - failing sessions (missing NI-DAQ data, error while writing the file)
+        do not abort the others, and leave no (partial) NWB file
+
+usage:
+    python tests/assembling/batch.py --nproc 2
+"""
+import argparse, sys, os, pathlib, tempfile, json, time
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+import pynwb
+from physion.assembling.batch import build_sessions
+from physion.analysis.read_NWB import Data
+
+
+def write_session(folder, date, time_, with_NIdaq=True):
+    """ a session with only a (pre-computed) running speed """
+    datafolder = os.path.join(folder, date, time_)
+    os.makedirs(datafolder)
+    metadata = {'date':date, 'time':time_, 'protocol':'None',
+                'experimenter':'test', 'lab':'test', 'institution':'test',
+                'notes':'', 'Locomotion':True, 'VisualStim':False,
+                'FaceCamera':False, 'EphysVm':False, 'EphysLFP':False,
+                'CaImaging':False}
+    with open(os.path.join(datafolder, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+    if with_NIdaq:
+        np.save(os.path.join(datafolder, 'NIdaq.start.npy'), [time.time()])
+    np.save(os.path.join(datafolder, 'locomotion.npy'),
+            dict(speed=np.random.randn(500), running_sampling=50.))
+    return datafolder
+
+
+def session_args(datafolder, destination_folder):
+    """ the arguments of "python -m physion.assembling.nwb" needed here """
+    return argparse.Namespace(datafolder=datafolder, filename='',
+                              destination_folder=destination_folder,
+                              modalities=['Locomotion'], verbose=False,
+                              force_recalculation_of_speed=False,
+                              running_sampling=50.)
+
+
+def statuses(RESULTS):
+    return [r['status'] for r in RESULTS]
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nproc", type=int, default=2)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    dest = os.path.join(folder, 'NWBs')
+    os.mkdir(dest)
+    FOLDERS = [write_session(folder, '2024_01_02', '10-00-00'),
+               write_session(folder, '2024_01_02', '11-00-00'),
+               write_session(folder, '2024_01_02', '12-00-00', with_NIdaq=False),
+               write_session(folder, '2024_01_02', '13-00-00')]
+    FILES = [os.path.join(dest, '2024_01_02-%s.nwb' % t) for t in\
+                    ['10-00-00', '11-00-00', '12-00-00', '13-00-00']]
+
+    # the last session fails while writing the NWB file
+    write = pynwb.NWBHDF5IO.write
+    def failing_write(self, *args, **kwargs):
+        if '13-00-00' in str(self.source):
+            raise OSError('disk full')
+        return write(self, *args, **kwargs)
+    pynwb.NWBHDF5IO.write = failing_write
+
+    def JOBS():
+        return [(session_args(f, dest), None) for f in FOLDERS]
+
+    # 1) first build
+    R = build_sessions(JOBS())
+    print(' - first build: %s' % statuses(R))
+    assert statuses(R)==['built', 'built', 'failed', 'failed']
+    print('   NWB files: %s, partial files left: %s' % (
+            [os.path.isfile(f) for f in FILES],
+            [f for f in os.listdir(dest) if '.part' in f]))
+    assert [os.path.isfile(f) for f in FILES]==[True, True, False, False]
+    assert len([f for f in os.listdir(dest) if '.part' in f])==0
+    assert 'disk full' in R[3]['error']
+    data = Data(FILES[0], verbose=False)
+    assert 'Running-Speed' in data.nwbfile.acquisition
+    data.io.close()
+
+    # 2) second build -> up-to-date sessions skipped
+    mtimes = [os.path.getmtime(f) for f in FILES[:2]]
+    R = build_sessions(JOBS())
+    print(' - second build: %s' % statuses(R))
+    assert statuses(R)==['skipped', 'skipped', 'failed', 'failed']
+    assert mtimes==[os.path.getmtime(f) for f in FILES[:2]]
+
+    # 3) an input modified after the build -> only its session is rebuilt
+    old = os.path.getmtime(os.path.join(FOLDERS[1], 'locomotion.npy'))-10
+    os.utime(FILES[1], (old, old))
+    R = build_sessions(JOBS())
+    print(' - session #2 older than its inputs: %s' % statuses(R))
+    assert statuses(R)==['skipped', 'built', 'failed', 'failed']
+
+    # 4) force -> all rebuilt
+    R = build_sessions(JOBS(), force=True)
+    print(' - force: %s' % statuses(R))
+    assert statuses(R)==['built', 'built', 'failed', 'failed']
+    assert len([f for f in os.listdir(dest) if '.part' in f])==0
+
+    # 5) process pool (the write failure is only patched in this process)
+    pynwb.NWBHDF5IO.write = write
+    R = build_sessions(JOBS()[:3], nproc=args.nproc, force=True)
+    print(' - force with nproc=%i: %s' % (args.nproc, statuses(R)))
+    assert statuses(R)==['built', 'built', 'failed']
+    R = build_sessions(JOBS()[:3], nproc=args.nproc)
+    print(' - up-to-date with nproc=%i: %s' % (args.nproc, statuses(R)))
+    assert statuses(R)==['skipped', 'skipped', 'failed']
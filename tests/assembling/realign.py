@@ -0,0 +1,54 @@
+"""
+regression test & benchmark of the photodiode realignment
+
+    compares the vectorized search of threshold crossings
+    to the former per-episode mask over the whole photodiode signal
+
+usage:
+    python tests/assembling/realign.py --nEpisodes 1000 --freq 10000
+"""
+import argparse, time, sys, os, pathlib, copy
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.assembling.realign_from_photodiode import realign_from_photodiode
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--nEpisodes", type=int, default=200)
+parser.add_argument("--freq", help="in Hz", type=float, default=10000)
+args = parser.parse_args()
+
+# synthetic protocol: stimuli with a random delay w.r.t. the expected onset
+Tstim, Tinter = 2., 3.
+time_start = 2+np.arange(args.nEpisodes)*(Tstim+Tinter)
+delays = 0.02+0.05*np.random.uniform(size=args.nEpisodes)
+
+t = np.arange(int((time_start[-1]+Tstim+5)*args.freq))/args.freq
+signal = 0.05*np.random.randn(len(t))
+for tstart, delay in zip(time_start, delays):
+    signal[(t>=tstart+delay) & (t<tstart+delay+Tstim)] += 1
+
+metadata = {'time_start':time_start,
+            'time_duration':Tstim*np.ones(args.nEpisodes),
+            'NIdaq-acquisition-frequency':args.freq}
+
+for label, kwargs in zip(['default', 'forced & ignored'],
+                         [{}, {'ignore_episodes':[3, 10],
+                               'indices_forced':[5, 20],
+                               'times_forced':[time_start[5]+0.03, time_start[20]-0.1],
+                               'durations_forced':[Tstim, Tstim]}]):
+    RESULTS = {}
+    for vectorized in [False, True]:
+        tic = time.time()
+        _, RESULTS[vectorized] = realign_from_photodiode(signal,
+                                                        copy.deepcopy(metadata),
+                                                        vectorized=vectorized,
+                                                        verbose=False,
+                                                        **copy.deepcopy(kwargs))
+        print(' - [%s] %s: %.2fs' % (label, 'vectorized' if vectorized else 'loop',
+                                     time.time()-tic))
+    print(' [%s] n=%i realigned episodes, identical: %s' % (label,
+            len(RESULTS[True]['time_start_realigned']),
+            np.array_equal(RESULTS[True]['time_start_realigned'],
+                           RESULTS[False]['time_start_realigned'])))
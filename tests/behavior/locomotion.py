@@ -0,0 +1,85 @@
+"""
+regression test & benchmark of the roto-encoder decoding
+
+    compares the single-pass decoding (transition table, by chunks)
+    to the former comparisons of the A and B traces,
+    and the running speed at the "running_sampling" rate of assembling.nwb
+    computed directly (compute_downsampled_speed) or with compute_speed+resample_signal
+
+usage:
+    python tests/behavior/locomotion.py --duration 600 --freq 10000
+"""
+import argparse, time, sys, os, pathlib, tracemalloc
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.behavior.locomotion import compute_speed, compute_downsampled_speed,\
+        compute_position, compute_position_from_binary_signals, process_binary_signal
+from physion.analysis.tools import resample_signal
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--duration", help="in s", type=float, default=600)
+parser.add_argument("--freq", help="in Hz", type=float, default=10000)
+parser.add_argument('-rs', "--running_sampling", default=50., type=float)
+args = parser.parse_args()
+
+# synthetic recording: encoder steps of a random running speed
+N = int(args.duration*args.freq)
+speed = 500*np.repeat(np.cumsum(np.random.randn(int(args.duration))), int(args.freq))[:N]
+steps = np.cumsum(np.clip(speed/args.freq, -0.9, 0.9)) # less than one step per sample
+# Gray code: ... => 11 => 01 => 00 => 10 => 11 => ... in (A,B), i.e. 3,2,0,1
+binary_signal = np.array([3, 2, 0, 1], dtype=np.uint32)[np.floor(steps).astype(int)%4]
+binary_signal[::100003] += 4 # other digital lines on, from time to time
+
+def run(func, *args, **kwargs):
+    tracemalloc.start()
+    tic = time.time()
+    output = func(*args, **kwargs)
+    tic = time.time()-tic
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, tic, peak/1e6
+
+def former_position(binary_signal, empirical=False):
+    A, B = process_binary_signal(binary_signal, empirical)
+    return compute_position_from_binary_signals(A, B)
+
+for empirical in [False, True]:
+    RESULTS = {}
+    for func in [former_position, compute_position]:
+        RESULTS[func], tic, peak = run(func, binary_signal, empirical=empirical)
+        print(' - [empirical=%s] %s: %.2fs, peak memory: %.0fMB' % (empirical,
+                func.__name__, tic, peak))
+    print(' [empirical=%s] identical position: %s' % (empirical,
+            np.array_equal(RESULTS[former_position], RESULTS[compute_position])))
+
+for empirical in [False, True]:
+    RESULTS = {}
+    for vectorized in [False, True]:
+        RESULTS[vectorized], tic, peak = run(compute_speed, binary_signal,
+                                             acq_freq=args.freq,
+                                             empirical=empirical,
+                                             vectorized=vectorized,
+                                             with_raw_position=True)
+        print(' - [empirical=%s] %s: %.2fs, peak memory: %.0fMB' % (empirical,
+                'vectorized' if vectorized else 'comparisons', tic, peak))
+    print(' [empirical=%s] identical position: %s, identical speed: %s' % (empirical,
+            np.array_equal(RESULTS[True][1], RESULTS[False][1]),
+            np.array_equal(RESULTS[True][0], RESULTS[False][0])))
+
+# downsampling as in assembling.nwb
+def speed_then_resample():
+    speed = compute_speed(binary_signal, acq_freq=args.freq)
+    return resample_signal(speed, original_freq=args.freq,
+                           new_freq=args.running_sampling,
+                           pre_smoothing=2./args.running_sampling)
+
+(t0, s0), tic, peak = run(speed_then_resample)
+print(' - compute_speed + resample_signal: %.2fs, peak memory: %.0fMB' % (tic, peak))
+(t1, s1), tic, peak = run(compute_downsampled_speed, binary_signal,
+                          acq_freq=args.freq, new_freq=args.running_sampling,
+                          smoothing=2./args.running_sampling)
+print(' - compute_downsampled_speed: %.2fs, peak memory: %.0fMB' % (tic, peak))
+print(' same time sampling: %s, correlation: %.4f, mean abs. difference: %.2fcm/s (speed std: %.2fcm/s)' % (\
+        np.array_equal(t0, t1), np.corrcoef(s0, s1)[0,1], np.mean(np.abs(s0-s1)), np.std(s0)))
@@ -0,0 +1,94 @@
+"""
+regression test & benchmark of the face motion computation
+
+    compares "compute_motion" (blocks of frames with sliced crops, optional
+    process pool) to the former frame-by-frame loop on a synthetic FaceCamera
+    recording, stored as single *.npy frames and then as a binary file:
+        same frames and same motion, with and without time subsampling
+
+usage:
+    python tests/facemotion/motion.py --nFrames 1000 --nproc 4
+"""
+import argparse, time, sys, os, pathlib, tempfile
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.facemotion import process
+from physion.utils.camera import CameraData
+
+
+def former_compute_motion(cls, time_subsampling=5):
+    """ [former loop of "compute_motion": each frame pair read with "load_ROI_data"] """
+    frames = np.arange(cls.camData.nFrames)[::time_subsampling]
+    motion = np.zeros(len(frames)-1)
+
+    for i, frame in enumerate(frames[:-1]):
+        try:
+            imgs = process.load_ROI_data(cls, frame, frame+2, flatten=True)
+            motion[i] = np.mean(np.diff(imgs,axis=0)**2)
+        except ValueError:
+            print('problem with frame #', frame)
+            pass # TO BE REMOVED !!
+
+    # ensure non-zero values, in mp4 movies you can have redundant frames
+    for i in range(1,len(motion)):
+        if motion[i]==0:
+            motion[i]=motion[i-1]
+
+    return frames[1:], motion
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFrames", type=int, default=300)
+    parser.add_argument("--nproc", type=int, default=2)
+    parser.add_argument("--block_size", type=int, default=50)
+    args = parser.parse_args()
+
+    # synthetic recording: a moving bright blob on a noisy background,
+    #       with repeated frames (zero motion, as in mp4 movies)
+    folder = tempfile.mkdtemp()
+    os.mkdir(os.path.join(folder, 'FaceCamera-imgs'))
+    np.save(os.path.join(folder, 'NIdaq.start.npy'), [0.])
+    Lx, Ly = 320, 240
+    x, y = np.meshgrid(np.arange(Lx), np.arange(Ly), indexing='ij')
+    for i in range(args.nFrames):
+        if (i%10)!=5:
+            img = 50+150*np.exp(-((x-160-40*np.sin(i/10.))**2+(y-120)**2)/800.)
+            img = np.uint8(np.clip(img+np.random.normal(0, 10, (Lx,Ly)), 0, 255))
+        np.save(os.path.join(folder, 'FaceCamera-imgs', '%.4f.npy' % (i/30.)), img.T)
+
+    for storage in ['npy-frames', 'binary']:
+
+        if storage=='binary':
+            CameraData('FaceCamera', folder=folder, verbose=False).convert_to_binary()
+
+        cls = SimpleNamespace(camData=CameraData('FaceCamera', folder=folder,
+                                                 verbose=False), ROI=None)
+        process.set_ROI_area(cls, roi_coords=(50, 80, 100, 150))
+        print(' - %s (%s)' % (storage, 'binary file: %s' % (cls.camData.frames is not None)))
+
+        for time_subsampling in [1, 3]:
+
+            tic = time.time()
+            former_frames, former_motion = former_compute_motion(cls,
+                                                    time_subsampling=time_subsampling)
+            tFormer = time.time()-tic
+
+            for nproc in [1, args.nproc]:
+                tic = time.time()
+                frames, motion = process.compute_motion(cls,
+                                                        time_subsampling=time_subsampling,
+                                                        block_size=args.block_size,
+                                                        nproc=nproc)
+                t = time.time()-tic
+                print('   subsampling=%i, nproc=%i: %.2fs vs former loop %.2fs,' % (
+                        time_subsampling, nproc, t, tFormer)+\
+                      ' identical frames: %s, identical motion: %s' % (
+                        np.array_equal(frames, former_frames),
+                        np.array_equal(motion, former_motion)))
+                assert np.array_equal(frames, former_frames)
+                assert np.array_equal(motion, former_motion)
@@ -0,0 +1,88 @@
+"""
+test harness of the NIdaq recording with a simulated device
+
+    the callbacks of hardware.NIdaq.main.Acquisition are triggered with
+    simulated readers, to check that:
+        - the cost per callback stays constant (preallocated/streamed data)
+        - the data read back with assembling.tools.load_NIdaq_data are complete
+
+usage:
+    python tests/hardware/NIdaq_streaming.py --duration 600 --freq 10000
+"""
+import argparse, time, sys, os, pathlib, tempfile
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.hardware.NIdaq.main import Acquisition
+from physion.assembling.tools import load_NIdaq_data
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--duration", help="in s", type=float, default=600)
+parser.add_argument("--freq", help="in Hz", type=float, default=10000)
+parser.add_argument("--buffer_time", help="in s", type=float, default=0.1)
+parser.add_argument("--Nchannel_analog_in", type=int, default=2)
+args = parser.parse_args()
+
+
+class SimulatedDevice:
+    """ replaces the nidaqmx device: only the channel names are used """
+
+    def __init__(self):
+        for key, name in zip(['ai_physical_chans', 'di_lines', 'ao_physical_chans'],
+                             ['ai', 'port0/line', 'ao']):
+            setattr(self, key, [type('Channel', (), {'name':'Sim/%s%i' % (name, i)})\
+                                    for i in range(8)])
+
+
+class SimulatedReader:
+    """ replaces the nidaqmx stream readers: buffers of consecutive samples """
+
+    def __init__(self):
+        self.i = 0
+
+    def read_many_sample(self, data, n, timeout=0):
+        data[:,:n] = np.sin(np.arange(self.i, self.i+n)*1e-3)
+        self.i += n
+
+    def read_many_sample_port_uint32(self, data, n, timeout=0):
+        data[:,:n] = np.arange(self.i, self.i+n)%4
+        self.i += n
+
+
+folder = tempfile.mkdtemp()
+acq = Acquisition(sampling_rate=args.freq,
+                  Nchannel_analog_in=args.Nchannel_analog_in,
+                  Nchannel_digital_in=1,
+                  max_time=args.duration,
+                  buffer_time=args.buffer_time,
+                  filename=os.path.join(folder, 'NIdaq.npy'),
+                  device=SimulatedDevice())
+
+# what "launch" does, without the nidaqmx tasks
+acq.init_storage()
+acq.analog_reader, acq.digital_reader = SimulatedReader(), SimulatedReader()
+acq.running = True
+
+# we stop before the end of the "max_time" to test the truncation
+nCallbacks = int(0.9*acq.Nsamples/acq.buffer_size)
+TIMES = np.zeros(nCallbacks)
+for i in range(nCallbacks):
+    tic = time.perf_counter()
+    acq.reading_task_callback(0, None, acq.buffer_size)
+    TIMES[i] = time.perf_counter()-tic
+
+acq.running = False # no nidaqmx task to close
+acq.close()
+
+n = int(nCallbacks/10)
+print(' - %i callbacks of %i samples: first 10%%: %.3fms, last 10%%: %.3fms per callback' % (\
+        nCallbacks, acq.buffer_size, 1e3*np.mean(TIMES[:n]), 1e3*np.mean(TIMES[-n:])))
+
+data = load_NIdaq_data(folder)
+N = nCallbacks*acq.buffer_size
+print(' - read back: analog %s, digital %s, dt=%.1e' % (data['analog'].shape,
+                                                        data['digital'].shape, data['dt']))
+print(' - complete and identical: %s' % (\
+        np.array_equal(data['analog'][0], np.sin(np.arange(N)*1e-3)) and\
+        np.array_equal(data['digital'][0], np.arange(N)%4)))
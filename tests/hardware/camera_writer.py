@@ -0,0 +1,68 @@
+"""
+test of the binary camera writer
+
+    frames are written with the BinaryFrameWriter (single "X.bin" file,
+    background thread) and with one np.save per frame (former "X-imgs" storage),
+    then read back with physion.utils.camera.CameraData
+
+usage:
+    python tests/hardware/camera_writer.py --nFrames 3000 --fps 300
+"""
+import argparse, time, sys, os, pathlib, tempfile
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.hardware.camera_writer import BinaryFrameWriter
+from physion.utils.camera import CameraData
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--nFrames", type=int, default=3000)
+parser.add_argument("--Lx", type=int, default=640)
+parser.add_argument("--Ly", type=int, default=480)
+parser.add_argument("--fps", help="acquisition rate of the binary writer test",
+                    type=float, default=300)
+args = parser.parse_args()
+
+folder = tempfile.mkdtemp()
+np.save(os.path.join(folder, 'NIdaq.start.npy'), [0.])
+FRAMES = np.random.randint(0, 255, size=(10, args.Ly, args.Lx)).astype(np.uint8)
+TIMES = {}
+
+# 1) one file per frame (acquisition loop blocked by each write)
+os.mkdir(os.path.join(folder, 'FramesCamera-imgs'))
+TIMES['frames'] = np.zeros(args.nFrames)
+for i in range(args.nFrames):
+    tic = time.perf_counter()
+    np.save(os.path.join(folder, 'FramesCamera-imgs', '%s.npy' % (i/30.)),
+            FRAMES[i%10])
+    TIMES['frames'][i] = time.perf_counter()-tic
+
+# 2) binary writer (acquisition loop only queues the frames)
+writer = BinaryFrameWriter(folder, 'BinaryCamera')
+TIMES['binary'] = np.zeros(args.nFrames)
+for i in range(args.nFrames):
+    tic = time.perf_counter()
+    writer.write(i/30., FRAMES[i%10])
+    TIMES['binary'][i] = time.perf_counter()-tic
+    time.sleep(max([0, 1./args.fps-(time.perf_counter()-tic)])) # camera frame rate
+tic = time.perf_counter()
+writer.close()
+print(' - closing the writer: %.2fs' % (time.perf_counter()-tic))
+
+for storage in ['frames', 'binary']:
+    print(' - %s: %.3fms per frame in the acquisition loop (max: %.1fms)' % (storage,
+            1e3*np.mean(TIMES[storage]), 1e3*np.max(TIMES[storage])))
+
+for storage, name in zip(['frames', 'binary'], ['FramesCamera', 'BinaryCamera']):
+    tic = time.perf_counter()
+    camData = CameraData(name, folder=folder, verbose=False)
+    load = time.perf_counter()-tic
+    # frame index from its timestamp (in case of dropped frames)
+    identical = (len(camData)==args.nFrames-writer.dropped*(storage=='binary')) and\
+        np.all([np.array_equal(camData.get(i),
+                               FRAMES[int(round(30*camData.times[i]))%10].T)\
+                    for i in range(0, len(camData), 97)])
+    print(' - %s: loaded in %.2fs, n=%i frames, identical: %s' % (storage, load,
+                                                                len(camData), identical))
+print(' - dropped frames: %i' % writer.dropped)
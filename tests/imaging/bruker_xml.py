@@ -0,0 +1,119 @@
+"""
+regression test & benchmark of the Bruker xml parser
+
+    synthetic Prairie xml files (multi-plane with piezo, single plane,
+    former 5.4 version) are parsed with the streaming parser and with the
+    former parsing of the whole ElementTree: the outputs should be identical
+
+    the timing and the peak memory (in a fresh process for each parser)
+    are then compared on a large file
+
+usage:
+    python tests/imaging/bruker_xml.py --nFrames 1000000
+"""
+import argparse, time, sys, os, pathlib, tempfile, resource, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging.bruker.xml_parser import bruker_xml_parser
+
+
+def write_xml(filename, nFrames,
+              version='5.6.64.400',
+              nPlanes=3,
+              CHANNELS=['Ch1', 'Ch2']):
+    """ one Sequence per cycle of "nPlanes" frames (if nPlanes>1) """
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<PVScan version="%s" date="1/1/2024 12:00:00 PM" notes="">\n' % version)
+        f.write('  <SystemIDs SystemID="0000"><SystemID SystemID="0000" Description="x"/></SystemIDs>\n')
+        f.write('  <PVStateShard>\n')
+        for key, value in zip(['linesPerFrame', 'pixelsPerLine', 'framePeriod'],
+                              [512, 512, 0.033]):
+            f.write('    <PVStateValue key="%s" value="%s"/>\n' % (key, value))
+        f.write('    <PVStateValue key="laserPower"><IndexedValue index="0" value="10" description="Pockels"/>'+\
+                '<IndexedValue index="1" value="0"/></PVStateValue>\n')
+        f.write('    <PVStateValue key="positionCurrent">'+\
+                '<SubindexedValues index="XAxis"><SubindexedValue subindex="0" value="1.5"/></SubindexedValues>'+\
+                '<SubindexedValues index="ZAxis"><SubindexedValue subindex="0" value="10" description="Z Focus"/>'+\
+                '<SubindexedValue subindex="1" value="180" description="Bruker 400 Piezo"/></SubindexedValues>'+\
+                '</PVStateValue>\n')
+        f.write('  </PVStateShard>\n')
+        for i in range(nFrames):
+            iCycle, iPlane = i//nPlanes, i%nPlanes
+            if iPlane==0:
+                if i>0:
+                    f.write('  </Sequence>\n')
+                f.write('  <Sequence type="TSeries ZSeries Element" cycle="%i" time="12:00:%02i.123">\n' % (
+                        iCycle+1, min([59, iCycle])))
+            f.write('    <Frame relativeTime="%.6f" absoluteTime="%.6f" index="%i" parameterSet="CurrentSettings">\n' % (
+                    0.033*i, 1.2+0.033*i, iPlane+1))
+            for chan in CHANNELS:
+                f.write('      <File channel="%s" channelName="%s" page="1" filename="TSeries-001_Cycle%05i_%s_%06i.ome.tif"/>\n' % (
+                        chan[-1], chan, iCycle+1, chan, iPlane+1))
+            f.write('      <ExtraParameters lastGoodFrame="0"/>\n')
+            if (nPlanes>1) and (version!='5.4.64.400'):
+                f.write('      <PVStateShard><PVStateValue key="positionCurrent"><SubindexedValues index="ZAxis">'+\
+                        '<SubindexedValue subindex="0" value="10" description="Z Focus"/>'+\
+                        '<SubindexedValue subindex="1" value="%.1f" description="Bruker 400 Piezo"/>' % (180+20*iPlane)+\
+                        '</SubindexedValues></PVStateValue></PVStateShard>\n')
+            f.write('    </Frame>\n')
+        f.write('  </Sequence>\n</PVScan>\n')
+
+
+def compare(x, y):
+    """ identical values and types """
+    if isinstance(x, dict):
+        return isinstance(y, dict) and (list(sorted(x.keys()))==list(sorted(y.keys()))) and\
+                np.all([compare(x[key], y[key]) for key in x])
+    elif isinstance(x, np.ndarray):
+        return isinstance(y, np.ndarray) and (x.dtype.kind==y.dtype.kind) and\
+                np.array_equal(x, y)
+    else:
+        return (type(x)==type(y)) and (x==y)
+
+
+def run_parser(filename, streaming):
+    """ in a fresh process: (time, peak memory increase in MB, data) """
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tic = time.time()
+    data = bruker_xml_parser(filename, streaming=streaming)
+    t = time.time()-tic
+    return t, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-rss0)/1024., data
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFrames", type=int, default=200000)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+
+    # 1) identical outputs
+    for label, kwargs in zip(['multi-plane', 'single-plane', 'single-sequence', 'v5.4'],
+                             [{}, {'nPlanes':1}, {'nPlanes':1000},
+                              {'nPlanes':1000, 'version':'5.4.64.400', 'CHANNELS':['Ch2']}]):
+        filename = os.path.join(folder, '%s.xml' % label)
+        write_xml(filename, 999, **kwargs)
+        data = bruker_xml_parser(filename)
+        print(' - [%s] n=%i frames, channels: %s, planes: %i, identical: %s' % (label,
+                len(data[data['channels'][0]]['tifFile']), data['channels'], data['Nplanes'],
+                compare(data, bruker_xml_parser(filename, streaming=False))))
+
+    # 2) large file
+    filename = os.path.join(folder, 'large.xml')
+    write_xml(filename, args.nFrames)
+    print(' - %i frames x 2 channels: %.0fMB xml file' % (args.nFrames,
+                                                       os.path.getsize(filename)/1e6))
+    RESULTS = {}
+    for streaming in [True, False]:
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            t, memory, RESULTS[streaming] = pool.submit(run_parser, filename,
+                                                        streaming).result()
+        print(' - %s parser: %.1fs, peak memory: +%.0fMB' % (\
+                'streaming' if streaming else 'tree', t, memory))
+    print(' - identical: %s' % compare(RESULTS[True], RESULTS[False]))
@@ -0,0 +1,132 @@
+"""
+benchmark of the log 8-bit movie conversion of a TIFF stack
+
+    a synthetic stack of 16-bit TIFF frames is converted with the pipelined
+    encoder for an increasing number of processes, and compared to the former
+    frame-by-frame conversion (same frames in the movie, same order)
+
+    errors in the pipeline (video writer, frame decoding, worker processes)
+    should be raised without hanging, with the video file released
+
+usage:
+    python tests/imaging/log8bit_movie.py --nFrames 2000 --Lx 512 --Ly 512
+"""
+import argparse, time, sys, os, pathlib, tempfile, multiprocessing, threading
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging import convert_to_movie
+from physion.imaging.convert_to_movie import write_log8bit_movie, cv, Image
+
+
+def former_conversion(vid_name, folder, FILES, movie_rate, Lx, Ly):
+    """ single thread, one TIFF at a time """
+    out = cv.VideoWriter(vid_name, cv.VideoWriter_fourcc(*'mp4v'),
+                         movie_rate, (Lx, Ly), False)
+    for f in FILES:
+        img = np.array(Image.open(os.path.join(folder, f)), dtype='uint16')
+        img = np.array(np.log(img+1.)/np.log(2**16)*2**8, dtype='uint8')
+        out.write(img)
+    out.release()
+
+
+class FailingWriter:
+    """ replaces cv.VideoWriter: fails after "nmax" frames if nmax>=0 """
+    def __init__(self, *args):
+        self.n, self.released = 0, False
+        WRITERS.append(self)
+    def write(self, img):
+        self.n += 1
+        if (self.nmax>=0) and (self.n>self.nmax):
+            raise IOError('disk full')
+    def release(self):
+        self.released = True
+
+
+def failing_decoding(folder, FILES):
+    raise IOError('decoding error')
+
+
+def check_error(label, *args, **kwargs):
+    """ runs write_log8bit_movie in a thread (to detect a blocked pipeline) """
+    ERROR = []
+    def run():
+        try:
+            write_log8bit_movie(*args, **kwargs)
+        except BaseException as be:
+            ERROR.append(be)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=120)
+    print(' - %s: blocked: %s, raised: %s, video released: %s' % (label,
+            thread.is_alive(), repr(ERROR[0]) if ERROR else None,
+            WRITERS[-1].released))
+
+
+def read_movie(vid_name):
+    cap, frames = cv.VideoCapture(vid_name), []
+    ret, frame = cap.read()
+    while ret:
+        frames.append(frame[:,:,0])
+        ret, frame = cap.read()
+    return np.array(frames)
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFrames", type=int, default=1000)
+    parser.add_argument("--Lx", type=int, default=512)
+    parser.add_argument("--Ly", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--nproc_max", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    FILES = np.array(['TSeries-001_Cycle00001_Ch2_%06d.ome.tif' % (i+1)\
+                            for i in range(args.nFrames)])
+    x, y = np.meshgrid(np.arange(args.Lx), np.arange(args.Ly))
+    for i, f in enumerate(FILES):
+        # moving blob (the frame order is visible in the movie)
+        img = 200+3000*np.exp(-((x-(i%args.Lx))**2+(y-args.Ly/2)**2)/400.)
+        img += 50*np.random.randn(args.Ly, args.Lx)
+        Image.fromarray(np.clip(img, 0, 2**16-1).astype('uint16')).save(\
+                os.path.join(folder, f), format='TIFF')
+    os.remove(os.path.join(folder, FILES[3])) # a missing frame
+    print(' - %i frames of %ix%i written in "%s"' % (args.nFrames, args.Lx, args.Ly,
+                                                     folder))
+
+    tic = time.time()
+    former_conversion(os.path.join(folder, 'former.mp4'), folder,
+                      np.delete(FILES, 3), 30., args.Lx, args.Ly)
+    tFormer = time.time()-tic
+    print(' - former conversion: %.2fs (%.0f frames/s)' % (tFormer, args.nFrames/tFormer))
+    former = read_movie(os.path.join(folder, 'former.mp4'))
+
+    for nproc in range(1, args.nproc_max+1):
+        tic = time.time()
+        success = write_log8bit_movie(os.path.join(folder, 'nproc%i.mp4' % nproc),
+                                      folder, FILES, 30., args.Lx, args.Ly,
+                                      nproc=nproc, batch_size=args.batch_size)
+        t = time.time()-tic
+        movie = read_movie(os.path.join(folder, 'nproc%i.mp4' % nproc))
+        print(' - nproc=%i: %.2fs (%.0f frames/s, x%.1f), missing frames: %s, identical: %s' % (
+                nproc, t, args.nFrames/t, tFormer/t, np.flatnonzero(~success),
+                np.array_equal(movie, former)))
+
+    # errors in the pipeline
+    WRITERS = []
+    cv.VideoWriter = FailingWriter
+    FailingWriter.nmax = 10
+    check_error('video writer error', os.path.join(folder, 'error.mp4'), folder,
+                FILES, 30., args.Lx, args.Ly, nproc=1, batch_size=4, queue_size=1)
+    FailingWriter.nmax = -1
+    decoding = convert_to_movie.load_log8bit_batch
+    convert_to_movie.load_log8bit_batch = failing_decoding
+    check_error('decoding error', os.path.join(folder, 'error.mp4'), folder,
+                FILES, 30., args.Lx, args.Ly, nproc=1, batch_size=4)
+    convert_to_movie.load_log8bit_batch = decoding
+    # a folder that can not be sent to the workers
+    check_error('worker error', os.path.join(folder, 'error.mp4'), lambda: folder,
+                FILES, 30., args.Lx, args.Ly, nproc=2, batch_size=4)
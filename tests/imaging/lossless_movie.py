@@ -0,0 +1,140 @@
+"""
+round trip of the lossless 16-bit movie conversion
+
+    synthetic 16-bit TIFF frames (with a minimal Bruker xml file) are encoded
+    in a lossless movie (ffv1, as in "convert_to_16bit_avi"), then restored by
+    "reconvert_to_tiffs_from_16bit" as TIFF files and as a suite2p binary
+    and compared bit by bit to the original frames
+
+    the int16 suite2p binary can not hold the values above 32766: they are
+    clipped (as in suite2p) and their number should be reported
+
+    the former reconversion (one ffmpeg decoding per frame) is timed
+    on the first frames
+
+    a truncated, a corrupted and an invalid movie should raise an error
+        (and release the binary file and the ffmpeg process)
+
+usage:
+    python tests/imaging/lossless_movie.py --nFrames 1000 --Lx 256 --Ly 256
+"""
+import argparse, time, sys, os, pathlib, tempfile, io, contextlib, shutil
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging.convert_to_movie import reconvert_to_tiffs_from_16bit,\
+        ffmpeg, Image
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--nFrames", type=int, default=1000)
+parser.add_argument("--Lx", type=int, default=256)
+parser.add_argument("--Ly", type=int, default=192)
+parser.add_argument("--nFormer", help="frames restored with the former method",
+                    type=int, default=20)
+args = parser.parse_args()
+
+folder = os.path.join(tempfile.mkdtemp(), 'TSeries-001')
+os.mkdir(folder)
+FILES = ['TSeries-001_Cycle00001_Ch2_%06d.ome.tif' % (i+1) for i in range(args.nFrames)]
+
+with open(os.path.join(folder, 'TSeries-001.xml'), 'w') as f:
+    f.write('<PVScan version="5.6.64.400" date="1/1/2024 12:00:00 PM">\n')
+    f.write('<SystemIDs/>\n<PVStateShard>\n')
+    for key, value in zip(['linesPerFrame', 'pixelsPerLine', 'framePeriod'],
+                          [args.Ly, args.Lx, 0.033]):
+        f.write('<PVStateValue key="%s" value="%s"/>\n' % (key, value))
+    f.write('</PVStateShard>\n<Sequence type="TSeries Timed Element" time="12:00:00">\n')
+    for i, tif in enumerate(FILES):
+        f.write('<Frame relativeTime="%.3f" absoluteTime="%.3f" index="%i">\n' % (
+                0.033*i, 0.033*i, i+1))
+        f.write('<File channel="2" channelName="Ch2" filename="%s"/>\n</Frame>\n' % tif)
+    f.write('</Sequence>\n</PVScan>\n')
+
+# full 16-bit range (also above the int16 limit of the suite2p binary)
+FRAMES = np.random.randint(0, 2**16, size=(args.nFrames, args.Ly, args.Lx),
+                           dtype=np.uint16)
+for frame, tif in zip(FRAMES, FILES):
+    Image.fromarray(frame).save(os.path.join(folder, tif), format='TIFF')
+
+vid_name = os.path.join(folder, 'Ch2.avi')
+tic = time.time()
+ffmpeg.input(os.path.join(folder, FILES[0].replace('000001', '%06d')))\
+        .output(vid_name, vcodec='ffv1').global_args('-loglevel', 'error').run()
+print(' - %i frames of %ix%i encoded in %.1fs' % (args.nFrames, args.Ly, args.Lx,
+                                                time.time()-tic))
+for tif in FILES:
+    os.remove(os.path.join(folder, tif))
+
+# former method: one decoding per frame
+tic = time.time()
+for i in range(args.nFormer):
+    out, _ = (ffmpeg.input(vid_name)
+              .filter_('select', 'gte(n,{})'.format(i))
+              .output('pipe:', format='rawvideo', pix_fmt='gray16le', vframes=1)
+              .run(capture_stdout=True, capture_stderr=True))
+tFormer = (time.time()-tic)/args.nFormer
+print(' - former reconversion: %.1fms per frame -> %.1fs for the movie' % (
+        1e3*tFormer, tFormer*args.nFrames))
+
+# single pass, to TIFF files
+tic = time.time()
+n = reconvert_to_tiffs_from_16bit(vid_name)
+t = time.time()-tic
+print(' - single pass to TIFF: %.1fs (%.1fms per frame), n=%i frames' % (t,
+        1e3*t/args.nFrames, n))
+print('   bit-exact: %s' % np.all([np.array_equal(\
+        np.array(Image.open(os.path.join(folder, tif))), frame)\
+                for tif, frame in zip(FILES, FRAMES)]))
+
+# single pass, to the suite2p binary
+tic = time.time()
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    n = reconvert_to_tiffs_from_16bit(vid_name,
+                                      binary_file=os.path.join(folder, 'data.bin'))
+t = time.time()-tic
+binary = np.fromfile(os.path.join(folder, 'data.bin'), np.int16).reshape(FRAMES.shape)
+print(' - single pass to binary: %.1fs (%.1fms per frame), n=%i frames' % (t,
+        1e3*t/args.nFrames, n))
+below = FRAMES<=2**15-2
+print('   bit-exact below %i: %s, clipped above: %s' % (2**15-2,
+        np.array_equal(binary[below], FRAMES[below].astype('int16')),
+        np.all(binary[~below]==2**15-2)))
+print('   clipped pixels reported: %s (n=%i)' % (
+        ('n=%i pixels above' % np.sum(~below)) in output.getvalue(), np.sum(~below)))
+
+# truncated and corrupted movies -> errors
+def open_files():
+    # (linux only)
+    return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 0
+
+for case in ['truncated', 'corrupted', 'invalid']:
+    broken = os.path.join(tempfile.mkdtemp(), 'TSeries-001')
+    os.mkdir(broken)
+    shutil.copy(os.path.join(folder, 'TSeries-001.xml'), broken)
+    if case=='truncated':
+        ffmpeg.input(vid_name).output(os.path.join(broken, 'Ch2.avi'), vcodec='copy',
+                                      vframes=args.nFrames//2)\
+                .global_args('-loglevel', 'error').run()
+    elif case=='invalid':
+        # -> ffmpeg fails (non-zero return code)
+        with open(os.path.join(broken, 'Ch2.avi'), 'wb') as f:
+            f.write(os.urandom(10000))
+    else:
+        with open(vid_name, 'rb') as f:
+            content = bytearray(f.read())
+        content[len(content)//3:] = os.urandom(len(content)-len(content)//3)
+        with open(os.path.join(broken, 'Ch2.avi'), 'wb') as f:
+            f.write(content[:len(content)//2])
+    nfiles, error = open_files(), None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            reconvert_to_tiffs_from_16bit(os.path.join(broken, 'Ch2.avi'),
+                                          binary_file=os.path.join(broken, 'data.bin'))
+    except IOError as be:
+        error = be
+    print(' - %s movie -> error: %s' % (case, error))
+    print('   files released: %s' % (open_files()==nfiles))
+    assert (error is not None) and (open_files()==nfiles)
+    assert (case!='invalid') or ('return code' in str(error))
@@ -0,0 +1,126 @@
+"""
+regression test & benchmark of the neuropil factor estimation of imaging.Calcium
+
+    the vectorized "compute_neuropil_facor" is compared to the former loop
+    over ROIs (one scikit-learn LinearRegression per ROI, copied below):
+        - continuous data: same slopes (to rounding), same alpha, same valid ROIs
+        - tied (rounded) data with empty percentile bins: the former loop
+            raises an IndexError, the vectorized version gives NaN slopes
+            (discarded ROIs) and the same slopes for the other ROIs
+
+usage:
+    python tests/imaging/neuropil_factor.py --nROIs 500 --nFrames 20000
+"""
+import argparse, time, sys, os, pathlib
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging.Calcium import compute_neuropil_facor, compute_neuropil_slopes
+
+
+def former_neuropil_slopes(F, Fneu):
+    """ [former loop over ROIs of "compute_neuropil_facor"] """
+    slopes_list = []
+    per = np.arange(5, 101, 5)
+
+    for k in range(len(F)): #loop on each neuron
+        b = 0
+        All_F, percentile_Fneu = [], []
+        for q in per:
+            current_percentile = np.percentile(Fneu[k], q)
+            previous_percentile = np.percentile(Fneu[k], b)
+            index_percentile_q = np.where((previous_percentile <= Fneu[k]) & (Fneu[k] < current_percentile))
+            F_percentile_q = F[k][index_percentile_q]
+            perc_F_q = np.percentile(F_percentile_q, 5)
+            percentile_Fneu.append(current_percentile)
+            All_F.append(perc_F_q)
+            b = q
+
+        #fitting a linear regression model
+        x = np.array(percentile_Fneu).reshape(-1, 1)
+        y = np.array(All_F)
+        model = LinearRegression()
+        model.fit(x, y)
+        slopes_list.append(model.coef_[0])
+
+    return np.array(slopes_list)
+
+
+def former_neuropil_facor(F, Fneu):
+    """ [former "compute_neuropil_facor"] """
+    slopes_list = former_neuropil_slopes(F, Fneu)
+    valid_ROIs, alphas = [],[]
+    for q in range(len(slopes_list)):
+        if slopes_list[q] > 0:
+            valid_ROIs.append(True)
+            alphas.append(slopes_list[q])
+        else :
+            valid_ROIs.append(False)
+    
+    alpha = np.mean(alphas)
+
+    return alpha, np.array(valid_ROIs)
+
+
+def synthetic_fluo(nROIs, nFrames):
+    """ neuropil contamination with ROI-specific factors (some negative) """
+    Fneu = 50+10*np.random.rand(nROIs, 1)*np.random.randn(nROIs, nFrames).cumsum(axis=1)/30.
+    factors = np.random.uniform(-0.3, 1., size=(nROIs, 1))
+    F = 100+factors*Fneu+np.random.exponential(5, size=(nROIs, nFrames))
+    return F, Fneu
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nROIs", type=int, default=200)
+    parser.add_argument("--nFrames", type=int, default=10000)
+    args = parser.parse_args()
+
+    # 1) continuous data
+    F, Fneu = synthetic_fluo(args.nROIs, args.nFrames)
+
+    tic = time.time()
+    former_alpha, former_valid = former_neuropil_facor(F, Fneu)
+    tFormer = time.time()-tic
+
+    tic = time.time()
+    alpha, valid = compute_neuropil_facor(F, Fneu)
+    t = time.time()-tic
+
+    slopes, former_slopes = compute_neuropil_slopes(F, Fneu), former_neuropil_slopes(F, Fneu)
+    print(' - continuous data: former loop %.2fs, vectorized %.3fs (x%.0f)' % (tFormer,
+                                                                  t, tFormer/t))
+    print('   alpha: %.12f vs %.12f, same valid ROIs: %s (n=%i/%i), max. slope diff.: %.1e' % (
+            alpha, former_alpha, np.array_equal(valid, former_valid),
+            np.sum(valid), args.nROIs, np.max(np.abs(slopes-former_slopes))))
+    assert np.array_equal(valid, former_valid)
+    assert np.allclose(slopes, former_slopes, rtol=1e-9, atol=1e-12)
+    assert np.isclose(alpha, former_alpha, rtol=1e-12, atol=0)
+
+    # 2) tied data (rounded neuropil -> empty percentile bins in some ROIs)
+    F, Fneu = synthetic_fluo(20, 2000)
+    tied = np.arange(20)%4==0
+    Fneu[tied] = np.round(Fneu[tied]/5.)
+    try:
+        former_neuropil_facor(F, Fneu)
+        former_error = None
+    except IndexError as e:
+        former_error = e
+    slopes = compute_neuropil_slopes(F, Fneu)
+    alpha, valid = compute_neuropil_facor(F, Fneu)
+    print(' - tied data: former loop raised: %s, NaN slopes: %s (tied ROIs: %s)' % (
+            repr(former_error), np.flatnonzero(np.isnan(slopes)), np.flatnonzero(tied)))
+    assert isinstance(former_error, IndexError)
+    assert np.all(np.isnan(slopes[tied])) and (not np.any(valid[tied]))
+
+    # the other ROIs are unchanged
+    former_alpha, former_valid = former_neuropil_facor(F[~tied], Fneu[~tied])
+    print('   other ROIs: same slopes: %s, same valid ROIs: %s, alpha: %.12f vs %.12f' % (
+            np.allclose(slopes[~tied], former_neuropil_slopes(F[~tied], Fneu[~tied]),
+                        rtol=1e-9, atol=1e-12),
+            np.array_equal(valid[~tied], former_valid), alpha, former_alpha))
+    assert np.array_equal(valid[~tied], former_valid)
+    assert np.isclose(alpha, former_alpha, rtol=1e-12, atol=0)
@@ -0,0 +1,99 @@
+"""
+regression test of the batched deconvolution of imaging.dcnv ("oasis")
+
+    "oasis" (work buffers reused across batches, batch size set from a memory
+    budget, output as a new array, a memory-mapped file or a preallocated
+    array, lazy input) is compared to the former version (copied below)
+    in a single batch over all neurons:
+        - several memory budgets (batch sizes of 1, 7, 16 and all neurons),
+            the number of neurons is not a multiple of the batch size
+            (-> reused and partially filled work buffers)
+        - out=None, out as a "*.npy" path, out as a preallocated array
+        - F as a float64 array and as a lazy array (read_NWB.LazyROIArray)
+
+usage:
+    python tests/imaging/oasis.py --nROIs 50 --nFrames 5000
+"""
+import argparse, time, sys, os, pathlib, tempfile
+import numpy as np
+import h5py
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging.dcnv import oasis, oasis_matrix
+from physion.analysis.read_NWB import LazyROIArray
+
+
+def former_oasis(F, batch_size, tau, fs):
+    """ [former version of "oasis"] """
+    NN, NT = F.shape
+    F = F.astype(np.float32)
+    S = np.zeros((NN, NT), dtype=np.float32)
+    for i in range(0, NN, batch_size):
+        f = F[i:i + batch_size]
+        v = np.zeros((f.shape[0], NT), dtype=np.float32)
+        w = np.zeros((f.shape[0], NT), dtype=np.float32)
+        t = np.zeros((f.shape[0], NT), dtype=np.int64)
+        l = np.zeros((f.shape[0], NT), dtype=np.float32)
+        s = np.zeros((f.shape[0], NT), dtype=np.float32)
+        oasis_matrix(f, v, w, t, l, s, tau, fs)
+        S[i:i + batch_size] = s
+    return S
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nROIs", type=int, default=50)
+    parser.add_argument("--nFrames", type=int, default=5000)
+    parser.add_argument("--tau", type=float, default=1.3)
+    parser.add_argument("--fs", type=float, default=30.)
+    args = parser.parse_args()
+
+    # synthetic calcium traces: random spikes * exponential kernel + noise
+    spikes = np.random.poisson(0.02, size=(args.nROIs, args.nFrames))
+    kernel = np.exp(-np.arange(int(5*args.tau*args.fs))/args.tau/args.fs)
+    F = np.array([np.convolve(s, kernel)[:args.nFrames] for s in spikes])
+    F += 0.1*np.random.randn(*F.shape) # float64
+
+    tic = time.time()
+    ref = former_oasis(F, args.nROIs, args.tau, args.fs)
+    print(' - former version (single batch): %.2fs' % (time.time()-tic))
+
+    folder = tempfile.mkdtemp()
+    with h5py.File(os.path.join(folder, 'F.h5'), 'w') as f:
+        lazyF = LazyROIArray(f.create_dataset('F', data=F.T, chunks=(1000, 4)),
+                             transposed=True)
+
+        for batch_size in [1, 7, 16, args.nROIs]:
+            # memory budget for "batch_size" neurons (see "oasis")
+            budget = batch_size*args.nFrames*(5*4+8)
+            for out in ['None', 'path', 'array']:
+                for Finput, label in zip([F, lazyF], ['array', 'lazy']):
+
+                    if out=='None':
+                        OUT = None
+                    elif out=='path':
+                        OUT = os.path.join(folder, 'S.npy')
+                    else:
+                        # (filled with garbage, fully overwritten)
+                        OUT = np.full(F.shape, np.nan, dtype=np.float32)
+
+                    tic = time.time()
+                    S = oasis(Finput, None, args.tau, args.fs,
+                              memory_budget=budget, out=OUT)
+                    t = time.time()-tic
+
+                    if out=='path':
+                        identical = isinstance(S, np.memmap) and\
+                                np.array_equal(np.load(OUT), ref)
+                        del S
+                    else:
+                        identical = np.array_equal(S, ref) and\
+                                ((out=='None') or (S is OUT))
+                    print(' - batches of %i neurons, out=%s, F: %s -> %.2fs, identical: %s' % (
+                            batch_size, out, label, t, identical))
+                    assert identical
+
+        # explicit batch size (as in suite2p)
+        assert np.array_equal(oasis(F, 7, args.tau, args.fs), ref)
@@ -0,0 +1,52 @@
+"""
+benchmark of the sliding percentile baselines (F0) of imaging.Calcium
+
+    - "sliding_percentile" -> subsampled approximation (+ smoothing)
+    - "sliding_percentile_exact" -> exact running percentile (numba)
+
+usage:
+    python tests/imaging/sliding_percentile.py --nROIs 100 --duration 3600
+"""
+import argparse, time, sys, os, pathlib
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.imaging.Calcium import compute_sliding_percentile,\
+        compute_sliding_percentile_exact, strided_app
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--nROIs", type=int, default=100)
+parser.add_argument("--duration", help="in s", type=float, default=3600)
+parser.add_argument("--freq", help="in Hz", type=float, default=30)
+parser.add_argument("--window", help="in s", type=float, default=300)
+parser.add_argument("--percentile", type=float, default=10)
+args = parser.parse_args()
+
+# 1) exactness against np.percentile on a short recording
+F = np.random.randn(3, 2000)
+Window = 101
+exact = compute_sliding_percentile_exact(F, args.percentile, Window)
+ref = np.array([np.percentile(strided_app(f, Window, 1), args.percentile, axis=-1)\
+                                    for f in F])
+print(' exact w.r.t. np.percentile: %s' %\
+        np.array_equal(exact[:,int(Window/2):int(Window/2)+ref.shape[1]], ref))
+
+# 2) benchmark on a long recording
+t = np.arange(int(args.duration*args.freq))/args.freq
+F = 1+0.2*np.sin(2*np.pi*t/1200.)+\
+        np.random.exponential(0.3, size=(args.nROIs, len(t)))
+Window = int(args.window*args.freq)
+
+compute_sliding_percentile_exact(F[:2,:2*Window], args.percentile, Window) # numba compilation
+
+tic = time.time()
+exact = compute_sliding_percentile_exact(F, args.percentile, Window)
+print(' - exact:  %.2fs' % (time.time()-tic))
+
+tic = time.time()
+approx = compute_sliding_percentile(F, args.percentile, Window)
+print(' - approx: %.2fs' % (time.time()-tic))
+
+print(' [%i ROIs x %i samples, window=%i samples] mean relative error of approx: %.2f%%' % (\
+        args.nROIs, len(t), Window, 100*np.mean(np.abs(approx-exact)/exact)))
@@ -0,0 +1,74 @@
+"""
+regression test & benchmark of the streamed phase/power maps
+
+    synthetic intrinsic imaging recordings (NWB files as written by
+    physion.intrinsic.acquisition) of a periodic stimulation with a pixel-dependent
+    phase, analyzed with:
+        - load_raw_data + perform_fft_analysis (full movie in memory)
+        - perform_streaming_fft_analysis (single frequency bin, streamed)
+
+usage:
+    python tests/intrinsic/fft.py --Nrepeat 10 --nFrames 2000 --Lx 200 --Ly 150
+"""
+import argparse, time, sys, os, pathlib, tempfile, datetime, json, tracemalloc
+import numpy as np
+import pynwb
+from dateutil.tz import tzlocal
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.intrinsic import tools
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--Nrepeat", type=int, default=10)
+parser.add_argument("--nFrames", type=int, default=2000)
+parser.add_argument("--nRecordings", type=int, default=3)
+parser.add_argument("--Lx", type=int, default=200)
+parser.add_argument("--Ly", type=int, default=150)
+parser.add_argument("--spatial_subsampling", type=int, default=0)
+args = parser.parse_args()
+
+folder = tempfile.mkdtemp()
+with open(os.path.join(folder, 'metadata.json'), 'w') as f:
+    json.dump({'Nrepeat':args.Nrepeat}, f)
+
+period, dt = 6., 0.05
+Nstim = int(period*args.Nrepeat/dt)
+phase = np.linspace(-np.pi, np.pi, args.Lx*args.Ly).reshape(args.Lx, args.Ly)
+for i in range(1, args.nRecordings+1):
+    # camera frames with a jitter, slightly shifted w.r.t. the stimulus times
+    t = np.sort(np.linspace(-0.1, Nstim*dt+0.1, args.nFrames)+\
+                            1e-3*np.random.randn(args.nFrames))
+    data = 1000+20*np.sin(2*np.pi*t[:,np.newaxis,np.newaxis]/period+phase)+\
+                    5*np.random.randn(args.nFrames, args.Lx, args.Ly)
+    nwbfile = pynwb.NWBFile('synthetic', 'intrinsic',
+                            datetime.datetime.now(tzlocal()))
+    nwbfile.add_acquisition(pynwb.TimeSeries(name='angle_timeseries',
+                                             data=np.zeros(Nstim), unit='Rd',
+                                             timestamps=np.arange(Nstim)*dt))
+    nwbfile.add_acquisition(pynwb.image.ImageSeries(name='image_timeseries',
+                                                    data=data.astype(np.uint16),
+                                                    unit='a.u.',
+                                                    timestamps=t))
+    with pynwb.NWBHDF5IO(os.path.join(folder, 'up-%i.nwb' % i), 'w') as io:
+        io.write(nwbfile)
+
+RESULTS = {}
+for method in ['full', 'streaming']:
+    tracemalloc.start()
+    tic = time.time()
+    if method=='full':
+        p, (t, data) = tools.load_raw_data(folder, 'up')
+        data = tools.resample_img(data, args.spatial_subsampling)
+        RESULTS[method] = tools.perform_fft_analysis(data, p['Nrepeat'])
+    else:
+        RESULTS[method] = tools.perform_streaming_fft_analysis(\
+                                tools.get_datafiles(folder, 'up'), args.Nrepeat,
+                                spatial_subsampling=args.spatial_subsampling)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(' - %s: %.2fs, peak memory: %.0fMB' % (method, time.time()-tic, peak/1e6))
+
+print(' - max. diff: power %.1e (relative), phase %.1e' % (\
+        np.max(np.abs(RESULTS['full'][0]-RESULTS['streaming'][0])/RESULTS['full'][0]),
+        np.max(np.abs(RESULTS['full'][1]-RESULTS['streaming'][1]))))
@@ -0,0 +1,80 @@
+"""
+regression test & benchmark of the accelerated area segmentation
+
+    synthetic retinotopic maps (mirror reversals of the azimuth and altitude
+    gradients, warped by smooth noise) segmented by RetinotopicMappingTrial
+    with and without the "accelerated" mode (morphology in bounding boxes,
+    adjacency from sparse pixel/patch products), then a parameter sweep
+    in a process pool
+
+usage:
+    python tests/intrinsic/segmentation.py --size 256 --nproc 4
+"""
+import argparse, time, sys, os, pathlib, contextlib
+import numpy as np
+import scipy.ndimage as ni
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.intrinsic import RetinotopicMapping
+from physion.intrinsic.tools import default_segmentation_params
+
+
+def synthetic_maps(L, seed=0, n=2.):
+    rng = np.random.default_rng(seed)
+    y, x = np.meshgrid(np.linspace(0, 1, L), np.linspace(0, 1, L), indexing='ij')
+    xw = x+0.08*np.sin(2*np.pi*(y+0.3))+0.05*np.sin(5*y)
+    yw = y+0.08*np.sin(2*np.pi*(x+0.1))
+    azi = 60*np.sin(2*np.pi*n*xw+0.4)*(0.6+0.4*yw)+\
+            ni.gaussian_filter(rng.normal(0, 1, (L, L)), L/30)*L/3
+    alt = 35*np.cos(2*np.pi*0.75*n*yw+0.2)+5*xw+\
+            ni.gaussian_filter(rng.normal(0, 1, (L, L)), L/30)*L/3
+    return {'altPosMap':alt, 'aziPosMap':azi,
+            'altPowerMap':np.ones((L, L)), 'aziPowerMap':np.ones((L, L)),
+            'vasculatureMap':np.ones((L, L)),
+            'mouseID':'synthetic', 'dateRecorded':'2022-01-01',
+            'params':dict(default_segmentation_params)}
+
+
+def same_patches(patches1, patches2):
+    return (list(patches1.keys())==list(patches2.keys())) and\
+        np.all([np.array_equal(patches1[k].array, patches2[k].array) and\
+                    (patches1[k].sign==patches2[k].sign) for k in patches1])
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--size", help="map size (in pixels)", type=int, default=256)
+    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument("--seeds", type=int, nargs='*', default=[0, 1])
+    args = parser.parse_args()
+
+    for seed, n in zip(args.seeds, [2., 3., 2., 3.]):
+        TRIALS = {}
+        for accelerated in [False, True]:
+            TRIALS[accelerated] = RetinotopicMapping.RetinotopicMappingTrial(\
+                    **synthetic_maps(args.size, seed, n), accelerated=accelerated)
+            tic = time.time()
+            with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+                TRIALS[accelerated].processTrial()
+            print(' - [seed=%i] %s: %.2fs' % (seed, 'accelerated' if accelerated else 'original',
+                                             time.time()-tic))
+        print(' [seed=%i] n=%i raw patches, n=%i final patches, identical: %s' % (seed,
+                len(TRIALS[True].rawPatches), len(TRIALS[True].finalPatches),
+                np.all([same_patches(getattr(TRIALS[False], key), getattr(TRIALS[True], key))\
+                        for key in ['rawPatches', 'patchesAfterSplit', 'finalPatches']])))
+
+    # parameter sweep
+    PARAMS = [{'signMapThr':thr, 'signMapFilterSigma':sigma}\
+                    for thr in [0.3, 0.5] for sigma in [1., 3., 5., 7.]]
+    RESULTS = {}
+    for nproc in [1, args.nproc]:
+        tic = time.time()
+        RESULTS[nproc] = RetinotopicMapping.processTrials(synthetic_maps(args.size), PARAMS,
+                                                          nproc=nproc)
+        print(' - sweep of n=%i parameter sets, nproc=%i: %.2fs' % (len(PARAMS), nproc,
+                                                                    time.time()-tic))
+    print(' - sweep: n=%s final patches, identical: %s' % (\
+            [len(r) for r in RESULTS[1]],
+            np.all([same_patches(r1, r2) for r1, r2 in zip(RESULTS[1], RESULTS[args.nproc])])))
@@ -0,0 +1,96 @@
+"""
+test & benchmark of the envelope pyramid of the raw data plots
+
+    on a synthetic recording with sparse transients, compares the display
+    with the envelope pyramid to the "[::subsampling]" stride:
+        - number of plotted points
+        - amplitude of the transients kept in the plotted points
+        - plotting time (zoomed-out and zoomed-in views)
+
+usage:
+    python tests/plots/envelope.py --duration 3600 --nROIs 500
+"""
+import argparse, time, sys, os, pathlib, types
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.dataviz import raw
+from physion.dataviz.envelope import EnvelopePyramid
+from physion.dataviz.raw import plt
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--duration", help="in s", type=float, default=3600)
+parser.add_argument("--nROIs", type=int, default=200)
+parser.add_argument("--CaImaging_freq", help="in Hz", type=float, default=30)
+parser.add_argument("--NIdaq_freq", help="in Hz", type=float, default=1000)
+parser.add_argument("--subsampling", type=int, default=10)
+args = parser.parse_args()
+
+# synthetic data object (only the attributes used by the plots)
+series = lambda data, rate, timestamps=None: types.SimpleNamespace(data=data,
+        rate=rate, starting_time=0., timestamps=timestamps, num_samples=data.shape[-1])
+
+nFrames = int(args.duration*args.CaImaging_freq)
+dFoF = 0.1*np.random.randn(args.nROIs, nFrames)
+for i in range(args.nROIs):
+    # single-frame transients, easily aliased by a stride
+    dFoF[i, np.random.choice(nFrames, 5)] += 5
+nSamples = int(args.duration*args.NIdaq_freq)
+photodiode = 0.01*np.random.randn(nSamples)
+photodiode[np.random.choice(nSamples, 20)] = 1
+
+data = types.SimpleNamespace(dFoF=dFoF, nROIs=args.nROIs,
+        valid_roiIndices=np.arange(args.nROIs),
+        Neuropil=series(dFoF, args.CaImaging_freq,
+                        timestamps=np.arange(nFrames)/args.CaImaging_freq),
+        nwbfile=types.SimpleNamespace(acquisition={\
+                'Photodiode-Signal':series(photodiode, args.NIdaq_freq),
+                'Running-Speed':series(photodiode[:,np.newaxis], args.NIdaq_freq)}),
+        running_speed=photodiode,
+        t_running_speed=np.arange(nSamples)/args.NIdaq_freq)
+
+# 1) the pyramid itself
+tic = time.time()
+envelope = EnvelopePyramid(dFoF, **{'timestamps':data.Neuropil.timestamps})
+print(' - pyramid of %i ROIs x %i frames built in %.2fs (%i levels)' % (args.nROIs,
+        nFrames, time.time()-tic, len(envelope.levels)))
+for tlim in [[0, args.duration], [10, 20]]:
+    t, y = envelope.query(*tlim, 800)
+    i1, i2 = envelope.indices(*tlim)
+    print(' - window %s: %i points per ROI, transients kept: %s, extrema identical: %s' % (
+            tlim, len(t), np.array_equal(y.max(axis=1), dFoF[:,i1:i2].max(axis=1)),
+            np.allclose(y.min(axis=1), dFoF[:,i1:i2].min(axis=1)) or\
+                    (len(t)>i2-i1))) # edge blocks can go beyond the window
+    print('   within the window: %s' % ((t.min()>=tlim[0]) and (t.max()<=tlim[1])))
+
+# 2) the plots
+settings = lambda envelope: {\
+        'Photodiode':dict(fig_fraction=.5, subsampling=args.subsampling,
+                          envelope=envelope),
+        'Locomotion':dict(fig_fraction=1, subsampling=args.subsampling,
+                          envelope=envelope),
+        'CaImaging':dict(fig_fraction=3, subsampling=args.subsampling,
+                         subquantity='dFoF', roiIndices=np.arange(5),
+                         annotation_side='', envelope=envelope),
+        'CaImagingRaster':dict(fig_fraction=4, subsampling=args.subsampling,
+                               roiIndices='all', normalization='per-line',
+                               subquantity='dFoF', name='', envelope=envelope)}
+
+raw.pt.inset = lambda ax, rect, **kwargs: ax.inset_axes(rect)
+for tlim in [[0, args.duration], [100, 130]]:
+    for envelope in [False, True, True]: # 2nd envelope call: cached pyramids
+        tic = time.time()
+        fig, ax = raw.plot(data, tlim, settings=settings(envelope))
+        fig.canvas.draw()
+        nPoints = np.sum([len(l.get_xdata()) for l in ax.get_lines()])
+        raster = ax.get_images()[0].get_array()
+        print(' - window %s, %s: %.2fs, n=%i plotted points, raster %s' % (\
+                tlim, 'envelope' if envelope else 'stride', time.time()-tic,
+                nPoints, raster.shape))
+        if tlim[0]==0:
+            print('   ROIs with their maximum in the raster: %.0f%%' % (\
+                    100*np.mean(np.max(raster, axis=1)==1)))
+        plt.close(fig)
@@ -0,0 +1,64 @@
+"""
+regression test & benchmark of the batch pupil tracking
+
+    compares "perform_batch" (process pool over frame shards)
+    to the frame-by-frame "perform_loop" on a synthetic FaceCamera recording
+
+usage:
+    python tests/pupil/batch.py --nFrames 1000 --nproc 4
+"""
+import argparse, time, sys, os, pathlib, tempfile
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.pupil import process
+from physion.utils.camera import CameraData
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFrames", type=int, default=300)
+    parser.add_argument("--nproc", type=int, default=2)
+    parser.add_argument('-s', "--subsampling", type=int, default=1)
+    args = parser.parse_args()
+
+    # synthetic recording: a dark moving ellipse on a noisy background
+    folder = tempfile.mkdtemp()
+    os.mkdir(os.path.join(folder, 'FaceCamera-imgs'))
+    np.save(os.path.join(folder, 'NIdaq.start.npy'), [0.])
+    Lx, Ly = 320, 240
+    x, y = np.meshgrid(np.arange(Lx), np.arange(Ly), indexing='ij')
+    for i in range(args.nFrames):
+        s = 40+10*np.sin(i/13.)
+        img = 200-150*process.inside_ellipse_cond(x, y,
+                                                  160+10*np.sin(i/10.),
+                                                  120+6*np.cos(i/7.),
+                                                  s, 0.8*s, 0.3)
+        img = np.uint8(np.clip(img+np.random.normal(0, 10, (Lx,Ly)), 0, 255))
+        np.save(os.path.join(folder, 'FaceCamera-imgs', '%.4f.npy' % (i/30.)), img.T)
+
+    config = {'ROIellipse':(160, 120, 140, 120, 0.1),
+              'ROIsaturation':100,
+              'gaussian_smoothing':1,
+              'reflectors':[(60, 60, 12, 12, 0)],
+              'blanks':[(10, 10, 8, 8, 0)]}
+
+    camData = CameraData('FaceCamera', folder=folder, verbose=False)
+
+    tic = time.time()
+    loop = process.perform_loop(process.init_batch_fit(camData, config),
+                                subsampling=args.subsampling,
+                                gaussian_smoothing=config['gaussian_smoothing'],
+                                saturation=config['ROIsaturation'],
+                                reflectors=config['reflectors'])
+    print(' - loop:  %.2fs' % (time.time()-tic))
+
+    tic = time.time()
+    batch = process.perform_batch(camData, config,
+                                  subsampling=args.subsampling,
+                                  nproc=args.nproc)
+    print(' - batch: %.2fs (nproc=%i)' % (time.time()-tic, args.nproc))
+
+    for key in ['frame', 'cx', 'cy', 'sx', 'sy', 'angle', 'residual']:
+        print(' %s identical: %s' % (key, np.array_equal(loop[key], batch[key])))
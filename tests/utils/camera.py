@@ -0,0 +1,103 @@
+"""
+regression test of the frame access of utils.camera.CameraData
+
+    the accessors (get, get_block, camData[int], camData[slice],
+    camData[array_of_indices]) are compared to the former per-frame
+    loading of the *.npy files:
+        - from the folder of single frames (stacked "get")
+        - from the memory-mapped binary file ("convert_to_binary")
+        - from a binary file shorter than its summary (interrupted
+            conversion/copy): frames and timestamps truncated
+
+usage:
+    python tests/utils/camera.py --nFrames 200 --Lx 80 --Ly 60
+"""
+import argparse, sys, os, pathlib, tempfile, io, contextlib
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.utils.camera import CameraData
+
+
+def former_frames(folder, indices):
+    """ [former loading: one *.npy file per frame] """
+    FILES = sorted(os.listdir(os.path.join(folder, 'FaceCamera-imgs')),
+                   key=lambda f: float(f.replace('.npy', '')))
+    return np.array([np.load(os.path.join(folder, 'FaceCamera-imgs', FILES[i])).T\
+                            for i in indices])
+
+
+def check_accessors(camData, folder, nFrames):
+    """ same frames as the former loading for all the accessors """
+    checks = {}
+    checks['get'] = np.all([np.array_equal(camData.get(i), former_frames(folder, [i])[0])\
+                                for i in [0, 1, nFrames//2, nFrames-1]])
+    checks['get_block'] = np.all([\
+            np.array_equal(camData.get_block(i0, i1), former_frames(folder, range(i0, min([i1, nFrames]))))\
+                for i0, i1 in [(0, 10), (nFrames//3, nFrames//2), (nFrames-5, nFrames+5)]]) and\
+                    (len(camData.get_block(4, 4))==0)
+    checks['int'] = np.all([np.array_equal(camData[i], former_frames(folder, [i%nFrames])[0])\
+                                for i in [0, nFrames-1, np.int64(7), -1]])
+    checks['slice'] = np.all([np.array_equal(camData[key], former_frames(folder, np.arange(nFrames)[key]))\
+                for key in [slice(None), slice(3, 40, 7), slice(None, None, -5), slice(-10, None)]])
+    checks['array'] = np.all([np.array_equal(camData[key], former_frames(folder, np.arange(nFrames)[key]))\
+                for key in [np.array([5, 2, 2, nFrames-1]), [0, 3], np.arange(nFrames)%4==0]])
+    return {k:bool(v) for k, v in checks.items()}
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFrames", type=int, default=200)
+    parser.add_argument("--Lx", type=int, default=80)
+    parser.add_argument("--Ly", type=int, default=60)
+    args = parser.parse_args()
+
+    for dtype in [np.uint8, np.uint16]:
+
+        folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(folder, 'FaceCamera-imgs'))
+        t0 = 1000.
+        np.save(os.path.join(folder, 'NIdaq.start.npy'), [t0])
+        for i in range(args.nFrames):
+            img = np.random.randint(0, np.iinfo(dtype).max, size=(args.Ly, args.Lx), dtype=dtype)
+            np.save(os.path.join(folder, 'FaceCamera-imgs', '%.4f.npy' % (t0+i/30.)), img)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            camData = CameraData('FaceCamera', folder=folder, verbose=False)
+        checks = check_accessors(camData, folder, args.nFrames)
+        print(' - %s, from the *.npy frames, identical: %s' % (np.dtype(dtype), checks))
+        assert np.all(list(checks.values()))
+        times = np.array(camData.times)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            camData.convert_to_binary()
+            binData = CameraData('FaceCamera', folder=folder, verbose=False)
+        checks = check_accessors(binData, folder, args.nFrames)
+        print(' - %s, from the binary file (memmap: %s), identical: %s' % (np.dtype(dtype),
+                isinstance(binData.frames, np.memmap), checks))
+        assert isinstance(binData.frames, np.memmap) and np.all(list(checks.values()))
+        assert np.array_equal(binData.times, times) and\
+                np.array_equal(binData.original_times, times)
+        del binData
+
+        # truncated binary: nTrunc frames and a half
+        nTrunc = args.nFrames//3
+        frame_size = args.Lx*args.Ly*np.dtype(dtype).itemsize
+        with open(os.path.join(folder, 'FaceCamera.bin'), 'r+b') as f:
+            f.truncate(nTrunc*frame_size+frame_size//2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            binData = CameraData('FaceCamera', folder=folder, verbose=False)
+        checks = check_accessors(binData, folder, nTrunc)
+        lengths = [binData.nFrames, len(binData), len(binData.times),
+                   len(binData.original_times), len(binData.relative_times),
+                   len(binData.frames)]
+        print(' - %s, truncated binary (%i frames), lengths: %s, identical: %s' % (
+                np.dtype(dtype), nTrunc, lengths, checks))
+        print('   truncation reported: %s' % ('%i frames in binary file' % nTrunc in output.getvalue()))
+        assert np.all(list(checks.values())) and lengths==[nTrunc]*6
+        assert np.array_equal(binData.original_times, times[:nTrunc]) and\
+                np.allclose(binData.relative_times, times[:nTrunc]-t0)
+        del binData
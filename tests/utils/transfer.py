@@ -0,0 +1,119 @@
+"""
+test of the transfer engine between two local temporary folders
+
+    - the manifest selects the same files than shutil.copytree for the TYPES
+    - a transfer killed in the middle is resumed (the complete files are skipped)
+    - a destination file corrupted with unchanged size and mtime is copied again
+    - the transferred files have the checksums of the source files
+
+usage:
+    python tests/utils/transfer.py --nFiles 20 --size 20
+"""
+import argparse, time, sys, os, pathlib, tempfile, shutil, multiprocessing
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.utils.transfer.types import TYPES
+from physion.utils.transfer.engine import build_manifest, transfer, file_checksum
+
+
+def tree(folder):
+    """ relative paths of the files (reports excluded) """
+    return sorted([os.path.relpath(os.path.join(root, f), folder)\
+                        for root, _, files in os.walk(folder) for f in files\
+                            if '.transfer-reports' not in root])
+
+
+def run_transfer(source, destination, folders, nthreads):
+    # to be killed
+    transfer(source, destination, ignore=TYPES['all'], folders=folders,
+             nthreads=nthreads, verbose=False)
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--nFiles", help="large files per session", type=int, default=10)
+    parser.add_argument("--size", help="of the large files, in MB", type=float, default=20)
+    parser.add_argument("--nthreads", type=int, default=4)
+    args = parser.parse_args()
+
+    # synthetic sessions
+    source = tempfile.mkdtemp()
+    for session in ['2024_01_01/12-00-00', '2024_01_01/14-00-00']:
+        folder = os.path.join(source, session)
+        for sub in ['TSeries-001/suite2p/plane0', 'FaceCamera-imgs']:
+            os.makedirs(os.path.join(folder, sub))
+        for i in range(args.nFiles):
+            with open(os.path.join(folder, 'TSeries-001', 'data%i.bin' % i), 'wb') as f:
+                f.write(np.random.bytes(int(args.size*1e6)))
+            np.save(os.path.join(folder, 'FaceCamera-imgs', '%i.npy' % i), np.zeros(100))
+            with open(os.path.join(folder, 'TSeries-001', 'frame%06d.ome.tif' % i), 'wb') as f:
+                f.write(np.random.bytes(1000))
+        for f in ['NIdaq.npy', 'TSeries-001/suite2p/plane0/ops.npy']:
+            np.save(os.path.join(folder, f), np.arange(1000))
+        for f in ['metadata.json', 'TSeries-001/TSeries-001.xml', '.hidden']:
+            with open(os.path.join(folder, f), 'w') as fh:
+                fh.write('{}')
+    with open(os.path.join(source, 'session.nwb'), 'w') as f:
+        f.write('nwb')
+    folders = ['2024_01_01']
+
+    # 1) same selection than shutil.copytree
+    for Type in TYPES:
+        destination = tempfile.mkdtemp()
+        for f in folders:
+            shutil.copytree(os.path.join(source, f), os.path.join(destination, f),
+                            dirs_exist_ok=True, ignore=TYPES[Type])
+        _, FILES = build_manifest(source, ignore=TYPES[Type], folders=folders)
+        print(' - type "%s": %i files, same as shutil.copytree: %s' % (Type,
+                len(FILES), sorted([f['path'] for f in FILES])==tree(destination)))
+
+    # 2) killed transfer
+    destination = tempfile.mkdtemp()
+    process = multiprocessing.get_context('spawn').Process(target=run_transfer,
+                    args=(source, destination, folders, args.nthreads))
+    process.start()
+    while len([f for f in tree(destination) if f.endswith('.bin')])<args.nFiles/2:
+        time.sleep(0.01)
+    process.kill()
+    process.join()
+    print(' - killed transfer: %i complete files, %i ".part" files' % (\
+            len([f for f in tree(destination) if not f.endswith('.part')]),
+            len([f for f in tree(destination) if f.endswith('.part')])))
+
+    tic = time.time()
+    RESULTS = transfer(source, destination, ignore=TYPES['all'], folders=folders,
+                       nthreads=args.nthreads, verbose=False)
+    print(' - resumed in %.1fs: n=%i copied, n=%i skipped, n=%i failed' % (\
+            time.time()-tic, *[len([r for r in RESULTS if r['status']==s])\
+                                    for s in ['copied', 'skipped', 'failed']]))
+
+    # 3) corrupted file with the same size and mtime
+    filename = os.path.join(destination, '2024_01_01', '12-00-00', 'TSeries-001', 'data0.bin')
+    stat = os.stat(filename)
+    with open(filename, 'r+b') as f:
+        f.write(b'corrupted')
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    RESULTS = transfer(source, destination, ignore=TYPES['all'], folders=folders,
+                       nthreads=args.nthreads, verbose=False)
+    print(' - corrupted file copied again: %s (n=%i skipped)' % (\
+            [r['path'] for r in RESULTS if r['status']=='copied'],
+            len([r for r in RESULTS if r['status']=='skipped'])))
+
+    # 4) verification
+    _, FILES = build_manifest(source, ignore=TYPES['all'], folders=folders)
+    print(' - same files: %s, same checksums: %s, reports: %s' % (\
+            sorted([f['path'] for f in FILES])==tree(destination),
+            np.all([file_checksum(os.path.join(source, f['path']))==\
+                        file_checksum(os.path.join(destination, f['path'])) for f in FILES]),
+            os.listdir(os.path.join(destination, '.transfer-reports'))))
+
+    # 5) timing
+    for nthreads in [1, args.nthreads]:
+        destination = tempfile.mkdtemp()
+        tic = time.time()
+        transfer(source, destination, ignore=TYPES['all'], folders=folders,
+                 nthreads=nthreads, verbose=False)
+        print(' - nthreads=%i: %.1fs' % (nthreads, time.time()-tic))
@@ -0,0 +1,95 @@
+"""
+regression test & benchmark of the movie building of visual_stim/build.py
+
+    compares the frames of "build_movie" (cache of static frames, 
+    parallel rendering of chunks) to the former frame-by-frame loop,
+    also with a frame cache bounded to a few frames (evictions)
+
+usage:
+    python tests/visual_stim/build.py --nproc 4 --Screen Dell-2020
+"""
+import argparse, time, sys, os, pathlib, tempfile
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+import physion
+from physion.visual_stim import build
+
+class VideoRecorder:
+    """ replaces cv.VideoWriter: keeps the frames in memory """
+    def __init__(self, *args):
+        self.frames = []
+        RECORDERS.append(self)
+    def write(self, frame):
+        self.frames.append(np.array(frame))
+    def release(self):
+        pass
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--Screen", default='Dell-2020-low-resolution')
+    parser.add_argument("--nproc", type=int, default=2)
+    parser.add_argument("--N_repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # gratings: 2 static and 2 drifting, with repeats 
+    protocol = build.get_default_params('grating')
+    protocol.update({'Presentation':'Randomized-Sequence', 'Screen':args.Screen,
+                     'presentation-duration':1., 'N-repeat':args.N_repeat,
+                     'angle-1':0, 'angle-2':90, 'N-angle':2,
+                     'speed-1':0, 'speed-2':2, 'N-speed':2,
+                     'demo':False})
+    Stim = build.build_stim(protocol)
+    folder = tempfile.mkdtemp()
+
+    RECORDERS = []
+    build.cv.VideoWriter = VideoRecorder
+
+    # former loop: all frames rendered (own time loop, not "movie_timeline")
+    tic = time.time()
+    square = build.MonitoringSquare(Stim)
+    former = []
+    t, tend = 0, Stim.experiment['time_stop'][-1]+Stim.experiment['interstim'][-1]
+    index = 0
+    tstart, tstop = Stim.experiment['time_start'][0], Stim.experiment['time_stop'][0]
+    while t<tend:
+        if t>=tstop:
+            index += 1
+            if index<len(Stim.experiment['index']):
+                tstart = Stim.experiment['time_start'][index]
+                tstop = Stim.experiment['time_stop'][index]
+            else:
+                tstart, tstop = np.inf, np.inf
+        if (t>=tstart) and (t<tstop):
+            data = Stim.gamma_correction(Stim.get_image(index, t-tstart))
+        else:
+            data = Stim.blank_color+Stim.get_null_image()
+        data = square.draw(data, t, tstart, tstop)
+        former.append(np.array(255*np.rot90(data, k=1), dtype='uint8'))
+        t+= 1./Stim.movie_refresh_freq
+    print(' - former loop: %.1fs' % (time.time()-tic))
+
+    frame_bytes = former[0].nbytes
+    for nproc, max_frames in zip([1, args.nproc, 1], [None, None, 3]):
+        if max_frames is not None:
+            # bounded cache (only in this process -> nproc=1)
+            build.FRAME_CACHE_BYTES = max_frames*frame_bytes
+        tic = time.time()
+        build.build_movie(Stim, folder, nproc=nproc, chunk_duration=2.)
+        print(' - build_movie (nproc=%i, cache: %s): %.1fs' % (nproc,
+                '%i frames' % max_frames if max_frames else 'default', time.time()-tic))
+        print(' n=%i frames, identical: %s' % (len(former),
+                (len(RECORDERS[-1].frames)==len(former)) and\
+                    np.all([np.array_equal(f1, f2) for f1, f2 in\
+                                    zip(RECORDERS[-1].frames, former)])))
+
+    # eviction: bounded memory, blank frames kept
+    cache = build.FrameCache(max_bytes=3*frame_bytes)
+    cache[('blank', -1.)] = [former[0]]
+    for i in range(10):
+        cache[('episode-%i' % i, -1.)] = [former[0].copy()]
+    print(' - bounded cache: n=%i frames, %i bytes <= %i: %s, blank kept: %s' % (
+            len(cache), cache.nbytes, cache.max_bytes, cache.nbytes<=cache.max_bytes,
+            ('blank', -1.) in cache))
@@ -0,0 +1,70 @@
+"""
+regression test & benchmark of the geometry cache of visual_stim.main
+
+    compares the drawing functions (cached planes, bounding boxes)
+    to their former full-screen versions, and times "get_image"
+
+usage:
+    python tests/visual_stim/geometry.py --Screen Dell-2020
+"""
+import argparse, time, sys, os, pathlib
+import numpy as np
+
+sys.path.append(os.path.join(pathlib.Path(__file__).resolve().parents[2], 'src'))
+
+from physion.visual_stim.build import build_stim, get_default_params
+
+# former full-screen versions
+def add_grating_patch(self, image, angle=0, radius=10, spatial_freq=0.1,
+                      contrast=1., phase_shift_Deg=0., time_phase=0.,
+                      xcenter=0, zcenter=0):
+    xrot = (self.x-xcenter)*np.cos(angle/180.*np.pi)+\
+                (self.z-zcenter)*np.sin(angle/180.*np.pi)
+    cond = ((self.x-xcenter)**2+(self.z-zcenter)**2)<radius**2
+    full_grating = self.compute_grating(xrot, spatial_freq=spatial_freq,
+                                        time_phase=time_phase,
+                                        phase_shift_Deg=phase_shift_Deg)-0.5
+    image[cond] += contrast*full_grating[cond] 
+
+def add_dot(self, image, pos, size, color, type='square'):
+    if type=='square':
+        cond = (self.x>(pos[0]-size/2)) & (self.x<(pos[0]+size/2)) &\
+                (self.z>(pos[1]-size/2)) & (self.z<(pos[1]+size/2))
+    else:
+        cond = np.sqrt((self.x-pos[0])**2+(self.z-pos[1])**2)<size
+    image[cond] = color
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--Screen", default='Dell-2020')
+    parser.add_argument("--units", default='cm')
+    parser.add_argument("--nFrames", type=int, default=30)
+    args = parser.parse_args()
+
+    for protocol_name, params in zip(['grating', 'grating', 'sparse-noise', 'random-dots'],
+                                     [{}, {'speed':2., 'radius':30., 'x-center':10.},
+                                      {'screen-width':100, 'screen-height':60,
+                                       'sparseness':5, 'black-white-ratio':50}, {}]):
+        protocol = get_default_params(protocol_name)
+        protocol.update(params)
+        protocol['Screen'], protocol['units'] = args.Screen, args.units
+        stim = build_stim(protocol)
+
+        TIMES = np.linspace(0, 2, args.nFrames)
+        tic = time.time()
+        new = [stim.get_image(0, t) for t in TIMES]
+        tnew = time.time()-tic
+
+        # same stimulus with the former drawing functions
+        stim.add_grating_patch = lambda *a, **k: add_grating_patch(stim, *a, **k)
+        stim.add_dot = lambda *a, **k: add_dot(stim, *a, **k)
+        tic = time.time()
+        former = [stim.get_image(0, t) for t in TIMES]
+        tformer = time.time()-tic
+
+        print(' - %s %s: %.1fms -> %.1fms per frame, max. diff: %.1e, identical uint8 frames: %s' % (\
+                protocol_name, params, 1e3*tformer/len(TIMES), 1e3*tnew/len(TIMES),
+                np.max(np.abs(np.array(new)-np.array(former))),
+                np.array_equal(np.array(255*np.array(new), dtype='uint8'),
+                               np.array(255*np.array(former), dtype='uint8'))))